@@ -0,0 +1,79 @@
+"""
+Logging throughput of a LogglyHandler as more threads log at once, with
+emit() called under the handler lock, as logging.Handler.handle() does, and
+without it, as the handler does now.
+
+    python -m benchmarks.bench_contention [records per thread]
+"""
+from __future__ import print_function
+
+import logging
+import sys
+import threading
+import time
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from restapi_logging_handler import LogglyHandler
+
+THREADS = (1, 2, 4, 8, 16, 32)
+
+
+class LockedLogglyHandler(LogglyHandler):
+    handle = logging.Handler.handle
+
+
+def records_per_second(handler, threads, number):
+    # no timed flushes, so every record is still in the buffer at the end
+    handler.timer.set()
+    log = logging.getLogger('bench.contention')
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    log.addHandler(handler)
+    extra = {'user': 'u-1', 'request_id': 12345, 'path': '/a/b/c'}
+    start = threading.Event()
+
+    def run():
+        start.wait()
+        for i in range(number):
+            log.info('message %s', i, extra=extra)
+
+    workers = [threading.Thread(target=run) for i in range(threads)]
+    for w in workers:
+        w.start()
+    try:
+        began = time.time()
+        start.set()
+        for w in workers:
+            w.join()
+        elapsed = time.time() - began
+    finally:
+        log.removeHandler(handler)
+
+    with handler.batch_lock:
+        sent = len(handler.logs)
+    if sent != threads * number:
+        raise AssertionError(
+            'lost records: {} of {}'.format(sent, threads * number))
+    return threads * number / elapsed
+
+
+def main(number=2000):
+    with patch('restapi_logging_handler.restapi_logging_handler'
+               '.FuturesSession'):
+        print('{:>8} {:>14} {:>14}'.format(
+            'threads', 'locked rec/s', 'unlocked rec/s'))
+        for threads in THREADS:
+            locked = records_per_second(
+                LockedLogglyHandler('TOKEN', 'bench'), threads, number)
+            unlocked = records_per_second(
+                LogglyHandler('TOKEN', 'bench'), threads, number)
+            print('{:>8} {:>14.0f} {:>14.0f}'.format(
+                threads, locked, unlocked))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,90 @@
+"""
+Time spent in the logging call on the caller's thread, with payloads built
+inline and with deferred=True. Deferred handlers are timed twice: with the
+worker held back until the logging calls are done, which is the cost of
+emit() itself, and with the worker running, which adds its share of the GIL.
+
+    python -m benchmarks.bench_emit [records]
+"""
+from __future__ import print_function
+
+import logging
+import sys
+import threading
+import time
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from restapi_logging_handler import LogglyHandler, RestApiHandler
+
+
+def hold_worker(handler):
+    release = threading.Event()
+    emit_now = handler._emitNow
+
+    def held(record):
+        release.wait()
+        emit_now(record)
+
+    handler._emitNow = held
+    return release
+
+
+def emit_us(handler, number, exc, hold=False):
+    release = hold_worker(handler) if hold else None
+    log = logging.getLogger('bench.emit')
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    log.addHandler(handler)
+    extra = {'user': 'u-1', 'request_id': 12345, 'path': '/a/b/c'}
+    try:
+        start = time.time()
+        for i in range(number):
+            if exc:
+                try:
+                    raise ValueError(i)
+                except ValueError:
+                    log.exception('failed %s', i, extra=extra)
+            else:
+                log.info('message %s', i, extra=extra)
+        elapsed = time.time() - start
+        if release is not None:
+            release.set()
+        handler.flush()
+    finally:
+        log.removeHandler(handler)
+    return elapsed / number * 1e6
+
+
+def main(number=5000):
+    with patch('restapi_logging_handler.restapi_logging_handler'
+               '.FuturesSession'):
+        handlers = {
+            'RestApiHandler': lambda **kw: RestApiHandler(
+                'http://localhost/', batch_size=500, **kw),
+            'LogglyHandler': lambda **kw: LogglyHandler(
+                'TOKEN', 'bench', **kw),
+        }
+        print('{:<16} {:<10} {:>10} {:>12} {:>12}'.format(
+            'handler', 'record', 'inline us', 'deferred us', 'worker on us'))
+        for exc in (False, True):
+            base = emit_us(logging.NullHandler(), number, exc)
+            print('{:<16} {:<10} {:>10.2f}'.format(
+                'NullHandler', 'exception' if exc else 'info', base))
+        for name, make in handlers.items():
+            for exc in (False, True):
+                inline = emit_us(make(), number, exc)
+                held = emit_us(make(deferred=True, max_queue=number),
+                               number, exc, hold=True)
+                running = emit_us(make(deferred=True, max_queue=number),
+                                  number, exc)
+                print('{:<16} {:<10} {:>10.2f} {:>12.2f} {:>12.2f}'.format(
+                    name, 'exception' if exc else 'info', inline, held,
+                    running))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,86 @@
+"""
+Per-record cost of RestApiHandler._getPayload, against the three-pass,
+record-mutating version it replaced.
+
+    python -m benchmarks.bench_payload [records]
+"""
+from __future__ import print_function
+
+import logging
+import sys
+import timeit
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from restapi_logging_handler.restapi_logging_handler import (
+    META_KEYS,
+    TOP_KEYS,
+    RestApiHandler,
+    simple_json,
+)
+
+
+def legacy_get_payload(handler, record):
+    d = record.__dict__
+    pid = d.pop('process', 'nopid')
+    tid = d.pop('thread', 'notid')
+
+    payload = {k: v for (k, v) in d.items() if k in TOP_KEYS}
+    payload['meta'] = {k: v for (k, v) in d.items() if k in META_KEYS}
+    payload['details'] = {
+        k: simple_json(v) for (k, v) in d.items()
+        if k not in handler.detail_ignore_set
+    }
+    payload['log'] = payload.pop('name', 'n/a')
+    payload['level'] = payload.pop('levelname', 'n/a')
+    payload['meta']['line'] = payload['meta'].pop('lineno', 'n/a')
+    payload['message'] = record.getMessage()
+    payload['pid'] = 'p-{}'.format(pid)
+    payload['tid'] = 't-{}'.format(tid)
+    return payload
+
+
+def make_record(extra):
+    record = logging.LogRecord(
+        'bench', logging.INFO, __file__, 10, 'message %s', ('arg',), None)
+    record.__dict__.update(extra)
+    return record
+
+
+def per_record_us(fn, handler, template, number):
+    # the legacy version pops keys, so every run gets a fresh copy
+    def copy():
+        return logging.makeLogRecord(dict(template.__dict__))
+
+    base = min(timeit.repeat(copy, number=number, repeat=5))
+    total = min(timeit.repeat(lambda: fn(handler, copy()),
+                              number=number, repeat=5))
+    return (total - base) / number * 1e6
+
+
+def main(number=20000):
+    with patch('restapi_logging_handler.restapi_logging_handler'
+               '.FuturesSession'):
+        handler = RestApiHandler('http://localhost/')
+
+    shapes = {
+        'no extra': {},
+        '3 extra': {'user': 'u-1', 'request_id': 12345, 'ok': True},
+        '10 extra': {'key{}'.format(i): i for i in range(10)},
+    }
+    print('{:<10} {:>12} {:>12} {:>8}'.format(
+        'extra', 'before us', 'after us', 'speedup'))
+    for name, extra in shapes.items():
+        record = make_record(extra)
+        before = per_record_us(legacy_get_payload, handler, record, number)
+        after = per_record_us(RestApiHandler._getPayload, handler, record,
+                              number)
+        print('{:<10} {:>12.2f} {:>12.2f} {:>7.2f}x'.format(
+            name, before, after, before / after))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
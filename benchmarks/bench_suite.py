@@ -0,0 +1,253 @@
+"""
+RestApiHandler and LogglyHandler posting to a local stub server, across
+message sizes, logging threads and shapes of extra. Each case reports the
+emit() latency percentiles on the logging threads, records per second until
+the server has them all, bytes on the wire per record, CPU seconds per 10k
+records (the stub server's own left out) and the peak memory traced while
+logging, which is measured in a second run as tracing slows everything.
+
+Results are written as JSON, and a previous file given with --compare is
+printed side by side with them.
+
+    python -m benchmarks.bench_suite --output results.json
+    python -m benchmarks.bench_suite --quick --compare results.json
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import threading
+import time
+
+try:
+    import tracemalloc
+    from time import process_time
+except ImportError:  # python 2
+    tracemalloc = None
+    from time import clock as process_time
+
+from benchmarks.stub_server import StubServer
+from restapi_logging_handler import LogglyHandler, RestApiHandler
+from restapi_logging_handler.metrics import clock
+
+SIZES = (64, 1024, 16384)
+THREADS = (1, 4, 16)
+SHAPES = {
+    'none': {},
+    'flat': {'user': 'u-1', 'request_id': 12345, 'path': '/a/b/c',
+             'ok': True, 'elapsed': 0.25},
+    'nested': {'request': {'method': 'GET', 'path': '/a/b/c',
+                           'headers': {'accept': '*/*', 'x-id': 'abc'}},
+               'user': {'id': 1, 'roles': ['admin', 'dev']},
+               'timings': [0.1, 0.2, 0.3]},
+}
+
+# numbers compared by --compare, and which way is better
+COMPARED = (
+    ('p50_us', 'lower'),
+    ('p99_us', 'lower'),
+    ('records_per_second', 'higher'),
+    ('bytes_per_record', 'lower'),
+    ('cpu_per_10k', 'lower'),
+    ('peak_kib', 'lower'),
+)
+
+
+def stub_loggly(url):
+    class StubLogglyHandler(LogglyHandler):
+        def _getEndpoint(self, add_tags=None):
+            return '{}bulk/TOKEN/tag/{}/'.format(
+                url, self._implodeTags(add_tags=add_tags))
+
+    return StubLogglyHandler
+
+
+def make_handler(name, url, compression):
+    if name == 'RestApiHandler':
+        return RestApiHandler(url, batch_size=500, compression=compression)
+    return stub_loggly(url)('TOKEN', 'bench', compression=compression)
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def log_records(handler, threads, number, message, extra):
+    """
+    Log number records on each of threads threads.
+
+    returns: seconds each logging call took, and when they began
+    """
+    log = logging.getLogger('bench.suite')
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    log.addHandler(handler)
+    start = threading.Event()
+    latencies = []
+
+    def run():
+        timings = [0.0] * number
+        start.wait()
+        for i in range(number):
+            began = clock()
+            log.info(message, extra=extra)
+            timings[i] = clock() - began
+        latencies.extend(timings)
+
+    workers = [threading.Thread(target=run) for i in range(threads)]
+    for w in workers:
+        w.start()
+    began = time.time()
+    try:
+        start.set()
+        for w in workers:
+            w.join()
+    finally:
+        log.removeHandler(handler)
+    return latencies, began
+
+
+def run_case(server, name, size, threads, shape, number, compression):
+    total = threads * number
+    message = 'x' * size
+    extra = SHAPES[shape]
+
+    server.reset()
+    handler = make_handler(name, server.url, compression)
+    cpu = process_time()
+    latencies, began = log_records(handler, threads, number, message, extra)
+    handler.flush()
+    if not server.wait_for(total):
+        raise AssertionError('{} lost records: {} of {}'.format(
+            name, server.records, total))
+    elapsed = time.time() - began
+    cpu = process_time() - cpu - server.cpu
+    handler.close()
+
+    latencies.sort()
+    result = {
+        'handler': name,
+        'message_bytes': size,
+        'threads': threads,
+        'extra': shape,
+        'records': total,
+        'requests': server.requests,
+        'p50_us': percentile(latencies, 0.5) * 1e6,
+        'p99_us': percentile(latencies, 0.99) * 1e6,
+        'records_per_second': total / elapsed,
+        'bytes_per_record': float(server.bytes) / total,
+        'cpu_per_10k': cpu / total * 10000,
+        'peak_kib': None,
+    }
+
+    if tracemalloc is not None:
+        server.reset()
+        handler = make_handler(name, server.url, compression)
+        tracemalloc.start()
+        try:
+            log_records(handler, threads, number, message, extra)
+            handler.flush()
+            server.wait_for(total)
+            result['peak_kib'] = tracemalloc.get_traced_memory()[1] / 1024.0
+        finally:
+            tracemalloc.stop()
+            handler.close()
+    return result
+
+
+def key(result):
+    return (result['handler'], result['message_bytes'], result['threads'],
+            result['extra'])
+
+
+def compare(results, previous):
+    before = {key(r): r for r in previous['results']}
+    print('{:<16} {:>6} {:>4} {:<7} {:<18} {:>12} {:>12} {:>8}'.format(
+        'handler', 'bytes', 'thr', 'extra', 'metric', 'before', 'after',
+        'change'))
+    for result in results:
+        old = before.get(key(result))
+        if old is None:
+            continue
+        for metric, better in COMPARED:
+            a, b = old.get(metric), result.get(metric)
+            if not a or b is None:
+                continue
+            change = (b - a) / a * 100
+            worse = change > 0 if better == 'lower' else change < 0
+            print('{:<16} {:>6} {:>4} {:<7} {:<18} {:>12.2f} {:>12.2f} '
+                  '{:>+7.1f}%{}'.format(
+                      result['handler'], result['message_bytes'],
+                      result['threads'], result['extra'], metric, a, b,
+                      change, ' worse' if worse else ''))
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the handlers against a local stub server.')
+    parser.add_argument('--records', type=int, default=2000,
+                        help='records logged per thread in each case')
+    parser.add_argument('--handlers', nargs='+',
+                        default=['RestApiHandler', 'LogglyHandler'],
+                        choices=['RestApiHandler', 'LogglyHandler'])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='message sizes in bytes')
+    parser.add_argument('--threads', type=int, nargs='+', default=THREADS,
+                        help='logging thread counts')
+    parser.add_argument('--extra', nargs='+', default=sorted(SHAPES),
+                        choices=sorted(SHAPES), help='shapes of extra')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'])
+    parser.add_argument('--quick', action='store_true',
+                        help='one size, thread count and shape, 500 records')
+    parser.add_argument('--output', help='file to write the JSON results to, '
+                                         'stdout if not given')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    return parser
+
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    if args.quick:
+        args.records = 500
+        args.sizes, args.threads, args.extra = [SIZES[1]], [4], ['flat']
+
+    server = StubServer().start()
+    results = []
+    try:
+        for name in args.handlers:
+            for size in args.sizes:
+                for threads in args.threads:
+                    for shape in args.extra:
+                        results.append(run_case(
+                            server, name, size, threads, shape,
+                            args.records, args.compression))
+                        print('done {}'.format(key(results[-1])),
+                              file=sys.stderr)
+    finally:
+        server.stop()
+
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'compression': args.compression,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    elif not args.compare:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+An in-process HTTP server standing in for a log ingestion endpoint: it
+answers every POST with 200 and counts the requests, body bytes and records
+it got, one record per line of the decompressed body.
+"""
+from __future__ import absolute_import
+
+import gzip
+import io
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+try:
+    from time import thread_time
+except ImportError:  # before python 3.7
+    thread_time = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def decode_body(body, encoding):
+    if encoding == 'gzip':
+        return gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    return body
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep connections open between posts
+
+    def do_POST(self):
+        began = thread_time() if thread_time is not None else 0.0
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        records = len([line for line in decode_body(
+            body, self.headers.get('Content-Encoding')).splitlines() if line])
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        cpu = thread_time() - began if thread_time is not None else 0.0
+        self.server.stub.received(length, records, cpu)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubServer(object):
+    """
+    Serves on a free local port from start() until stop().
+    """
+
+    def __init__(self):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.stub = self
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        self.lock = threading.Condition()
+        self.thread = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes = 0
+            self.records = 0
+            # cpu seconds spent serving, to leave out of the handler's
+            self.cpu = 0.0
+
+    def received(self, nbytes, records, cpu):
+        with self.lock:
+            self.requests += 1
+            self.bytes += nbytes
+            self.records += records
+            self.cpu += cpu
+            self.lock.notify_all()
+
+    def wait_for(self, records, timeout=60.0):
+        """
+        returns: True once records records have been received, False if
+        they weren't within timeout seconds
+        """
+        deadline = time.time() + timeout
+        with self.lock:
+            while self.records < records:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.lock.wait(remaining)
+            return True
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
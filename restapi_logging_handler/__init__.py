@@ -1,6 +1,16 @@
 from __future__ import absolute_import
 
+import sys
+
 from restapi_logging_handler.loggly_handler import LogglyHandler
 from restapi_logging_handler.restapi_logging_handler import RestApiHandler
 
 __all__ = ['LogglyHandler', 'RestApiHandler', ]
+
+if sys.version_info >= (3, 7):
+    from restapi_logging_handler.async_handler import (
+        AsyncLogglyHandler,
+        AsyncRestApiHandler,
+    )
+
+    __all__ += ['AsyncLogglyHandler', 'AsyncRestApiHandler', ]
@@ -0,0 +1,131 @@
+from __future__ import absolute_import
+
+import collections
+import threading
+
+
+class Repeats(object):
+    """
+    The repeats of one record within a window.
+    """
+
+    __slots__ = ('opened', 'count', 'first', 'last', 'record', 'samples')
+
+    def __init__(self, opened):
+        self.opened = opened
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.record = None
+        self.samples = []
+
+
+class Aggregator(object):
+    """
+    Collapses records logged again and again from the same place. The first
+    record of a (logger, level, msg, lineno) in a window is sent as usual,
+    the rest are only counted until the window is over, then sent as one
+    event: the last of them with how many there were, when the first and
+    last were logged and the args of the first few. At most max_keys
+    windows are kept, the least recently logged one is closed early to make
+    room.
+    """
+
+    def __init__(self, window=1.0, max_keys=1000, max_samples=3,
+                 snapshot=None, sample=None):
+        """
+        window: seconds repeats are collected for
+        max_keys: most distinct records collected at once
+        max_samples: how many of the repeats' args are kept
+        snapshot: called with a repeat for the copy of it kept until its
+            window is over, so its args changing after it was logged don't
+            change what is sent; the record itself if None
+        sample: called with the args of a repeat for what is kept of them,
+            the args themselves if None
+        """
+        self.window = window
+        self.max_keys = max_keys
+        self.max_samples = max_samples
+        self.snapshot = snapshot
+        self.sample = sample
+        self.lock = threading.Lock()
+        self.windows = collections.OrderedDict()
+        # windows closed early that still have repeats to send
+        self.closed = []
+
+    def add(self, record):
+        """
+        returns: True if the record was counted as a repeat and is not to
+        be sent itself
+        """
+        if record.exc_info:
+            return False
+        key = (record.name, record.levelno, record.msg, record.lineno)
+        now = record.created
+        try:
+            seen = self.windows.get(key)
+        except TypeError:
+            # msg can't be hashed
+            return False
+
+        # copied before taking the lock, as only repeats are kept
+        kept = sampled = None
+        if seen is not None:
+            kept = record if self.snapshot is None else self.snapshot(record)
+            if len(seen.samples) < self.max_samples:
+                sampled = (record.args,) if self.sample is None else (
+                    self.sample(record.args),)
+
+        with self.lock:
+            repeats = self.windows.pop(key, None)
+            if repeats is None or now - repeats.opened >= self.window:
+                self._open(key, repeats, now)
+                return False
+            # back in as the most recently logged
+            self.windows[key] = repeats
+            if kept is None:
+                # its window was opened by another thread meanwhile, send it
+                return False
+
+            repeats.count += 1
+            if repeats.first is None:
+                repeats.first = now
+            repeats.last = now
+            repeats.record = kept
+            if sampled and len(repeats.samples) < self.max_samples:
+                repeats.samples.append(sampled[0])
+        return True
+
+    def _open(self, key, repeats, now):
+        if repeats is not None and repeats.count:
+            self.closed.append(repeats)
+        self.windows[key] = Repeats(now)
+        while len(self.windows) > self.max_keys:
+            evicted = self.windows.popitem(last=False)[1]
+            if evicted.count:
+                self.closed.append(evicted)
+
+    def collect(self, now, everything=False):
+        """
+        Close the windows that are over, or all of them.
+
+        returns: a list of the Repeats to send, oldest first
+        """
+        with self.lock:
+            done, self.closed = self.closed, []
+            for key, repeats in list(self.windows.items()):
+                if everything or now - repeats.opened >= self.window:
+                    del self.windows[key]
+                    if repeats.count:
+                        done.append(repeats)
+        done.sort(key=lambda r: r.first)
+        return done
+
+    def afterFork(self):
+        """
+        Runs in the child after a fork: what the parent collected is the
+        parent's to send.
+        """
+        self.lock = threading.Lock()
+        self.windows = collections.OrderedDict()
+        self.closed = []
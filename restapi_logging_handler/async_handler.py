@@ -0,0 +1,455 @@
+from __future__ import absolute_import
+
+import asyncio
+import collections
+import logging
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from restapi_logging_handler.loggly_handler import LogglyHandler
+from restapi_logging_handler.restapi_logging_handler import (
+    RestApiHandler,
+    _handlers,
+)
+from restapi_logging_handler.retry import parse_retry_after
+
+
+def _runningLoop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class AsyncDeliveryMixin(object):
+    """
+    Uploads records from a single coroutine on an asyncio event loop rather
+    than through a FuturesSession thread pool.
+
+    emit() builds the payload and hands it to the loop without blocking or
+    awaiting, from the loop's own thread or any other. The loop is the one
+    given to the handler, or else the one running at the first emit().
+    Uploads go through aiohttp when it is installed, otherwise through
+    requests on a single helper thread.
+
+    Call `await handler.aclose()` before the loop stops to send what is
+    still queued.
+    """
+
+    # handler options the coroutine has no counterpart for
+    unsupported = ('circuit_breaker', 'deferred', 'runtime', 'max_pending')
+
+    def _checkOptions(self, kwargs):
+        for name in self.unsupported:
+            if kwargs.get(name) not in (None, False):
+                raise ValueError('{} is not supported by {}'.format(
+                    name, self.__class__.__name__))
+
+    def _initAsync(self, loop, max_queue, flush_interval, max_batch,
+                   max_concurrency):
+        self.loop = loop
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_concurrency = max_concurrency
+        self.queue = None
+        self.task = None
+        self.dropped = 0
+        self._early = collections.deque()
+        self._inflight = []
+        self._wake = None
+        self._http = None
+        self._executor = None
+        self._closing = False
+
+    def _createSession(self):
+        # the aiohttp session has to be made on the loop, see _asyncPost
+        return None
+
+    def _afterFork(self):
+        # the parent's loop, consumer and connections aren't the child's
+        super(AsyncDeliveryMixin, self)._afterFork()
+        self._initAsync(None, self.max_queue, self.flush_interval,
+                        self.max_batch, self.max_concurrency)
+
+    def _batchTimer(self):
+        # the consumer coroutine sends on flush_interval instead
+        return None
+
+    def _prepItem(self, record):
+        """
+        The part of the record that is queued for the consumer, its data
+        and content type.
+        """
+        return self._prepPayload(record)
+
+    def _deliver(self, items):
+        """
+        Coroutine sending a list of queued items, a POST each.
+        """
+        url = self._getEndpoint()
+        return self._postAll([
+            (url, data, {'content-type': header})
+            for data, header in items
+        ])
+
+    def _retryDelay(self, attempt, status_code, retry_after):
+        """
+        attempt: how many times the request has been sent
+        status_code: response status, None if there was no response
+
+        returns: seconds to wait before sending a failed request again, None
+        not to
+        """
+        return None
+
+    def emit(self, record):
+        """
+        Queue the record for upload. Never blocks or awaits.
+        """
+        # avoid infinite recursion
+        if record.name.startswith(('requests', 'aiohttp')):
+            return
+
+        if self.sampler is not None and not self.sampler.allow(record):
+            if self.metrics is not None:
+                self.metrics.inc('suppressed')
+            return
+
+        try:
+            item = self._prepItem(record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        running = _runningLoop()
+        if self.loop is None:
+            if running is None:
+                # nothing to upload on yet, keep it until there is
+                self._holdEarly(item)
+                return
+            self.loop = running
+
+        if running is self.loop:
+            self._put(item)
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._put, item)
+        else:
+            self.dropped += 1
+
+    def _holdEarly(self, item):
+        if len(self._early) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._early.append(item)
+
+    def _put(self, item):
+        """
+        Runs on the loop.
+        """
+        if self.queue is None:
+            self._start()
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def _start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self._wake = asyncio.Event()
+        while self._early:
+            self.queue.put_nowait(self._early.popleft())
+        self.task = self.loop.create_task(self._consume())
+
+    async def _consume(self):
+        while True:
+            items = [await self.queue.get()]
+            if self.flush_interval and self.queue.qsize() < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._wake.wait(),
+                                           self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+            while len(items) < self.max_batch:
+                try:
+                    items.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            self._inflight = items
+            try:
+                await self._deliver(items)
+            except Exception as e:
+                sys.stderr.write(
+                    '{}: could not send {} records error {}\n'.format(
+                        self.__class__.__name__, len(items), repr(e)))
+            self._inflight = []
+
+    def _aiohttpTimeout(self):
+        """
+        The handler's timeout, a number or (connect, read), for aiohttp.
+        """
+        if isinstance(self.timeout, tuple):
+            connect, read = self.timeout
+            return aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        return aiohttp.ClientTimeout(total=self.timeout)
+
+    async def _asyncPost(self, url, data, headers):
+        """
+        returns: the http status code and Retry-After header of the response
+        """
+        if aiohttp is not None:
+            if self._http is None:
+                self._http = aiohttp.ClientSession(
+                    timeout=self._aiohttpTimeout())
+            async with self._http.post(url, data=data,
+                                       headers=headers) as resp:
+                await resp.read()
+                return resp.status, resp.headers.get('Retry-After')
+
+        if self._http is None:
+            self._http = requests.Session()
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        post = partial(self._http.post, url, data=data, headers=headers,
+                       timeout=self.timeout)
+        resp = await self.loop.run_in_executor(self._executor, post)
+        return resp.status_code, resp.headers.get('Retry-After')
+
+    async def _postRetrying(self, url, data, headers):
+        """
+        Send a request, and again after a backoff for as long as
+        _retryDelay() allows.
+        """
+        attempt = 1
+        while True:
+            retry_after = None
+            try:
+                status, retry_after = await self._asyncPost(url, data,
+                                                            headers)
+            except Exception as e:
+                status, reason = None, 'error {}'.format(repr(e))
+            else:
+                if status < 300:
+                    return
+                reason = 'status {}'.format(status)
+
+            delay = None
+            if not self._closing:
+                delay = self._retryDelay(attempt, status,
+                                         parse_retry_after(retry_after))
+            if delay is None:
+                sys.stderr.write('{}: post failed {}\n'.format(
+                    self.__class__.__name__, reason))
+                return
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _postAll(self, requests_):
+        """
+        Send (url, data, headers) requests, at most max_concurrency at once.
+        """
+        for i in range(0, len(requests_), self.max_concurrency):
+            chunk = requests_[i:i + self.max_concurrency]
+            results = await asyncio.gather(
+                *[self._postRetrying(*r) for r in chunk],
+                return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    sys.stderr.write(
+                        '{}: post failed error {}\n'.format(
+                            self.__class__.__name__, repr(result)))
+
+    def flush(self, *args, **kwargs):
+        """
+        Wake the consumer so queued records are sent without waiting out
+        flush_interval.
+        """
+        loop = self.loop
+        if loop is None or self._wake is None or loop.is_closed():
+            return
+        if _runningLoop() is loop:
+            self._wake.set()
+        else:
+            loop.call_soon_threadsafe(self._wake.set)
+
+    async def aclose(self):
+        """
+        Send everything still queued, without retrying what fails, and stop
+        the consumer.
+        """
+        self._closing = True
+        items = list(self._early)
+        self._early.clear()
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+            items = self._inflight + items
+            while not self.queue.empty():
+                items.append(self.queue.get_nowait())
+
+        for i in range(0, len(items), self.max_batch):
+            await self._deliver(items[i:i + self.max_batch])
+
+        if self._http is not None:
+            if aiohttp is not None:
+                await self._http.close()
+            else:
+                self._http.close()
+                self._executor.shutdown(wait=False)
+            self._http = None
+
+    def close(self):
+        _handlers.discard(self)
+        self._stopSummaryTimer()
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            if _runningLoop() is loop:
+                loop.create_task(self.aclose())
+            elif loop.is_running():
+                asyncio.run_coroutine_threadsafe(self.aclose(), loop)
+            else:
+                loop.run_until_complete(self.aclose())
+        logging.Handler.close(self)
+
+
+class AsyncRestApiHandler(AsyncDeliveryMixin, RestApiHandler):
+    """
+    A RestApiHandler that uploads from a coroutine on an asyncio event loop.
+    Records are POSTed one each, or joined into batches if any of the
+    batch_ options are given.
+    """
+
+    def __init__(self, endpoint,
+                 loop=None,
+                 max_queue=10000,
+                 flush_interval=0,
+                 max_batch=1000,
+                 max_concurrency=8,
+                 **kwargs):
+        """
+        endpoint: define the fully qualified RESTful API endpoint to POST to.
+        loop: event loop to upload on, the running one at first emit if None
+        max_queue: records held for upload before new ones are dropped
+        flush_interval: seconds to wait for more records after the first,
+            batch_interval if batching and this is not given
+        max_batch: most records taken off the queue at once
+        max_concurrency: most POSTs in flight at once
+        kwargs: passed on to RestApiHandler, except circuit_breaker,
+            deferred, runtime and max_pending
+        """
+        self._checkOptions(kwargs)
+        self._initAsync(loop, max_queue, flush_interval, max_batch,
+                        max_concurrency)
+        RestApiHandler.__init__(self, endpoint, **kwargs)
+        if self.batching and not flush_interval:
+            self.flush_interval = self.batch_interval or 0
+        if self.batch_size:
+            self.max_batch = min(self.max_batch, self.batch_size)
+
+    def _deliver(self, items):
+        if not self.batching:
+            return super(AsyncRestApiHandler, self)._deliver(items)
+
+        url = self._getEndpoint()
+        requests_ = []
+        batch = []
+        nbytes = 0
+        for data, header in items:
+            batch.append(data)
+            nbytes += len(data)
+            if self.batch_bytes and nbytes >= self.batch_bytes:
+                requests_.append(self._encodeAsync(url, batch))
+                batch = []
+                nbytes = 0
+        if batch:
+            requests_.append(self._encodeAsync(url, batch))
+        return self._postAll(requests_)
+
+    def _encodeAsync(self, url, batch):
+        data, header = self._joinBatch(batch)
+        data, headers = self._encodeBatch(data, header)
+        return url, data, headers
+
+
+class AsyncLogglyHandler(AsyncDeliveryMixin, LogglyHandler):
+    """
+    A LogglyHandler that uploads from a coroutine on an asyncio event loop,
+    in place of its flush timer thread and thread pool. Failed bulk requests
+    are retried by the coroutine, but not spooled, and repeated records are
+    not aggregated.
+    """
+
+    unsupported = AsyncDeliveryMixin.unsupported + (
+        'spool_dir', 'aggregate_window', 'interval', 'flush_count',
+        'flush_bytes', 'adaptive')
+
+    def __init__(self,
+                 custom_token=None,
+                 app_tags=None,
+                 loop=None,
+                 max_queue=10000,
+                 flush_interval=1.0,
+                 max_batch=10000,
+                 max_concurrency=8,
+                 **kwargs):
+        """
+        custom_token: The loggly custom token account ID
+        app_tags: Loggly tags. Can be a tag string or a list of tag strings
+        loop: event loop to upload on, the running one at first emit if None
+        max_queue: records held for upload before new ones are dropped
+        flush_interval: seconds to collect records before a bulk upload
+        max_batch: most records sent in one flush
+        max_concurrency: most bulk POSTs in flight at once
+        kwargs: passed on to LogglyHandler, except those in unsupported;
+            flush_interval takes the place of interval, flush_count and
+            flush_bytes
+        """
+        self._checkOptions(kwargs)
+        self._initAsync(loop, max_queue, flush_interval, max_batch,
+                        max_concurrency)
+        LogglyHandler.__init__(self, custom_token, app_tags, **kwargs)
+
+    def _flushAndRepeatTimer(self):
+        # the consumer coroutine takes the place of the timer thread
+        return threading.Event()
+
+    def _stopFlushTimer(self):
+        self.timer.set()
+        self.close()
+
+    def _prepItem(self, record):
+        return self._prepEvent(self._prepPayload(record))
+
+    def _deliver(self, items):
+        requests_ = []
+        for url, lines, level in self._buildBulks(items):
+            data, headers = self._encodeBatch('\n'.join(lines),
+                                              'application/json')
+            requests_.append((url, data, headers))
+            self.retry_policy.budget.deposit()
+        return self._postAll(requests_)
+
+    def _retryDelay(self, attempt, status_code, retry_after):
+        policy = self.retry_policy
+        if (attempt > self.max_attempts or
+                not policy.retryable(status_code) or
+                not policy.budget.withdraw()):
+            return None
+        if self.metrics is not None:
+            self.metrics.inc('retries')
+        return policy.delay(attempt, retry_after)
@@ -0,0 +1,142 @@
+from __future__ import absolute_import
+
+import getpass
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+METADATA_URL = 'http://169.254.169.254'
+TOKEN_PATH = '/latest/api/token'
+INSTANCE_ID_PATH = '/latest/meta-data/instance-id'
+TOKEN_TTL_HEADER = 'X-aws-ec2-metadata-token-ttl-seconds'
+TOKEN_HEADER = 'X-aws-ec2-metadata-token'
+
+# seconds a found id, and the lack of one off EC2, are cached for
+CACHE_TTL = 24 * 60 * 60
+MISSING_TTL = 60 * 60
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _user():
+    getuid = getattr(os, 'getuid', None)
+    if getuid is not None:
+        return getuid()
+    return getpass.getuser()
+
+
+# where the instance id is kept for the next processes of the user on the
+# host, a file for each user; one another user owns is ignored
+DEFAULT_CACHE_PATH = os.path.join(
+    tempfile.gettempdir(),
+    'restapi-logging-handler-instance-id-{}.json'.format(_user()))
+
+
+def fetch_instance_id(base_url=METADATA_URL, timeout=1.0):
+    """
+    Ask the instance metadata service for the instance id, with an IMDSv2
+    session token, or without one if the token can't be had, as IMDSv1.
+
+    returns: the instance id, or None if it can't be found
+    """
+    headers = {}
+    try:
+        resp = requests.put(base_url + TOKEN_PATH,
+                            headers={TOKEN_TTL_HEADER: '60'},
+                            timeout=timeout)
+        if resp.status_code == 200:
+            headers[TOKEN_HEADER] = resp.text
+    except requests.RequestException:
+        pass
+    try:
+        resp = requests.get(base_url + INSTANCE_ID_PATH, headers=headers,
+                            timeout=timeout)
+    except requests.RequestException:
+        return None
+    if resp.status_code != 200:
+        return None
+    return resp.content.decode('utf-8').strip() or None
+
+
+def _owned(f):
+    """
+    returns: True if the open file f belongs to the current user, always
+    where there are no uids
+    """
+    getuid = getattr(os, 'getuid', None)
+    return getuid is None or os.fstat(f.fileno()).st_uid == getuid()
+
+
+def read_cache(path, now=None):
+    """
+    returns: a (found, instance id) tuple, found False if there is nothing
+    cached, it has expired or the file is another user's, the id None if
+    the host isn't on EC2
+    """
+    try:
+        with open(path) as f:
+            if not _owned(f):
+                return False, None
+            cached = json.load(f)
+        instance_id = cached['instance_id']
+        ttl = CACHE_TTL if instance_id else MISSING_TTL
+        now = time.time() if now is None else now
+        if 0 <= now - cached['time'] < ttl:
+            return True, instance_id
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+    return False, None
+
+
+def write_cache(path, instance_id):
+    directory, name = os.path.split(path)
+    tmp = None
+    try:
+        # a new file only the user can read, put in place in one step
+        fd, tmp = tempfile.mkstemp(prefix=name + '.', suffix='.tmp',
+                                   dir=directory or None)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'instance_id': instance_id, 'time': time.time()}, f)
+        _replace(tmp, path)
+    except (IOError, OSError) as e:
+        if tmp is not None:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+        sys.stderr.write(
+            'Could not cache instance id in {} error {}\n'.format(
+                path, repr(e)))
+
+
+def lookup_instance_id(callback, base_url=METADATA_URL,
+                       cache_path=DEFAULT_CACHE_PATH, timeout=1.0):
+    """
+    Find the instance id and call callback(instance id, or None off EC2):
+    right away if it is cached, otherwise from a thread once the metadata
+    service has answered, caching the answer.
+    cache_path: file to cache the id in, None not to
+
+    returns: the thread, or None if the id was cached
+    """
+    if cache_path is not None:
+        found, instance_id = read_cache(cache_path)
+        if found:
+            callback(instance_id)
+            return None
+
+    def lookup():
+        instance_id = fetch_instance_id(base_url, timeout=timeout)
+        if cache_path is not None:
+            write_cache(cache_path, instance_id)
+        callback(instance_id)
+
+    t = threading.Thread(target=lookup, name='restapi-logging-instance-id')
+    t.daemon = True  # stop if the program exits
+    t.start()
+    return t
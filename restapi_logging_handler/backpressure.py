@@ -0,0 +1,164 @@
+from __future__ import absolute_import
+
+import collections
+import logging
+import sys
+import threading
+import time
+
+BLOCK = 'block'
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+DROP_BELOW = 'drop_below'
+
+OVERFLOW_POLICIES = (BLOCK, DROP_NEWEST, DROP_OLDEST, DROP_BELOW)
+
+
+class PendingLimiter(object):
+    """
+    Bounds how many requests a handler may have queued or in flight in its
+    session's executor, and decides what to do with a request when full.
+    """
+
+    def __init__(self,
+                 max_pending,
+                 policy=BLOCK,
+                 timeout=1.0,
+                 drop_level=logging.WARNING,
+                 report_interval=10.0,
+                 name='RestApiHandler'):
+        """
+        max_pending: most requests allowed to be waiting at once
+        policy: what to do when full, one of OVERFLOW_POLICIES
+            block: wait up to timeout seconds for room, then drop
+            drop_newest: drop the request being sent
+            drop_oldest: cancel the oldest request not yet started
+            drop_below: drop requests below drop_level, block for the rest
+        timeout: seconds to wait for room when blocking
+        drop_level: level under which drop_below drops
+        report_interval: least seconds between dropped-count reports
+        name: prefix for the reports written to stderr
+        """
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(
+                'overflow policy must be one of {}'.format(
+                    ', '.join(OVERFLOW_POLICIES)))
+        if max_pending < 1:
+            raise ValueError('max_pending must be at least 1')
+
+        self.max_pending = max_pending
+        self.policy = policy
+        self.timeout = timeout
+        self.drop_level = drop_level
+        self.report_interval = report_interval
+        self.name = name
+
+        self.reset()
+        self.dropped = collections.Counter()
+        self.reported = 0
+        self.last_report = time.time()
+
+    def reset(self):
+        """
+        Forget the requests pending, e.g. in the child after a fork.
+        """
+        self.condition = threading.Condition()
+        self.pending = collections.deque()
+        self.records = {}
+        self.count = 0
+
+    @property
+    def dropped_total(self):
+        return sum(self.dropped.values())
+
+    def submit(self, send, level=logging.NOTSET, records=1):
+        """
+        send: callable starting the request and returning its future
+        level: highest logging level of the records in the request
+        records: how many log records the request carries
+
+        returns: the future from send, or None if the request was dropped
+        """
+        with self.condition:
+            if not self._makeRoom(level, records):
+                return None
+            self.count += 1
+
+        try:
+            future = send()
+        except Exception:
+            self._release()
+            raise
+
+        with self.condition:
+            self.pending.append(future)
+            self.records[future] = records
+        future.add_done_callback(self._done)
+        return future
+
+    def _makeRoom(self, level, records):
+        """
+        Called with the condition held. True once there is a free slot.
+        """
+        if self.count < self.max_pending:
+            return True
+
+        if self.policy == DROP_NEWEST:
+            return self._drop('newest', records)
+
+        if self.policy == DROP_BELOW and level < self.drop_level:
+            return self._drop('below_level', records)
+
+        if self.policy == DROP_OLDEST:
+            for future in list(self.pending):
+                # a cancelled future runs _done straight away, freeing a slot
+                cancelled = self.records.get(future, 1)
+                if future.cancel():
+                    self._drop('oldest', cancelled)
+                    return True
+            return self._drop('newest', records)
+
+        deadline = time.time() + self.timeout
+        while self.count >= self.max_pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return self._drop('timeout', records)
+            self.condition.wait(remaining)
+        return True
+
+    def _drop(self, reason, records):
+        self.dropped[reason] += records
+        if time.time() - self.last_report >= self.report_interval:
+            self.report()
+        return False
+
+    def _release(self):
+        with self.condition:
+            self.count -= 1
+            self.condition.notify()
+
+    def _done(self, future):
+        with self.condition:
+            try:
+                self.pending.remove(future)
+            except ValueError:
+                pass
+            self.records.pop(future, None)
+            self.count -= 1
+            self.condition.notify()
+
+    def report(self):
+        """
+        Write the dropped counts to stderr if more were dropped since the
+        last report.
+        """
+        total = self.dropped_total
+        self.last_report = time.time()
+        if total == self.reported:
+            return
+        self.reported = total
+        sys.stderr.write(
+            '{}: dropped {} records, {}\n'.format(
+                self.name, total, ', '.join(
+                    '{} {}'.format(reason, count)
+                    for reason, count in sorted(self.dropped.items()))))
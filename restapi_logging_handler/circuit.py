@@ -0,0 +1,171 @@
+from __future__ import absolute_import
+
+import collections
+import sys
+import threading
+import time
+
+from restapi_logging_handler.retry import RETRYABLE_STATUSES
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+BUFFER = 'buffer'
+DROP = 'drop'
+
+OPEN_POLICIES = (BUFFER, DROP)
+
+
+class CircuitBreaker(object):
+    """
+    Stops a handler from posting to an endpoint that keeps failing.
+
+    Closed, requests are sent and failures counted. After failure_threshold
+    failures in a row it opens: requests are held back, buffered or dropped
+    by policy, for reset_timeout seconds. Then it is half-open and lets one
+    probe request through. If the probe succeeds it closes and the buffered
+    requests are sent, otherwise it opens again for twice as long, up to
+    max_reset_timeout.
+    """
+
+    def __init__(self,
+                 failure_threshold=5,
+                 reset_timeout=10.0,
+                 max_reset_timeout=300.0,
+                 policy=BUFFER,
+                 max_buffered=1000,
+                 failure_statuses=RETRYABLE_STATUSES,
+                 name='RestApiHandler'):
+        """
+        failure_threshold: failures in a row that open the circuit
+        reset_timeout: seconds the circuit first stays open before a probe
+        max_reset_timeout: most seconds it stays open after failed probes
+        policy: what to do with requests while open, one of OPEN_POLICIES
+            buffer: keep up to max_buffered requests, drop the oldest after
+            drop: drop them
+        max_buffered: most requests kept while open
+        failure_statuses: response statuses counted as failures, besides
+            requests that got no response
+        name: prefix for the reports written to stderr
+        """
+        if policy not in OPEN_POLICIES:
+            raise ValueError(
+                'circuit breaker policy must be one of {}'.format(
+                    ', '.join(OPEN_POLICIES)))
+        if failure_threshold < 1:
+            raise ValueError('failure_threshold must be at least 1')
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.policy = policy
+        self.max_buffered = max_buffered
+        self.failure_statuses = frozenset(failure_statuses)
+        self.name = name
+
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.timeout = reset_timeout
+        self.opened_at = None
+        self.buffered = collections.deque()
+        self.dropped = 0
+        self.reported = 0
+
+    def allow(self):
+        """
+        returns: True if a request may be sent now, False if it is to be
+        held back. Once the circuit has been open for its timeout, the first
+        caller gets HALF_OPEN, also true, and its request is the probe.
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if (self.state == OPEN and
+                    time.time() - self.opened_at >= self.timeout):
+                self.state = HALF_OPEN
+                return HALF_OPEN
+            return False
+
+    def release_probe(self):
+        """
+        The probe was not sent after all, dropped or cancelled: open the
+        circuit again, so the next request is the probe.
+        """
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+
+    def failed(self, status_code=None, error=None):
+        """
+        Whether a request outcome counts against the endpoint.
+        """
+        return error is not None or status_code in self.failure_statuses
+
+    def record_success(self):
+        """
+        returns: the requests held while the circuit was open, to be sent
+        now that it is closed, or None if it was closed already
+        """
+        with self.lock:
+            self.failures = 0
+            if self.state == CLOSED:
+                return None
+            self.state = CLOSED
+            self.timeout = self.reset_timeout
+            held = [send for send, records in self.buffered]
+            self.buffered = collections.deque()
+        sys.stderr.write(
+            '{}: circuit closed, sending {} held requests\n'.format(
+                self.name, len(held)))
+        return held
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self.timeout = min(self.timeout * 2, self.max_reset_timeout)
+            elif (self.state == OPEN or
+                  self.failures < self.failure_threshold):
+                return
+            self.state = OPEN
+            self.opened_at = time.time()
+            timeout = self.timeout
+        sys.stderr.write(
+            '{}: circuit open after {} failures, retrying in {}s\n'.format(
+                self.name, self.failures, timeout))
+
+    def hold(self, send, records=1):
+        """
+        Keep a request back while the circuit is open.
+        send: callable that sends the request once the circuit closes
+        records: how many log records the request carries
+        """
+        with self.lock:
+            if self.policy == DROP:
+                self.dropped += records
+                return
+            if len(self.buffered) >= self.max_buffered:
+                self.dropped += self.buffered.popleft()[1]
+            self.buffered.append((send, records))
+
+    def drop_buffered(self):
+        """
+        Count the requests still held as dropped, as on close.
+        """
+        with self.lock:
+            self.dropped += sum(records for send, records in self.buffered)
+            self.buffered = collections.deque()
+
+    def report(self):
+        """
+        Write the dropped count to stderr if more were dropped since the
+        last report.
+        """
+        if self.dropped == self.reported:
+            return
+        self.reported = self.dropped
+        sys.stderr.write(
+            '{}: dropped {} records, circuit open\n'.format(
+                self.name, self.dropped))
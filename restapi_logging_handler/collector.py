@@ -0,0 +1,269 @@
+from __future__ import absolute_import
+
+import argparse
+import errno
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+
+from restapi_logging_handler.loggly_handler import LogglyHandler
+from restapi_logging_handler.restapi_logging_handler import RestApiHandler
+from restapi_logging_handler.serialization import utf8_len
+
+DEFAULT_ADDRESS = '/tmp/restapi-logging-collector.sock'
+
+# largest event sent as one datagram; bigger ones lose their details and
+# have their message and traceback cut short
+MAX_DATAGRAM = 64 * 1024
+
+# errors meaning the collector isn't there or can't keep up
+UNDELIVERABLE = (errno.ENOENT, errno.ECONNREFUSED, errno.EAGAIN,
+                 errno.EWOULDBLOCK, errno.ENOBUFS)
+
+
+class CollectorHandler(RestApiHandler):
+    """
+    A handler which builds payloads as RestApiHandler does and writes them
+    to a local Collector over a Unix datagram socket, leaving the uploads to
+    the collector. Sending never blocks: records the collector can't take
+    are dropped and counted.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, max_datagram=MAX_DATAGRAM,
+                 **kwargs):
+        """
+        address: path of the collector's socket
+        max_datagram: events bigger than this are shrunk to fit
+        kwargs: passed on to RestApiHandler, e.g. serializer, json_encoder
+            and deferred
+        """
+        self.address = address
+        self.max_datagram = max_datagram
+        self.dropped = 0
+        # the last error other than the collector being unavailable
+        self.drop_error = None
+        self.sock = None
+        super(CollectorHandler, self).__init__(address, **kwargs)
+
+    def _createSession(self):
+        return None
+
+    def _socket(self):
+        if self.sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            self.sock = sock
+        return self.sock
+
+    def _shrink(self, payload, size, max_size=None):
+        """
+        Cut an event down to fit max_size, max_datagram if None: the details
+        are dropped, the message and traceback cut short, and 'truncated'
+        holds its size.
+        """
+        if max_size is None:
+            max_size = self.max_datagram
+        event = {k: v for k, v in payload.items() if k != 'details'}
+        event['truncated'] = size
+        limit = max_size // 2
+        while True:
+            for key in ('message', 'traceback'):
+                if key in payload:
+                    event[key] = u'{}'.format(payload[key])[:limit]
+            data = self.encode(event)
+            if utf8_len(data) <= max_size or limit == 0:
+                return data
+            limit //= 2
+
+    def _emitNow(self, record):
+        payload = self._getPayload(record)
+        data = self.encode(payload)
+        size = utf8_len(data)
+        if size > self.max_datagram:
+            data = self._shrink(payload, size)
+        while True:
+            encoded = data.encode('utf-8')
+            try:
+                self._socket().sendto(encoded, self.address)
+                return
+            except socket.error as e:
+                if e.errno == errno.EMSGSIZE and len(encoded) > 1:
+                    # the system takes less than max_datagram, halve it
+                    shrunk = self._shrink(payload, size, len(encoded) // 2)
+                    if utf8_len(shrunk) < len(encoded):
+                        data = shrunk
+                        continue
+                with self.batch_lock:
+                    self.dropped += 1
+                    if e.errno not in UNDELIVERABLE:
+                        self.drop_error = e
+                return
+
+    def _afterFork(self):
+        super(CollectorHandler, self)._afterFork()
+        # each process writes through its own socket
+        self.sock = None
+        self.dropped = 0
+        self.drop_error = None
+
+    def flush(self):
+        self._drainQueue()
+
+    def close(self):
+        super(CollectorHandler, self).close()
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.dropped:
+            sys.stderr.write(
+                'CollectorHandler: dropped {} records, collector at {} '
+                'unavailable\n'.format(self.dropped, self.address))
+        if self.drop_error is not None:
+            sys.stderr.write(
+                'CollectorHandler: last send error {}\n'.format(
+                    repr(self.drop_error)))
+
+
+class Collector(object):
+    """
+    Receives the events of CollectorHandlers on a Unix datagram socket and
+    hands them to one handler, a LogglyHandler or a RestApiHandler, which
+    batches, compresses and uploads them for every process on the host.
+    """
+
+    def __init__(self, handler, address=DEFAULT_ADDRESS,
+                 max_datagram=MAX_DATAGRAM, receive_buffer=4 * 1024 * 1024):
+        """
+        handler: the handler uploading the events
+        address: path of the socket to listen on, replaced if it exists
+        max_datagram: largest event accepted
+        receive_buffer: bytes of events the kernel holds for the collector
+            while it is busy
+        """
+        self.handler = handler
+        self.address = address
+        self.max_datagram = max_datagram
+        self.received = 0
+        self.invalid = 0
+        self.stopped = threading.Event()
+
+        try:
+            os.unlink(address)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                 receive_buffer)
+        except socket.error:
+            pass
+        self.sock.bind(address)
+        self.sock.settimeout(0.5)
+
+    def handle_datagram(self, data):
+        try:
+            payload = json.loads(data.decode('utf-8'))
+        except ValueError:
+            self.invalid += 1
+            return
+        self.received += 1
+        self.handler._collectPayload(payload)
+
+    def serve_forever(self):
+        while not self.stopped.is_set():
+            try:
+                data = self.sock.recv(self.max_datagram)
+            except socket.timeout:
+                continue
+            except socket.error as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            try:
+                self.handle_datagram(data)
+            except Exception as e:
+                sys.stderr.write(
+                    'Collector: could not handle event error {}\n'.format(
+                        repr(e)))
+
+    def stop(self):
+        self.stopped.set()
+
+    def close(self):
+        """
+        Upload what is collected and remove the socket.
+        """
+        self.sock.close()
+        try:
+            os.unlink(self.address)
+        except OSError:
+            pass
+        self.handler.close()
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        description='Collect the logs of local processes and upload them '
+                    'to Loggly or a RESTful API.')
+    parser.add_argument('--socket', default=DEFAULT_ADDRESS,
+                        help='path of the socket to listen on')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--loggly-token', help='Loggly custom token')
+    target.add_argument('--endpoint', help='RESTful API endpoint to POST to')
+    parser.add_argument('--tags', default='collector',
+                        help='comma separated Loggly tags')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='seconds between uploads')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='upload once this many events are collected')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'],
+                        help='compress uploads')
+    parser.add_argument('--spool-dir',
+                        help='Loggly: keep undeliverable uploads here')
+    return parser
+
+
+def build_handler(args):
+    if args.loggly_token:
+        return LogglyHandler(
+            args.loggly_token,
+            args.tags,
+            interval=args.interval,
+            flush_count=args.batch_size,
+            group_by_thread=False,
+            compression=args.compression,
+            spool_dir=args.spool_dir,
+        )
+    return RestApiHandler(
+        args.endpoint,
+        batch_size=args.batch_size,
+        batch_interval=args.interval,
+        compression=args.compression,
+    )
+
+
+def main(argv=None):
+    """
+    Entry point of restapi-logging-collector.
+    """
+    args = _parser().parse_args(argv)
+    collector = Collector(build_handler(args), address=args.socket)
+
+    def stop(signum, frame):
+        collector.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        collector.serve_forever()
+    finally:
+        collector.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
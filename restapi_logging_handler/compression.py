@@ -0,0 +1,70 @@
+from __future__ import absolute_import
+
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+ENCODINGS = (GZIP, ZSTD)
+
+
+def _gzip(data, level):
+    # wbits 31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION if level is None else level,
+        zlib.DEFLATED,
+        31,
+    )
+    return compressor.compress(data) + compressor.flush()
+
+
+def _zstd(data, level):
+    if level is None:
+        return zstandard.ZstdCompressor().compress(data)
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+COMPRESSORS = {
+    GZIP: _gzip,
+    ZSTD: _zstd,
+}
+
+
+def check_encoding(encoding):
+    """
+    Raise ValueError unless encoding is None or can be used here.
+    """
+    if encoding is None:
+        return
+    if encoding not in ENCODINGS:
+        raise ValueError(
+            'compression must be one of {}'.format(', '.join(ENCODINGS)))
+    if encoding == ZSTD and zstandard is None:
+        raise ValueError(
+            'zstd compression needs the zstandard package installed')
+
+
+def compress(data, encoding, threshold=0, level=None):
+    """
+    data: request body, text or bytes
+    encoding: 'gzip', 'zstd' or None
+    threshold: bodies smaller than this many bytes are left uncompressed
+    level: compression level, the library default if None
+
+    returns: a tuple of the body and the Content-Encoding to send it with,
+    None if the body was left as it was
+    """
+    if encoding is None:
+        return data, None
+
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    if len(data) < threshold:
+        return data, None
+
+    return COMPRESSORS[encoding](data, level), encoding
@@ -1,37 +1,43 @@
 from __future__ import absolute_import
 
 import atexit
-import json
-import os
+import logging
+import re
+import sys
 import threading
+import time
+from concurrent import futures
 from functools import partial
-import sys
 
-import requests
-
-from restapi_logging_handler.restapi_logging_handler import (
+from restapi_logging_handler.aggregation import Aggregator
+from restapi_logging_handler.aws import (
+    DEFAULT_CACHE_PATH,
+    METADATA_URL,
+    lookup_instance_id,
+)
+from restapi_logging_handler.restapi_logging_handler import (  # noqa: F401
     RestApiHandler,
-    serialize,
+    setInterval,  # importable from here as before
 )
+from restapi_logging_handler.retry import RetryPolicy, parse_retry_after
+from restapi_logging_handler.scheduler import Scheduler
+from restapi_logging_handler.serialization import utf8_len
+from restapi_logging_handler.spool import DiskSpool
 
+# Loggly rejects bulk requests over 5MB and events over 1MB
+MAX_BULK_BYTES = 5 * 1024 * 1024
+MAX_EVENT_BYTES = 1024 * 1024
 
-def setInterval(interval):
-    def decorator(function):
-        def wrapper(*args, **kwargs):
-            stopped = threading.Event()
+TRUNCATION_MARKER = '...[truncated]'
 
-            def loop():  # executed in another thread
-                while not stopped.wait(interval):  # until stopped
-                    function(*args, **kwargs)
+# most seconds close() waits for the last posts to be answered
+CLOSE_WAIT = 10.0
 
-            t = threading.Thread(target=loop)
-            t.daemon = True  # stop if the program exits
-            t.start()
-            return stopped
-
-        return wrapper
+# logs per flush the adaptive interval aims for when flush_count isn't set
+ADAPTIVE_TARGET = 1000
 
-    return decorator
+# characters Loggly doesn't allow in a tag
+UNSAFE_TAG = re.compile(r'[^\w.-]')
 
 
 class LogglyHandler(RestApiHandler):
@@ -44,48 +50,246 @@ class LogglyHandler(RestApiHandler):
                  custom_token=None,
                  app_tags=None,
                  max_attempts=5,
-                 aws_tag=False):
+                 aws_tag=False,
+                 max_bulk_bytes=MAX_BULK_BYTES,
+                 max_event_bytes=MAX_EVENT_BYTES,
+                 spool_dir=None,
+                 spool_max_bytes=100 * 1024 * 1024,
+                 retry_policy=None,
+                 group_by_thread=True,
+                 tag_fields=None,
+                 max_tag_groups=10,
+                 interval=1.0,
+                 flush_count=None,
+                 flush_bytes=None,
+                 adaptive=False,
+                 min_interval=0.1,
+                 max_interval=10.0,
+                 aggregate_window=None,
+                 aggregate_max_keys=1000,
+                 aggregate_samples=3,
+                 aws_metadata_url=METADATA_URL,
+                 aws_cache_path=DEFAULT_CACHE_PATH,
+                 **kwargs):
         """
         customToken: The loggly custom token account ID
         appTags: Loggly tags. Can be a tag string or a list of tag strings
-        aws_tag: include aws instance id in tags if True and id can be found
+        aws_tag: include aws instance id in tags if True and id can be found.
+            It is looked up in the background, logs sent before it is known
+            go without it
+        aws_metadata_url: base url of the instance metadata service
+        aws_cache_path: file the instance id is cached in for the next
+            processes, None not to cache it
+        max_bulk_bytes: split a flush into bulk requests of at most this size
+        max_event_bytes: truncate single events larger than this
+        spool_dir: directory to keep bulk requests that could not be
+            delivered in, and to replay them from at startup
+        spool_max_bytes: most bytes kept in spool_dir, oldest dropped first
+        retry_policy: RetryPolicy deciding which failed posts are retried and
+            how long after, a default one if None
+        group_by_thread: send the logs of each process and thread in their
+            own bulk requests, tagged with the pid and tid. If False, a flush
+            is sent as few bulk requests as max_bulk_bytes allows, and pid
+            and tid are fields of each event
+        tag_fields: payload fields, e.g. ['level'], whose values are added
+            to the tags, sending a bulk request per combination of values
+        max_tag_groups: most combinations of tag_fields values tagged per
+            flush, events with any others are sent untagged
+        interval: seconds between flushes
+        flush_count: flush as soon as this many logs are collected
+        flush_bytes: flush as soon as the collected logs reach this size
+        adaptive: lengthen the interval, up to max_interval, while flushes
+            are small, and shorten it, down to min_interval, while they are
+            big or come early
+        aggregate_window: seconds over which repeats of a record, the same
+            logger, level, msg and line, are sent as one event with their
+            count, None to send each
+        aggregate_max_keys: most distinct records aggregated at once
+        aggregate_samples: how many of the repeats' args are sent
+        kwargs: passed on to RestApiHandler, e.g. max_pending and
+            overflow_policy
         """
-        self.pid = os.getpid()
         self.tags = self._getTags(app_tags)
         self.custom_token = custom_token
 
         self.aws_tag = aws_tag
-        if self.aws_tag:
-            id_url = None
+        self.aws_metadata_url = aws_metadata_url
+        self.aws_cache_path = aws_cache_path
+        self.ec2_id = None
+        self.aws_lookup = None
 
-            try:
-                aws_base = "http://169.254.169.254/latest/meta-data/{}"
-                id_url = aws_base.format('instance-id')
-                self.ec2_id = requests.get(id_url, timeout=2).content.decode(
-                    'utf-8')
-            except Exception as e:
-                sys.stderr.write(
-                    'Could not obtain metadata from url {} error {}'.format(
-                        id_url, repr(e)
-                    ))
-                self.ec2_id = 'id_NA'
-
-            self.tags.append(self.ec2_id)
-
-        super(LogglyHandler, self).__init__(self._getEndpoint())
+        super(LogglyHandler, self).__init__(self._getEndpoint(), **kwargs)
 
         self.max_attempts = max_attempts
+        self.retry_policy = (retry_policy if retry_policy is not None
+                             else RetryPolicy())
+        if self.runtime is not None:
+            self.scheduler = self.runtime.scheduler
+        else:
+            self.scheduler = Scheduler(name='LogglyHandler retries')
+        self.max_bulk_bytes = max_bulk_bytes
+        self.max_event_bytes = max_event_bytes
+        self.group_by_thread = group_by_thread
+        self.tag_fields = list(tag_fields) if tag_fields else []
+        self.max_tag_groups = max_tag_groups
+        self.interval = interval
+        self.flush_count = flush_count
+        self.flush_bytes = flush_bytes
+        self.adaptive = adaptive
+        self.min_interval = min(min_interval, interval)
+        self.max_interval = max(max_interval, interval)
         self.timer = None
+        self.wake = threading.Event()
+        self.next_flush = None
+        self.flush_woken = False
         self.logs = []
+        self.logs_nbytes = 0
+        # bulk posts not yet answered, and retries not yet sent
+        self.inflight = set()
+        self.retries = []
+        self.closing = False
+        self.aggregator = None
+        if aggregate_window is not None:
+            self.aggregator = Aggregator(window=aggregate_window,
+                                         max_keys=aggregate_max_keys,
+                                         max_samples=aggregate_samples,
+                                         snapshot=self._snapshot,
+                                         sample=self.serializer)
+        if self.metrics is not None:
+            self.metrics.gauge('buffered', lambda: len(self.logs))
         self.timer = self._flushAndRepeatTimer()
-        atexit.register(self._stopFlushTimer)
+        if self.runtime is None:
+            # a shared runtime flushes its handlers at exit
+            atexit.register(self._stopFlushTimer)
+
+        self.spool = None
+        self.spool_replay = None
+        if spool_dir is not None:
+            self.spool = DiskSpool(spool_dir, max_bytes=spool_max_bytes)
+            self.spool_replay = self.spool.replayInBackground(self._sendNow)
+
+        if self.aws_tag:
+            self.aws_lookup = self._lookupInstanceId()
+
+    def _lookupInstanceId(self):
+        return lookup_instance_id(self._setInstanceId,
+                                  base_url=self.aws_metadata_url,
+                                  cache_path=self.aws_cache_path)
+
+    def _setInstanceId(self, instance_id):
+        """
+        Tag the logs sent from now on with the instance id, or id_NA if it
+        couldn't be found.
+        """
+        if instance_id is None:
+            sys.stderr.write(
+                'Could not obtain instance id from {}\n'.format(
+                    self.aws_metadata_url))
+            instance_id = 'id_NA'
+        self.ec2_id = instance_id
+        # a new list, so threads joining the tags never see it change
+        self.tags = self.tags + [instance_id]
 
-    @setInterval(1)
     def _flushAndRepeatTimer(self):
-        self.flush()
+        """
+        Start flushing every interval seconds, or sooner when woken, on the
+        runtime's scheduler if there is one, otherwise on a thread.
+
+        returns: an Event that stops it once set
+        """
+        stopped = threading.Event()
+        if self.runtime is not None:
+            self._scheduleFlush(stopped, self.interval, self.interval)
+            return stopped
+        t = threading.Thread(target=self._flushLoop, args=(stopped,))
+        t.daemon = True  # stop if the program exits
+        t.start()
+        return stopped
+
+    def _flushTick(self, interval, early):
+        """
+        Flush, and work out when to next.
+
+        returns: the interval to the next flush
+        """
+        try:
+            count = self.flush()
+        except Exception as e:
+            sys.stderr.write(
+                'LogglyHandler: flush failed error {}'.format(repr(e)))
+            count = 0
+        if self.adaptive:
+            interval = self._nextInterval(interval, count, early)
+        return interval
+
+    def _flushLoop(self, stopped):
+        interval = self.interval
+        while True:
+            early = self.wake.wait(interval)
+            self.wake.clear()
+            if stopped.is_set():
+                return
+            interval = self._flushTick(interval, early)
+
+    def _scheduleFlush(self, stopped, delay, interval, early=False):
+        with self.batch_lock:
+            self.next_flush = self.scheduler.call_later(
+                delay, self._scheduledFlush, stopped, interval, early)
+
+    def _scheduledFlush(self, stopped, interval, early):
+        if stopped.is_set():
+            return
+        interval = self._flushTick(interval, early)
+        if stopped.is_set():
+            return
+        with self.batch_lock:
+            if self.flush_woken:
+                # woken while flushing, flush again right away
+                self.flush_woken = False
+                self._scheduleFlush(stopped, 0, interval, early=True)
+            else:
+                self._scheduleFlush(stopped, interval, interval)
+
+    def _wakeFlush(self):
+        """
+        Flush now rather than at the end of the interval.
+        """
+        if self.runtime is None:
+            self.wake.set()
+            return
+        with self.batch_lock:
+            call = self.next_flush
+            if call is None or call.cancelled:
+                return
+            if call.started:
+                # flushing now, it schedules the next one when done
+                self.flush_woken = True
+                return
+            stopped, interval, early = call.args
+            if early:
+                # woken already
+                return
+            call.cancel()
+            self._scheduleFlush(stopped, 0, interval, early=True)
+
+    def _nextInterval(self, interval, count, early):
+        """
+        Halve the interval after a flush that came early or was big, double
+        it after a small one.
+        count: how many logs were flushed
+        early: True if the flush was woken by flush_count or flush_bytes
+        """
+        target = self.flush_count or ADAPTIVE_TARGET
+        if early or count >= target:
+            return max(self.min_interval, interval / 2.0)
+        if count < target / 4.0:
+            return min(self.max_interval, interval * 2.0)
+        return interval
 
     def _stopFlushTimer(self):
         self.timer.set()
+        self.wake.set()
+        self._collectRepeats(everything=True)
         self.flush()
 
     def _getTags(self, app_tags):
@@ -134,67 +338,388 @@ class LogglyHandler(RestApiHandler):
 
         return payload
 
-    def handle_response(self, sess, resp, batch=None, attempt=0, ):
+    def _sendNow(self, url, data, headers):
+        """
+        POST and wait for the response.
+
+        returns: True if it was delivered
+        """
+        try:
+            resp = self.session.post(url, data=data, headers=headers,
+                                     timeout=self.timeout).result()
+        except Exception:
+            return False
+        return resp.status_code == 200
+
+    def _spoolBulk(self, url, lines):
+        data, headers = self._encodeBatch('\n'.join(lines),
+                                          'application/json')
+        self.spool.append(url, data, headers)
+
+    def _holdPost(self, url, data, headers, level, records, callback,
+                  resend=None):
+        """
+        While the circuit breaker is open, spool bulk requests if there is
+        a spool rather than hold them in memory.
+        """
+        if self.spool is None:
+            super(LogglyHandler, self)._holdPost(
+                url, data, headers, level, records, callback, resend)
+            return
+        try:
+            self.spool.append(url, data, headers)
+        except Exception as e:
+            sys.stderr.write(
+                'LogglyHandler: could not spool {} records error {}'.format(
+                    records, repr(e)))
+
+    def _callSoon(self, function, *args):
+        call = self.scheduler.call_later(0, function, *args)
+        if call.cancelled:
+            # the scheduler has stopped
+            super(LogglyHandler, self)._callSoon(function, *args)
+
+    def _circuitClosed(self, held):
+        super(LogglyHandler, self)._circuitClosed(held)
+        if self.spool is None:
+            return
+        # what was spooled during the outage is in the segment still being
+        # written, which replay only claims once it is closed
+        self.spool.rotate()
+        if not (self.spool_replay and self.spool_replay.is_alive()):
+            self.spool_replay = self.spool.replayInBackground(self._sendNow)
+
+    def _sendBulk(self, url, lines, level=logging.NOTSET, attempt=1):
+        """
+        POST one bulk request, retrying it if it fails.
+        """
+        callback = partial(
+            self.handle_response, batch=lines, attempt=attempt, url=url)
+        future = self._postBatch(
+            url,
+            '\n'.join(lines),
+            'application/json',
+            level=level,
+            records=len(lines),
+            callback=callback,
+            # held back by the circuit breaker, sent again through here so
+            # it is retried and waited for on close like any other
+            resend=partial(self._sendBulk, url, lines, level, attempt),
+        )
+        if future is not None:
+            with self.batch_lock:
+                self.inflight.add(future)
+            future.add_done_callback(self._postDone)
+            future.add_done_callback(
+                partial(self._checkPosted, url, lines, attempt))
+        return future
+
+    def _postDone(self, future):
+        with self.batch_lock:
+            self.inflight.discard(future)
+
+    def _checkPosted(self, url, lines, attempt, future):
+        """
+        Retry a bulk request that failed without a response.
+        """
+        if future.cancelled() or future.exception() is None:
+            return
+        self._retry(url, lines, attempt,
+                    reason='error {}'.format(repr(future.exception())))
+
+    def handle_response(self, sess, resp, batch=None, attempt=0, url=None):
         if resp.status_code != 200:
-            if attempt <= self.max_attempts:
-                attempt += 1
-                self.flush(batch, attempt)
-            else:
-                sys.stderr.write(
-                    'LogglyHandler: max post attempts '
-                    'failed status {} content {}'.format(
-                        resp.status_code, resp.content.decode()
-                    ))
+            self._retry(
+                url, batch, attempt,
+                status_code=resp.status_code,
+                reason='status {} content {}'.format(
+                    resp.status_code, resp.content.decode()),
+                retry_after=parse_retry_after(
+                    resp.headers.get('Retry-After')),
+            )
+
+    def _retry(self, url, lines, attempt, status_code=None, reason='',
+               retry_after=None):
+        """
+        Schedule a failed bulk request to be sent again after a backoff, or
+        give up on it.
+        attempt: how many times it has been sent
+        status_code: response status, None if there was no response
+        """
+        policy = self.retry_policy
+        if not policy.retryable(status_code):
+            if self.metrics is not None:
+                self.metrics.inc('records_failed', len(lines))
+            sys.stderr.write(
+                'LogglyHandler: post not retryable, dropped {} records, '
+                '{}'.format(len(lines), reason))
+            return
 
-    def flush(self, current_batch=None, attempt=1):
-        if current_batch is None:
-            self.logs, current_batch = [], self.logs
-        if current_batch:
-            # group by process id and thread id, for tags
-            pids = {}
-            for d in current_batch:
-                pid = d.pop('pid', 'nopid')
-                tid = d.pop('tid', 'notid')
-                data = json.dumps(d, default=serialize)
-
-                if pid in pids:
-                    p = pids[pid]
-                    if tid in p:
-                        p[tid].append(data)
-                    else:
-                        p[tid] = [data]
-                else:
-                    pids[pid] = {tid: [data]}
-
-            for pid, tids in pids.items():
-                for tid, data in tids.items():
-                    callback = partial(
-                        self.handle_response, batch=data, attempt=attempt)
-                    url = self._getEndpoint(add_tags=[pid, tid])
-                    payload = '\n'.join(data)
-
-                    self.session.post(
-                        url,
-                        data=payload,
-                        headers={'content-type': 'application/json'},
-                        background_callback=callback
-                    )
+        if attempt > self.max_attempts:
+            problem = 'max post attempts failed {}'.format(reason)
+        elif self.closing:
+            problem = 'handler closed, post failed {}'.format(reason)
+        elif not policy.budget.withdraw():
+            problem = 'retry budget exhausted, post failed {}'.format(reason)
+        else:
+            call = self.scheduler.call_later(
+                policy.delay(attempt, retry_after),
+                self._sendBulk, url, lines, logging.NOTSET, attempt + 1)
+            if not call.cancelled:
+                with self.batch_lock:
+                    self.retries = [c for c in self.retries
+                                    if not (c.started or c.cancelled)]
+                    self.retries.append(call)
+                if self.metrics is not None:
+                    self.metrics.inc('retries')
+                return
+            # the scheduler has stopped
+            problem = 'handler closed, post failed {}'.format(reason)
+        self._giveUp(url, lines, problem)
+
+    def _giveUp(self, url, lines, problem):
+        """
+        Spool a bulk request that won't be retried, or report it dropped.
+        """
+        if self.spool is not None and url is not None:
+            try:
+                self._spoolBulk(url, lines)
+                if self.metrics is not None:
+                    self.metrics.inc('records_spooled', len(lines))
+                return
+            except Exception as e:
+                problem += ', could not spool error {}'.format(repr(e))
+        if self.metrics is not None:
+            self.metrics.inc('records_failed', len(lines))
+        sys.stderr.write('LogglyHandler: {}'.format(problem))
 
-    def emit(self, record):
+    def _serializeEvent(self, d):
+        """
+        Serialize one payload to a bulk line, truncating it if it is over
+        max_event_bytes.
+
+        returns: a tuple of the line and its size in bytes
+        """
+        data = self.encode(d)
+        size = utf8_len(data)
+        if size > self.max_event_bytes:
+            data = self._truncateEvent(d, size)
+            size = utf8_len(data)
+        return data, size
+
+    def _truncateEvent(self, d, size):
+        """
+        Shrink an oversized payload to fit max_event_bytes. The details are
+        dropped, the message and traceback are cut short and end in
+        TRUNCATION_MARKER, and 'truncated' holds the original size.
         """
-        Override emit() method in handler parent for sending log to RESTful
-        API
+        event = {k: v for k, v in d.items() if k != 'details'}
+        event['truncated'] = size
+        texts = [k for k in ('message', 'traceback') if k in event]
+        limit = self.max_event_bytes
+
+        while True:
+            for key in texts:
+                text = u'{}'.format(d[key])
+                if len(text) > limit:
+                    event[key] = text[:limit] + TRUNCATION_MARKER
+            data = self.encode(event)
+            if utf8_len(data) <= self.max_event_bytes or limit == 0:
+                return data
+            limit //= 2
+
+    def _splitBulk(self, events):
         """
+        Split (line, size, level) events into bulk bodies that each stay
+        under max_bulk_bytes.
 
-        pid = os.getpid()
-        if pid != self.pid:
-            self.pid = pid
-            self.logs = []
-            self.timer = self._flushAndRepeatTimer()
-            atexit.register(self._stopFlushTimer)
+        returns: a list of (lines, level) tuples
+        """
+        chunks = []
+        lines = []
+        level = logging.NOTSET
+        nbytes = 0
+        for data, size, event_level in events:
+            # each line after the first also costs its newline
+            if lines and nbytes + 1 + size > self.max_bulk_bytes:
+                chunks.append((lines, level))
+                lines = []
+                level = logging.NOTSET
+                nbytes = 0
+            nbytes += size + 1 if lines else size
+            lines.append(data)
+            level = max(level, event_level)
+        if lines:
+            chunks.append((lines, level))
+        return chunks
+
+    def _prepEvent(self, d):
+        """
+        Serialize a payload into a bulk line.
+
+        returns: an event tuple of the tags of its thread, its tag_fields
+        values, the line, its size in bytes and its logging level
+        """
+        tags = ()
+        if self.group_by_thread:
+            tags = (d.pop('pid', 'nopid'), d.pop('tid', 'notid'))
+        values = ()
+        if self.tag_fields:
+            values = tuple(UNSAFE_TAG.sub('_', u'{}'.format(d.get(field)))
+                           for field in self.tag_fields)
+        data, size = self._serializeEvent(d)
+        level = logging.getLevelName(d.get('level'))
+        if not isinstance(level, int):
+            level = logging.NOTSET
+        return tags, values, data, size, level
+
+    def _buildBulks(self, events):
+        """
+        Group events into bulk requests.
 
-        # avoid infinite recursion
-        if record.name.startswith('requests'):
+        returns: a list of (url, lines, level) tuples, one per request
+        """
+        groups = {}
+        # combinations of tag_fields values tagged so far
+        tag_groups = set()
+        for tags, values, data, size, level in events:
+            if values:
+                if (values in tag_groups or
+                        len(tag_groups) < self.max_tag_groups):
+                    tag_groups.add(values)
+                    tags += values
+            groups.setdefault(tags, []).append((data, size, level))
+
+        bulks = []
+        for tags, events in groups.items():
+            url = self._getEndpoint(add_tags=list(tags))
+            for lines, level in self._splitBulk(events):
+                bulks.append((url, lines, level))
+        return bulks
+
+    def flush(self, current_batch=None, attempt=1):
+        """
+        Send the collected logs, or current_batch, a list of payloads.
+
+        returns: how many logs were sent
+        """
+        if current_batch is None:
+            self._drainQueue()
+            self._collectRepeats()
+            with self.batch_lock:
+                self.logs, events = [], self.logs
+                self.logs_nbytes = 0
+        else:
+            events = [self._prepEvent(d) for d in current_batch]
+        if events:
+            for url, data, level in self._buildBulks(events):
+                self.retry_policy.budget.deposit()
+                self._sendBulk(url, data, level, attempt)
+        return len(events)
+
+    def close(self):
+        """
+        Stop the flush timer and send whatever is still collected. Posts
+        that fail from now on, and retries not yet sent, are spooled, or
+        reported dropped, rather than retried.
+        """
+        self._stopSummaryTimer()
+        self.timer.set()
+        self.wake.set()
+        self._collectRepeats(everything=True)
+        self.closing = True
+        self.flush()
+        super(LogglyHandler, self).close()
+        self._finishPosts()
+        if self.runtime is None:
+            self.scheduler.stop()
+        if self.spool is not None:
+            self.spool.close()
+
+    def _finishPosts(self):
+        """
+        Wait up to CLOSE_WAIT seconds for the posts in flight, then give up
+        the retries still waiting to be sent.
+        """
+        with self.batch_lock:
+            inflight = [f for f in self.inflight
+                        if isinstance(f, futures.Future)]
+        if inflight:
+            futures.wait(inflight, timeout=CLOSE_WAIT)
+        with self.batch_lock:
+            retries, self.retries = self.retries, []
+        for call in retries:
+            if call.started or call.cancelled:
+                continue
+            call.cancel()
+            url, lines, level, attempt = call.args
+            self._giveUp(url, lines, 'handler closed before retrying post')
+
+    def _afterFork(self):
+        """
+        Start over in the child after a fork, with an empty buffer and a
+        flush timer of its own. The atexit hook registered by the parent
+        still flushes it when the child exits.
+        """
+        super(LogglyHandler, self)._afterFork()
+        self.logs = []
+        self.logs_nbytes = 0
+        self.inflight = set()
+        self.retries = []
+        self.retry_policy.budget.afterFork()
+        if self.aggregator is not None:
+            self.aggregator.afterFork()
+        if self.aws_tag and self.ec2_id is None:
+            # the parent's lookup thread isn't in the child
+            self.aws_lookup = self._lookupInstanceId()
+        self.wake = threading.Event()
+        self.next_flush = None
+        self.flush_woken = False
+        if self.runtime is not None:
+            self.scheduler = self.runtime.scheduler
+        else:
+            self.scheduler = Scheduler(name='LogglyHandler retries')
+        self.timer = self._flushAndRepeatTimer()
+        if self.spool is not None:
+            self.spool.afterFork()
+            # the parent replays what was spooled
+            self.spool_replay = None
+
+    def emit(self, record):
+        aggregator = self.aggregator
+        if (aggregator is not None and
+                not record.name.startswith('requests') and
+                aggregator.add(record)):
             return
+        super(LogglyHandler, self).emit(record)
 
-        self.logs.append(self._prepPayload(record))
+    def _collectRepeats(self, everything=False):
+        """
+        Collect an event for each window of repeats that is over, or for
+        all of them.
+        """
+        if self.aggregator is None:
+            return
+        for repeats in self.aggregator.collect(time.time(), everything):
+            payload = self._prepPayload(repeats.record)
+            payload['count'] = repeats.count
+            payload['first_created'] = repeats.first
+            payload['last_created'] = repeats.last
+            payload['sample_args'] = repeats.samples
+            self._collectPayload(payload)
+
+    def _emitNow(self, record):
+        self._collectPayload(self._prepPayload(record))
+
+    def _collectPayload(self, payload):
+        payload.setdefault('tags', self._implodeTags())
+        event = self._prepEvent(payload)
+        with self.batch_lock:
+            self.logs.append(event)
+            self.logs_nbytes += event[3]
+            full = ((self.flush_count and
+                     len(self.logs) >= self.flush_count) or
+                    (self.flush_bytes and
+                     self.logs_nbytes >= self.flush_bytes))
+        if full:
+            self._wakeFlush()
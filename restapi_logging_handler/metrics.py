@@ -0,0 +1,197 @@
+from __future__ import absolute_import
+
+import bisect
+import sys
+import threading
+
+try:
+    from time import perf_counter as clock
+except ImportError:  # python 2
+    from time import time as clock
+
+# upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01,
+                   0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+# what each metric counts, for the Prometheus HELP lines
+DESCRIPTIONS = {
+    'records': 'records handled, suppressed ones included',
+    'batches': 'bulk requests sent',
+    'posts': 'POSTs sent',
+    'post_errors': 'POSTs that failed or got an error status',
+    'bytes': 'request body bytes sent',
+    'retries': 'POSTs retried',
+    'suppressed': 'records suppressed by sampling or rate limits',
+    'records_failed': 'records given up on after retrying',
+    'records_spooled': 'records spooled to disk after retrying',
+    'queue_depth': 'records queued for the deferred worker',
+    'pending': 'POSTs waiting for or using a worker',
+    'buffered': 'records collected and not yet flushed',
+    'dropped': 'records dropped',
+    'emit_seconds': 'time spent in emit() on the logging thread',
+    'serialize_seconds': 'time spent encoding payloads',
+    'flush_seconds': 'time spent in flush()',
+    'post_seconds': 'time from submitting a POST to its completion',
+    'http_seconds': 'time from sending a request to its response',
+}
+
+
+class Histogram(object):
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # the last bucket holds what is over every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {'count': self.count, 'sum': self.sum, 'buckets': cumulative}
+
+
+class Metrics(object):
+    """
+    Counters, gauges and latency histograms of a handler. Recording is a
+    dict update under a lock; gauges are only read when a snapshot is taken.
+    """
+
+    def __init__(self, name='RestApiHandler', buckets=DEFAULT_BUCKETS):
+        """
+        name: the handler label of the exported metrics
+        buckets: upper bounds, in seconds, of the histogram buckets
+        """
+        self.name = name
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def timed(self, name, function):
+        """
+        Wrap function to observe how long each call takes as name.
+        """
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.observe(name, clock() - start)
+
+        return wrapper
+
+    def gauge(self, name, function):
+        """
+        Report the value returned by function as name in every snapshot.
+        """
+        self.gauges[name] = function
+
+    def snapshot(self):
+        """
+        returns: a dict of 'counters', 'gauges' and 'histograms', each a
+        dict by metric name. Histograms hold their count, sum and buckets,
+        a list of (upper bound, cumulative count) tuples.
+        """
+        gauges = {}
+        for name, function in self.gauges.items():
+            try:
+                gauges[name] = function()
+            except Exception:
+                gauges[name] = None
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': gauges,
+                'histograms': {name: histogram.snapshot()
+                               for name, histogram in self.histograms.items()},
+            }
+
+    def prometheus(self, prefix='restapi_logging'):
+        """
+        The snapshot in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        label = 'handler="{}"'.format(self.name)
+        lines = []
+
+        def header(name, kind, metric):
+            lines.append('# HELP {} {}'.format(
+                name, DESCRIPTIONS.get(metric, metric)))
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+        for metric, value in sorted(snapshot['counters'].items()):
+            name = '{}_{}_total'.format(prefix, metric)
+            header(name, 'counter', metric)
+            lines.append('{}{{{}}} {}'.format(name, label, value))
+        for metric, value in sorted(snapshot['gauges'].items()):
+            if value is None:
+                continue
+            name = '{}_{}'.format(prefix, metric)
+            header(name, 'gauge', metric)
+            lines.append('{}{{{}}} {}'.format(name, label, value))
+        for metric, histogram in sorted(snapshot['histograms'].items()):
+            name = '{}_{}'.format(prefix, metric)
+            header(name, 'histogram', metric)
+            for bound, count in histogram['buckets']:
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    name, label, le, count))
+            lines.append('{}_sum{{{}}} {}'.format(
+                name, label, histogram['sum']))
+            lines.append('{}_count{{{}}} {}'.format(
+                name, label, histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def afterFork(self):
+        """
+        Runs in the child after a fork, where the lock may have been held
+        by one of the parent's threads: the counts so far are the parent's,
+        start over.
+        """
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def export(self, interval, callback):
+        """
+        Call callback(snapshot) every interval seconds on a thread.
+
+        returns: an Event that stops it once set
+        """
+        stopped = threading.Event()
+
+        def loop():
+            while not stopped.wait(interval):
+                try:
+                    callback(self.snapshot())
+                except Exception as e:
+                    sys.stderr.write(
+                        '{}: metrics export failed error {}\n'.format(
+                            self.name, repr(e)))
+
+        t = threading.Thread(target=loop)
+        t.daemon = True  # stop if the program exits
+        t.start()
+        return stopped
@@ -1,11 +1,33 @@
-import datetime
-import uuid
 import logging
 import json
-import traceback
+import os
+import sys
+import threading
+import time
+import weakref
+from functools import partial
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 from requests_futures.sessions import FuturesSession
 
+from restapi_logging_handler.backpressure import BLOCK, PendingLimiter
+from restapi_logging_handler.circuit import HALF_OPEN
+from restapi_logging_handler.compression import check_encoding, compress
+from restapi_logging_handler.metrics import Metrics, clock
+from restapi_logging_handler.runtime import SharedRuntime, configure_session
+from restapi_logging_handler.sampling import Sampler
+from restapi_logging_handler.serialization import (
+    DEFAULT_SERIALIZER,
+    get_encoder,
+    serialize,
+    utf8_len,
+)
+from restapi_logging_handler.tracebacks import TracebackFormatter
+
 """
 logrecord attributes
     %(name)s            Name of the logger (logging channel)
@@ -93,33 +115,69 @@ TOP_KEYS = {
     'name',
 }
 
+# where TOP_KEYS and META_KEYS go in the payload: (in meta, payload name)
+PAYLOAD_ROUTES = {
+    'name': (False, 'log'),
+    'levelname': (False, 'level'),
+    'created': (True, 'created'),
+    'funcName': (True, 'funcName'),
+    'lineno': (True, 'line'),
+}
 
-def serialize(obj):
-    """JSON serializer for objects not serializable by default json code"""
-    if isinstance(obj, datetime.datetime):
-        serial = obj.isoformat(sep='T')
-        return serial
+# route of record attributes that go in the payload details
+DETAIL = object()
 
-    if isinstance(obj, uuid.UUID):
-        serial = str(obj)
-        return serial
+# seconds to wait for a connection, and then for the response, per POST
+DEFAULT_TIMEOUT = (5.0, 30.0)
 
-    try:
-        return obj.__dict__
-    except AttributeError:
-        return str(obj)
-    except Exception as e:
-        strval = 'unknown obj'
-        exceptval = 'unknown err'
+# how the records of a batch are joined into one request body
+BATCH_FORMATS = {
+    'ndjson': ('', '\n', '', 'application/x-ndjson'),
+    'array': ('[', ',', ']', 'application/json'),
+}
+
+
+# handlers to start over in the child after a fork
+_handlers = weakref.WeakSet()
+
+
+def _afterForkInChild():
+    SharedRuntime.afterForkAll()
+    for handler in list(_handlers):
         try:
-            strval = str(obj)
-            exceptval = repr(e)
-        except Exception:
-            pass
-        return 'json fail {} {}'.format(exceptval, strval)
+            handler._afterFork()
+        except Exception as e:
+            sys.stderr.write(
+                '{}: could not reset after fork error {}\n'.format(
+                    handler.__class__.__name__, repr(e)))
+
+
+# python 3.7+; before that handlers check the pid on each emit
+AT_FORK_HOOKS = hasattr(os, 'register_at_fork')
+if AT_FORK_HOOKS:
+    os.register_at_fork(after_in_child=_afterForkInChild)
+
+
+def setInterval(interval):
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            stopped = threading.Event()
+
+            def loop():  # executed in another thread
+                while not stopped.wait(interval):  # until stopped
+                    function(*args, **kwargs)
 
+            t = threading.Thread(target=loop)
+            t.daemon = True  # stop if the program exits
+            t.start()
+            return stopped
 
-# test
+        return wrapper
+
+    return decorator
+
+
+# superseded by Serializer, which leaves json types as they are
 def simple_json(obj):
     try:
         return json.dumps(obj, default=serialize)
@@ -133,28 +191,241 @@ class RestApiHandler(logging.Handler):
     """
 
     def __init__(self, endpoint, content_type='json',
-                 ignored_record_keys=None):
+                 ignored_record_keys=None,
+                 batch_size=None,
+                 batch_bytes=None,
+                 batch_interval=None,
+                 batch_format='ndjson',
+                 max_pending=None,
+                 overflow_policy=BLOCK,
+                 block_timeout=1.0,
+                 drop_level=logging.WARNING,
+                 compression=None,
+                 compression_threshold=1024,
+                 compression_level=None,
+                 serializer=None,
+                 json_encoder='auto',
+                 deferred=False,
+                 max_queue=10000,
+                 circuit_breaker=None,
+                 runtime=None,
+                 max_workers=32,
+                 pool_connections=10,
+                 pool_maxsize=None,
+                 keep_alive=True,
+                 timeout=DEFAULT_TIMEOUT,
+                 metrics=None,
+                 sampling=None,
+                 sampling_summary_interval=60.0,
+                 traceback_cache_size=256,
+                 max_traceback_frames=None,
+                 max_traceback_bytes=None):
         """
         endpoint: define the fully qualified RESTful API endpoint to POST to.
         content_type: only supports JSON currently
+        batch_size: send a batch once it holds this many records
+        batch_bytes: send a batch once its serialized records reach this size
+        batch_interval: send any pending batch every this many seconds
+        batch_format: 'ndjson' or 'array', how a batch is joined into a body
+        max_pending: most POSTs allowed to wait for a worker at once,
+            unlimited if None
+        overflow_policy: what to do with a POST when max_pending is reached,
+            'block', 'drop_newest', 'drop_oldest' or 'drop_below'
+        block_timeout: seconds to wait for room before dropping when blocking
+        drop_level: the 'drop_below' policy drops records under this level
+        compression: 'gzip' or 'zstd' to compress batch bodies, None for none
+        compression_threshold: batch bodies under this many bytes are sent
+            uncompressed
+        compression_level: compression level, the library default if None
+        serializer: callable making detail values json encodable, a
+            default Serializer if None
+        json_encoder: 'auto', 'orjson', 'ujson', 'json' or a callable like
+            json.dumps, see serialization.get_encoder
+        deferred: if True, emit() only snapshots the record and queues it,
+            and a background thread builds, serializes and sends payloads
+        max_queue: most records a deferred handler holds before dropping
+        circuit_breaker: a CircuitBreaker to stop posting to the endpoint
+            while it keeps failing, None to always post
+        runtime: a SharedRuntime to use the threads and connections of, or
+            True for the process-wide one, in place of the handler's own
+        max_workers: threads doing the POSTs
+        pool_connections: hosts to keep a pool of connections for
+        pool_maxsize: connections kept per host, max_workers if None
+        keep_alive: False to close each connection after its request
+        timeout: seconds to wait for each POST, either one number or a
+            (connect, read) tuple, None to wait forever
+        metrics: a Metrics to record counts and latencies in, or True for
+            a new one, None to record nothing
+        sampling: a Sampler, or a list of SamplingRules, deciding which
+            records below ERROR are sent before their payloads are built
+        sampling_summary_interval: seconds between the WARNING records
+            counting what sampling suppressed, when sampling is a list
+        traceback_cache_size: most formatted tracebacks remembered, so the
+            same failure logged again isn't formatted again, 0 for none
+        max_traceback_frames: most frames sent of each traceback, the
+            innermost kept, all if None
+        max_traceback_bytes: tracebacks over this size keep only their end
+
+        Records are sent one POST each unless one of batch_size, batch_bytes
+        or batch_interval is given, in which case they are collected and
+        POSTed together.
         """
+        if batch_format not in BATCH_FORMATS:
+            raise ValueError(
+                'batch_format must be one of {}'.format(
+                    ', '.join(sorted(BATCH_FORMATS))))
+
+        check_encoding(compression)
+
+        if runtime is True:
+            runtime = SharedRuntime.default()
+        self.runtime = runtime
+
+        self.max_workers = max_workers
+        self.pool_connections = pool_connections
+        self.pool_maxsize = (pool_maxsize if pool_maxsize is not None
+                             else max_workers)
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+
         self.endpoint = endpoint
         self.content_type = content_type
-        self.session = FuturesSession(max_workers=32)
+        self.session = self._createSession()
         self.ignored_record_keys = (ignored_record_keys if ignored_record_keys
                                     else DEFAULT_IGNORED_KEYS)
         foo = TOP_KEYS.union(META_KEYS)
         self.detail_ignore_set = self.ignored_record_keys.union(foo)
+        self._key_routes = self._routeKeys()
+        self.serializer = (serializer if serializer is not None
+                           else DEFAULT_SERIALIZER)
+        self.encode = get_encoder(json_encoder, default=serialize)
+        self.tracebacks = TracebackFormatter(
+            cache_size=traceback_cache_size,
+            max_frames=max_traceback_frames,
+            max_bytes=max_traceback_bytes)
+
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.batch_interval = batch_interval
+        self.batch_format = batch_format
+        self.batching = any(
+            v is not None for v in (batch_size, batch_bytes, batch_interval))
+        self.batch = []
+        self.batch_nbytes = 0
+        self.batch_level = logging.NOTSET
+        self.batch_lock = threading.RLock()
+        self.batch_timer = None
+
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.compression_level = compression_level
+
+        self.limiter = None
+        if max_pending is not None:
+            self.limiter = PendingLimiter(
+                max_pending,
+                policy=overflow_policy,
+                timeout=block_timeout,
+                drop_level=drop_level,
+                name=self.__class__.__name__,
+            )
+
+        self.breaker = circuit_breaker
+
+        self.deferred = deferred
+        self.queue = None
+        self.queue_dropped = 0
+        self.worker = None
+        self.pid = os.getpid()
 
         logging.Handler.__init__(self)
 
+        if isinstance(sampling, (list, tuple)):
+            sampling = Sampler(sampling,
+                               summary_interval=sampling_summary_interval)
+        self.sampler = sampling
+        self.summary_timer = None
+
+        if metrics is True:
+            metrics = Metrics(name=self.__class__.__name__)
+        self.metrics = metrics
+        if metrics is not None:
+            self._instrument(metrics)
+
+        if runtime is not None:
+            runtime.register(self)
+        _handlers.add(self)
+
+        if deferred:
+            self.queue = queue.Queue(maxsize=max_queue)
+            if runtime is None:
+                self.worker = self._startWorker()
+
+        if self.batching and batch_interval:
+            self.batch_timer = self._batchTimer()
+        if self.sampler is not None:
+            self.summary_timer = self._summaryTimer()
+
+    def _instrument(self, metrics):
+        """
+        Time every encode and flush, and report the queue, batch and drop
+        counts as gauges. Handlers without metrics pay nothing for this.
+        """
+        self.encode = metrics.timed('serialize_seconds', self.encode)
+        self.flush = metrics.timed('flush_seconds', self.flush)
+        metrics.gauge('buffered', lambda: len(self.batch))
+        metrics.gauge('dropped', self._droppedTotal)
+        if self.deferred:
+            metrics.gauge('queue_depth', lambda: self.queue.qsize())
+        if self.limiter is not None:
+            metrics.gauge('pending', lambda: self.limiter.count)
+
+    def _droppedTotal(self):
+        total = self.queue_dropped
+        if self.limiter is not None:
+            total += self.limiter.dropped_total
+        if self.breaker is not None:
+            total += self.breaker.dropped
+        return total
+
+    def _recordPost(self, start, future):
+        """
+        Observe how long a POST took and whether it failed.
+        """
+        metrics = self.metrics
+        metrics.observe('post_seconds', clock() - start)
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            metrics.inc('post_errors')
+            return
+        resp = future.result()
+        elapsed = getattr(resp, 'elapsed', None)
+        if elapsed is not None:
+            metrics.observe('http_seconds', elapsed.total_seconds())
+        if resp.status_code >= 400:
+            metrics.inc('post_errors')
+
+    def _createSession(self):
+        """
+        Build the session POSTs are sent through.
+        """
+        if self.runtime is not None:
+            return self.runtime.session
+        return configure_session(
+            FuturesSession(max_workers=self.max_workers),
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            keep_alive=self.keep_alive)
+
     def _getTraceback(self, record):
         """
-        Format the traceback of the record, if exists.
+        Format the traceback of the record, if exists, from its exc_info,
+        or take its exc_text if a formatter has filled it in.
         """
         if record.exc_info:
-            return traceback.format_exc()
-        return None
+            return self.tracebacks.format(record.exc_info, record.exc_text)
+        return record.exc_text or None
 
     def _getEndpoint(self):
         """
@@ -163,37 +434,55 @@ class RestApiHandler(logging.Handler):
         """
         return self.endpoint
 
+    def _routeKeys(self):
+        """
+        Classify record attributes once, so _getPayload can sort a record
+        in a single pass.
+
+        returns: a dict of attribute name to its PAYLOAD_ROUTES entry, or to
+        None if it is left out. Attributes not in the dict are details.
+        """
+        routes = dict.fromkeys(self.detail_ignore_set)
+        # sent as pid and tid whatever the ignored keys are
+        routes['process'] = routes['thread'] = None
+        routes.update(
+            (k, v) for k, v in PAYLOAD_ROUTES.items()
+            if k in TOP_KEYS or k in META_KEYS
+        )
+        return routes
+
     def _getPayload(self, record):
         """
         The data that will be sent to the RESTful API
         """
 
-        try:
-            # top level payload items
-            d = record.__dict__
-            pid = d.pop('process', 'nopid')
-            tid = d.pop('thread', 'notid')
+        d = record.__dict__
+        pid = d.get('process', 'nopid')
+        tid = d.get('thread', 'notid')
 
+        try:
+            meta = {'line': 'n/a'}
+            details = {}
             payload = {
-                k: v for (k, v) in d.items()
-                if k in TOP_KEYS
-            }
-
-            # logging meta attributes
-            payload['meta'] = {
-                k: v for (k, v) in d.items()
-                if k in META_KEYS
+                'log': 'n/a',
+                'level': 'n/a',
+                'meta': meta,
+                'details': details,
             }
 
-            # everything else goes in details
-            payload['details'] = {
-                k: simple_json(v) for (k, v) in d.items()
-                if k not in self.detail_ignore_set
-            }
-
-            payload['log'] = payload.pop('name', 'n/a')
-            payload['level'] = payload.pop('levelname', 'n/a')
-            payload['meta']['line'] = payload['meta'].pop('lineno', 'n/a')
+            routes = self._key_routes
+            serializer = self.serializer
+            for k, v in d.items():
+                route = routes.get(k, DETAIL)
+                if route is DETAIL:
+                    # everything else goes in details
+                    details[k] = serializer(v)
+                elif route is not None:
+                    in_meta, name = route
+                    if in_meta:
+                        meta[name] = v
+                    else:
+                        payload[name] = v
 
             payload['message'] = record.getMessage()
             tb = self._getTraceback(record)
@@ -219,12 +508,388 @@ class RestApiHandler(logging.Handler):
         returns: a tuple of the data and the http content-type
         """
         payload = self._getPayload(record)
-        json_data = json.dumps(payload, default=serialize)
+        json_data = self.encode(payload)
 
         return {
             'json': (json_data, 'application/json')
         }.get(self.content_type, (json_data, 'text/plain'))
 
+    def _batchTimer(self):
+        if self.runtime is not None:
+            return self.runtime.every(self.batch_interval, self.flush)
+
+        @setInterval(self.batch_interval)
+        def repeat():
+            self.flush()
+
+        return repeat()
+
+    def _summaryTimer(self):
+        interval = self.sampler.summary_interval
+        if self.runtime is not None:
+            return self.runtime.every(interval, self._logSuppressed)
+
+        @setInterval(interval)
+        def repeat():
+            self._logSuppressed()
+
+        return repeat()
+
+    def _logSuppressed(self):
+        """
+        Send a summary of the records sampling suppressed, if there were any.
+        """
+        record = self.sampler.summary_record()
+        if record is not None:
+            self.handle(record)
+
+    def _stopSummaryTimer(self):
+        """
+        Stop the summary timer and send a last summary.
+        """
+        if self.summary_timer is not None:
+            self.summary_timer.set()
+            self.summary_timer = None
+            self._logSuppressed()
+
+    def _post(self, url, data, headers, level=logging.NOTSET, records=1,
+              callback=None, resend=None):
+        """
+        POST through the session, subject to the max_pending limit.
+        level: highest level of the records being sent
+        records: how many records are being sent
+        resend: callable sending the request once the circuit breaker
+            closes, if it is held back; this POST again if None
+
+        returns: the request future, or None if it was dropped or held back
+        """
+        breaker = self.breaker
+        probe = False
+        if breaker is not None:
+            allowed = breaker.allow()
+            if not allowed:
+                self._holdPost(url, data, headers, level, records, callback,
+                               resend)
+                return None
+            probe = allowed == HALF_OPEN
+
+        kwargs = {'data': data, 'headers': headers, 'timeout': self.timeout}
+        if callback is not None:
+            kwargs['background_callback'] = callback
+        send = partial(self.session.post, url, **kwargs)
+
+        metrics = self.metrics
+        if metrics is not None:
+            start = clock()
+        try:
+            if self.limiter is None:
+                future = send()
+            else:
+                future = self.limiter.submit(send, level=level,
+                                             records=records)
+        except Exception:
+            if probe:
+                breaker.release_probe()
+            raise
+        if future is None and probe:
+            breaker.release_probe()
+        if future is not None and breaker is not None:
+            future.add_done_callback(
+                partial(self._recordOutcome, probe=probe))
+        if future is not None and metrics is not None:
+            metrics.inc('posts')
+            metrics.inc('bytes', len(data))
+            future.add_done_callback(partial(self._recordPost, start))
+        return future
+
+    def _holdPost(self, url, data, headers, level, records, callback,
+                  resend=None):
+        """
+        Keep back a POST while the circuit breaker is open.
+        """
+        if resend is None:
+            resend = partial(self._post, url, data, headers, level, records,
+                             callback)
+        self.breaker.hold(resend, records)
+
+    def _recordOutcome(self, future, probe=False):
+        """
+        Tell the circuit breaker how a POST went, and send what it held back
+        once it closes.
+        probe: True if the POST was the breaker's probe
+        """
+        if future.cancelled():
+            if probe:
+                self.breaker.release_probe()
+            return
+        error = future.exception()
+        status_code = None
+        if error is None:
+            status_code = future.result().status_code
+        if self.breaker.failed(status_code, error):
+            self.breaker.record_failure()
+            return
+        held = self.breaker.record_success()
+        if held is not None:
+            self._circuitClosed(held)
+
+    def _circuitClosed(self, held):
+        """
+        The endpoint is back, send what was held back meanwhile. Runs in a
+        POST's done callback, so the sending is left to another thread, as
+        it may wait for room under max_pending.
+        held: callables sending the held POSTs
+        """
+        if held:
+            self._callSoon(self._sendHeld, held)
+
+    def _callSoon(self, function, *args):
+        """
+        Run function on the runtime's scheduler if there is one, otherwise
+        on a thread of its own.
+        """
+        if self.runtime is not None:
+            call = self.runtime.scheduler.call_later(0, function, *args)
+            if not call.cancelled:
+                return
+        t = threading.Thread(target=function, args=args)
+        t.daemon = True  # stop if the program exits
+        t.start()
+
+    def _sendHeld(self, held):
+        for send in held:
+            try:
+                send()
+            except Exception as e:
+                sys.stderr.write(
+                    '{}: could not post held request error {}\n'.format(
+                        self.__class__.__name__, repr(e)))
+
+    def _encodeBatch(self, data, content_type):
+        """
+        Compress a bulk body if the handler is set up to.
+
+        returns: a tuple of the body and the http headers to send it with
+        """
+        headers = {'content-type': content_type}
+        data, encoding = compress(data,
+                                  self.compression,
+                                  threshold=self.compression_threshold,
+                                  level=self.compression_level)
+        if encoding is not None:
+            headers['content-encoding'] = encoding
+        return data, headers
+
+    def _postBatch(self, url, data, content_type, level=logging.NOTSET,
+                   records=1, callback=None, resend=None):
+        """
+        POST a bulk body, compressed if the handler is set up to.
+        """
+        data, headers = self._encodeBatch(data, content_type)
+        if self.metrics is not None:
+            self.metrics.inc('batches')
+        return self._post(url, data, headers, level=level, records=records,
+                          callback=callback, resend=resend)
+
+    def _addToBatch(self, data, level):
+        """
+        Collect one prepped record, sending the batch once it is full.
+        """
+        with self.batch_lock:
+            self.batch.append(data)
+            self.batch_nbytes += utf8_len(data)
+            self.batch_level = max(self.batch_level, level)
+            full = ((self.batch_size and len(self.batch) >= self.batch_size)
+                    or (self.batch_bytes and
+                        self.batch_nbytes >= self.batch_bytes))
+
+        if full:
+            self.flush()
+
+    def _joinBatch(self, batch):
+        """
+        Join prepped records into one request body.
+
+        returns: a tuple of the body and the http content-type
+        """
+        start, sep, end, header = BATCH_FORMATS[self.batch_format]
+        if self.content_type != 'json':
+            header = 'text/plain'
+        return start + sep.join(batch) + end, header
+
+    def flush(self):
+        """
+        Send all collected records in one POST.
+        """
+        self._drainQueue()
+        with self.batch_lock:
+            batch, self.batch = self.batch, []
+            level, self.batch_level = self.batch_level, logging.NOTSET
+            self.batch_nbytes = 0
+
+        if not batch:
+            return
+
+        data, header = self._joinBatch(batch)
+        try:
+            self._postBatch(self._getEndpoint(),
+                            data,
+                            header,
+                            level=level,
+                            records=len(batch))
+        except Exception as e:
+            sys.stderr.write(
+                'RestApiHandler: could not post batch of {} records '
+                'error {}'.format(len(batch), repr(e)))
+
+    def _snapshot(self, record):
+        """
+        A copy of the record that stays valid after emit() returns: the
+        message is formatted now, in case its args change later, and the
+        traceback is left for the worker to format from exc_info.
+        """
+        snapshot = record.__class__.__new__(record.__class__)
+        snapshot.__dict__.update(record.__dict__)
+        try:
+            snapshot.msg = record.getMessage()
+            snapshot.args = None
+        except Exception:
+            # left as is, the worker sends it as a could not format payload
+            # like an inline handler does
+            pass
+        return snapshot
+
+    def _startWorker(self):
+        worker = threading.Thread(target=self._work)
+        worker.daemon = True  # stop if the program exits
+        worker.start()
+        return worker
+
+    def _work(self):
+        """
+        Background thread of a deferred handler.
+        """
+        while True:
+            record = self.queue.get()
+            try:
+                if record is None:
+                    return
+                self._emitNow(record)
+            except Exception:
+                self.handleError(record)
+            finally:
+                self.queue.task_done()
+
+    def _drainQueue(self, timeout=5.0):
+        """
+        Wait, up to timeout seconds, for the worker to take care of every
+        queued record.
+        """
+        if self.queue is None or self._onWorker():
+            return
+        done = self.queue.all_tasks_done
+        deadline = time.time() + timeout
+        with done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                done.wait(remaining)
+
+    def _onWorker(self):
+        """
+        Whether this is the thread working through the deferred queue.
+        """
+        current = threading.current_thread()
+        if self.runtime is not None:
+            return current is self.runtime.dispatcher
+        return current is self.worker
+
+    def _stopWorker(self):
+        if not self.deferred:
+            return
+        self._drainQueue()
+        if self.worker is not None:
+            self.queue.put(None)
+            self.worker.join(5.0)
+            self.worker = None
+        if self.queue_dropped:
+            sys.stderr.write(
+                '{}: dropped {} records, queue full\n'.format(
+                    self.__class__.__name__, self.queue_dropped))
+
+    def _afterFork(self):
+        """
+        Runs in the child after a fork. The threads of the parent, and the
+        session's thread pool with them, are not in the child, and its locks
+        may have been held by one of them, so start over with new ones.
+        Records the parent had collected are left for the parent to send.
+        """
+        self.pid = os.getpid()
+        self.batch_lock = threading.RLock()
+        self.batch = []
+        self.batch_nbytes = 0
+        self.batch_level = logging.NOTSET
+        self.session = self._createSession()
+        self.tracebacks.afterFork()
+        if self.metrics is not None:
+            self.metrics.afterFork()
+        if self.limiter is not None:
+            self.limiter.reset()
+        if self.breaker is not None:
+            self.breaker.lock = threading.Lock()
+        if self.deferred:
+            self.queue = queue.Queue(maxsize=self.queue.maxsize)
+            self.queue_dropped = 0
+            if self.runtime is None:
+                self.worker = self._startWorker()
+        if self.batch_timer is not None:
+            self.batch_timer = self._batchTimer()
+        if self.sampler is not None:
+            self.sampler.afterFork()
+            self.summary_timer = self._summaryTimer()
+
+    def close(self):
+        """
+        Stop the batch timer and send whatever is still collected.
+        """
+        # nothing to start over in a child once closed
+        _handlers.discard(self)
+        self._stopSummaryTimer()
+        self._stopWorker()
+        if self.batch_timer is not None:
+            self.batch_timer.set()
+        if self.batching:
+            self.flush()
+        if self.limiter is not None:
+            self.limiter.report()
+        if self.breaker is not None:
+            self.breaker.drop_buffered()
+            self.breaker.report()
+        logging.Handler.close(self)
+
+    def handle(self, record):
+        """
+        Like logging.Handler.handle(), but without holding the handler lock
+        around emit(). Building payloads needs no lock, and the batch and
+        queue are guarded by their own, so threads logging at once don't
+        wait for each other's payloads.
+        """
+        rv = self.filter(record)
+        if isinstance(rv, logging.LogRecord):
+            # filters may return a replacement record since python 3.12
+            record = rv
+        if rv:
+            metrics = self.metrics
+            if metrics is None:
+                self.emit(record)
+            else:
+                start = clock()
+                self.emit(record)
+                metrics.observe('emit_seconds', clock() - start)
+                metrics.inc('records')
+        return rv
+
     def emit(self, record):
         """
         Override emit() method in handler parent for sending log to RESTful API
@@ -233,11 +898,61 @@ class RestApiHandler(logging.Handler):
         if record.name.startswith('requests'):
             return
 
+        if self.sampler is not None and not self.sampler.allow(record):
+            if self.metrics is not None:
+                self.metrics.inc('suppressed')
+            return
+
+        if not AT_FORK_HOOKS and os.getpid() != self.pid:
+            self._afterFork()
+
+        if self.deferred:
+            try:
+                self.queue.put_nowait(self._snapshot(record))
+            except queue.Full:
+                with self.batch_lock:
+                    self.queue_dropped += 1
+                return
+            if self.runtime is not None:
+                self.runtime.dispatch(self)
+            return
+
+        self._emitNow(record)
+
+    def _collectPayload(self, payload):
+        """
+        Send, or add to the batch, a payload built elsewhere, e.g. by a
+        CollectorHandler in another process.
+        """
+        data = self.encode(payload)
+        header = 'application/json' if self.content_type == 'json' \
+            else 'text/plain'
+        level = logging.getLevelName(payload.get('level'))
+        if not isinstance(level, int):
+            level = logging.NOTSET
+
+        if self.batching:
+            self._addToBatch(data, level)
+            return
+        self._post(self._getEndpoint(),
+                   data=data,
+                   headers={'content-type': header},
+                   level=level)
+
+    def _emitNow(self, record):
+        """
+        Build the payload of a record and send it, or add it to the batch.
+        """
         data, header = self._prepPayload(record)
 
+        if self.batching:
+            self._addToBatch(data, record.levelno)
+            return
+
         try:
-            self.session.post(self._getEndpoint(),
-                              data=data,
-                              headers={'content-type': header})
+            self._post(self._getEndpoint(),
+                       data=data,
+                       headers={'content-type': header},
+                       level=record.levelno)
         except Exception:
             self.handleError(record)
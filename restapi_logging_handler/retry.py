@@ -0,0 +1,127 @@
+from __future__ import absolute_import
+
+import random
+import threading
+import time
+from email.utils import mktime_tz, parsedate_tz
+
+# statuses worth trying again; anything else that is not 200 is given up on
+RETRYABLE_STATUSES = frozenset([408, 425, 429, 500, 502, 503, 504])
+
+
+def parse_retry_after(value, now=None):
+    """
+    value: a Retry-After header, in seconds or as an HTTP date
+
+    returns: seconds to wait, or None if value is missing or unreadable
+    """
+    if not value or not isinstance(value, str):
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    now = time.time() if now is None else now
+    return max(0.0, mktime_tz(parsed) - now)
+
+
+class RetryBudget(object):
+    """
+    Caps retries across every request of a handler, so an outage can't
+    multiply the request rate. Each first attempt adds ratio of a retry to
+    the budget, min_per_second more trickle in over time, and each retry
+    takes one.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, max_tokens=20.0):
+        """
+        ratio: retries allowed per request sent
+        min_per_second: retries allowed per second whatever is sent
+        max_tokens: most retries that can be saved up
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.last = time.time()
+        self.lock = threading.Lock()
+        self.exhausted = 0
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.max_tokens,
+            self.tokens + (now - self.last) * self.min_per_second)
+        self.last = now
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """
+        returns: True if a retry may be made
+        """
+        with self.lock:
+            self._refill(time.time())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            self.exhausted += 1
+            return False
+
+    def afterFork(self):
+        """
+        Runs in the child after a fork, where the lock may have been held
+        by one of the parent's threads.
+        """
+        self.lock = threading.Lock()
+
+
+class RetryPolicy(object):
+    """
+    When and how long to wait before sending a failed request again:
+    exponential backoff with full jitter, never sooner than the server's
+    Retry-After.
+    """
+
+    def __init__(self,
+                 base_delay=0.5,
+                 max_delay=30.0,
+                 jitter=True,
+                 retry_statuses=RETRYABLE_STATUSES,
+                 budget=None):
+        """
+        base_delay: seconds to wait before the first retry
+        max_delay: most seconds to wait, unless Retry-After asks for more
+        jitter: wait a random time up to the backoff rather than all of it
+        retry_statuses: response statuses that are retried
+        budget: RetryBudget shared by the retries, a new one if None
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retry_statuses = frozenset(retry_statuses)
+        self.budget = budget if budget is not None else RetryBudget()
+
+    def retryable(self, status_code):
+        """
+        status_code: response status, None if the request got no response
+        """
+        return status_code is None or status_code in self.retry_statuses
+
+    def delay(self, attempt, retry_after=None):
+        """
+        attempt: how many times the request has been sent so far
+        retry_after: seconds the server asked to wait, if any
+
+        returns: seconds to wait before sending it again
+        """
+        backoff = min(self.max_delay,
+                      self.base_delay * (2 ** max(attempt - 1, 0)))
+        if self.jitter:
+            backoff = random.uniform(0, backoff)
+        if retry_after is not None:
+            backoff = max(backoff, retry_after)
+        return backoff
@@ -0,0 +1,193 @@
+from __future__ import absolute_import
+
+import atexit
+import sys
+import threading
+import weakref
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from requests.adapters import HTTPAdapter
+from requests_futures.sessions import FuturesSession
+
+from restapi_logging_handler.scheduler import Scheduler
+
+# records a deferred handler works through before the next handler's turn
+DISPATCH_CHUNK = 100
+
+
+def configure_session(session, pool_connections=10, pool_maxsize=10,
+                      keep_alive=True):
+    """
+    Size the connection pools of a session.
+    pool_connections: hosts to keep a pool of connections for
+    pool_maxsize: connections kept per host, best at least the number of
+        threads posting to it, or the rest reconnect for every request
+    keep_alive: False to close each connection after its request
+    """
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+class SharedRuntime(object):
+    """
+    Threads and connections shared by every handler that opts in, in place
+    of each handler's own: one scheduler thread for flush timers and
+    retries, one session whose fixed pool of worker threads does the POSTs
+    over one connection pool per host, one thread working through the
+    queues of deferred handlers in turn, and one atexit hook.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+    _instances = weakref.WeakSet()
+
+    def __init__(self, max_workers=32, pool_connections=10, pool_maxsize=None,
+                 keep_alive=True, name='restapi-logging'):
+        """
+        max_workers: threads doing POSTs for all the handlers
+        pool_connections: hosts to keep a pool of connections for
+        pool_maxsize: connections kept per host, max_workers if None
+        keep_alive: False to close each connection after its request
+        name: prefix of the thread names
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.pool_connections = pool_connections
+        self.pool_maxsize = (pool_maxsize if pool_maxsize is not None
+                             else max_workers)
+        self.keep_alive = keep_alive
+        self.handlers = weakref.WeakSet()
+        self._start()
+        SharedRuntime._instances.add(self)
+        atexit.register(self.close)
+
+    def _start(self):
+        self.scheduler = Scheduler(name='{}-scheduler'.format(self.name))
+        self.session = configure_session(
+            FuturesSession(max_workers=self.max_workers),
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            keep_alive=self.keep_alive)
+
+        self.lock = threading.Lock()
+        self.ready = queue.Queue()
+        self.scheduled = set()
+        self.dispatcher = None
+        self.closed = False
+
+    @classmethod
+    def afterForkAll(cls):
+        """
+        Runs in the child after a fork, before its handlers are reset: the
+        threads and connections of the parent's runtimes are replaced.
+        """
+        cls._default_lock = threading.Lock()
+        for runtime in list(cls._instances):
+            runtime._start()
+
+    @classmethod
+    def default(cls):
+        """
+        The runtime of the process, created on first use.
+        """
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def register(self, handler):
+        self.handlers.add(handler)
+
+    def every(self, interval, function):
+        """
+        Run function every interval seconds on the scheduler thread.
+
+        returns: an Event that stops it once set
+        """
+        stopped = threading.Event()
+
+        def run():
+            if stopped.is_set():
+                return
+            try:
+                function()
+            except Exception as e:
+                sys.stderr.write(
+                    '{}: timer failed error {}\n'.format(self.name, repr(e)))
+            if not stopped.is_set():
+                self.scheduler.call_later(interval, run)
+
+        self.scheduler.call_later(interval, run)
+        return stopped
+
+    def dispatch(self, handler):
+        """
+        Have the dispatcher thread work through the queue of a deferred
+        handler. Called after each put; a handler already waiting for its
+        turn isn't queued twice.
+
+        returns: the dispatcher thread
+        """
+        with self.lock:
+            if self.dispatcher is None:
+                self.dispatcher = threading.Thread(
+                    target=self._dispatch,
+                    name='{}-dispatcher'.format(self.name))
+                self.dispatcher.daemon = True  # stop if the program exits
+                self.dispatcher.start()
+            if id(handler) in self.scheduled:
+                return self.dispatcher
+            self.scheduled.add(id(handler))
+        self.ready.put(handler)
+        return self.dispatcher
+
+    def _dispatch(self):
+        while True:
+            handler = self.ready.get()
+            if handler is None:
+                return
+            with self.lock:
+                self.scheduled.discard(id(handler))
+            for i in range(DISPATCH_CHUNK):
+                try:
+                    record = handler.queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    handler._emitNow(record)
+                except Exception:
+                    handler.handleError(record)
+                finally:
+                    handler.queue.task_done()
+            else:
+                # more left, go to the back of the line
+                self.dispatch(handler)
+
+    def close(self):
+        """
+        Close every handler, which sends what it still holds, its open
+        aggregation windows and last sampling summary included, then stop
+        the shared threads.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        for handler in list(self.handlers):
+            try:
+                handler.close()
+            except Exception as e:
+                sys.stderr.write(
+                    '{}: close failed error {}\n'.format(self.name, repr(e)))
+        self.scheduler.stop()
+        if self.dispatcher is not None:
+            self.ready.put(None)
+            self.dispatcher.join(5.0)
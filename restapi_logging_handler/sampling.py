@@ -0,0 +1,174 @@
+from __future__ import absolute_import
+
+import logging
+import random
+import threading
+import time
+
+# logger name of the summaries of suppressed records
+SUMMARY_LOGGER = 'restapi_logging_handler.sampling'
+
+_UNMATCHED = object()
+
+
+class TokenBucket(object):
+    """
+    Lets rate events a second through on average, and up to burst at once.
+    Not thread safe; the Sampler holding it takes its lock.
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'last')
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.time() if now is None else now
+
+    def take(self, now):
+        """
+        returns: True if an event may go through now
+        """
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class SamplingRule(object):
+    """
+    Which records of a logger to keep. Records at ERROR and above are always
+    kept, whatever the rules.
+    """
+
+    def __init__(self, logger='', level=logging.WARNING, sample_rate=1.0,
+                 rate_limit=None, burst=None):
+        """
+        logger: name of the logger the rule is for, its children included,
+            '' for every logger
+        level: highest level the rule applies to
+        sample_rate: fraction of the records kept, at random
+        rate_limit: most records kept per second for each logger and level
+        burst: most records kept at once before rate_limit applies, one
+            second's worth if None
+        """
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError('sample_rate must be between 0 and 1')
+        if rate_limit is not None and rate_limit <= 0:
+            raise ValueError('rate_limit must be over 0')
+        self.logger = logger
+        self.level = level
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit
+        self.burst = (burst if burst is not None
+                      else max(1.0, rate_limit or 0.0))
+
+    def matches(self, name, levelno):
+        return levelno <= self.level and (
+            not self.logger or name == self.logger or
+            name.startswith(self.logger + '.'))
+
+
+class Sampler(object):
+    """
+    Decides, before a payload is built, whether a record is kept, by the
+    first SamplingRule for its logger and level, the most specific logger
+    name first. Suppressed records are counted for summary().
+    """
+
+    def __init__(self, rules, summary_interval=60.0):
+        """
+        rules: SamplingRules, records no rule matches are kept
+        summary_interval: seconds between summaries of suppressed records
+        """
+        self.rules = sorted(rules, key=lambda r: -len(r.logger))
+        self.summary_interval = summary_interval
+        self.lock = threading.Lock()
+        # rule of each (logger name, level) seen, so each is matched once
+        self.matched = {}
+        self.buckets = {}
+        self.suppressed = {}
+
+    def _rule(self, key):
+        name, levelno = key
+        if name == SUMMARY_LOGGER:
+            return None
+        for rule in self.rules:
+            if rule.matches(name, levelno):
+                return rule
+        return None
+
+    def allow(self, record):
+        """
+        returns: True if the record is to be sent
+        """
+        levelno = record.levelno
+        if levelno >= logging.ERROR:
+            return True
+        key = (record.name, levelno)
+        rule = self.matched.get(key, _UNMATCHED)
+        if rule is _UNMATCHED:
+            rule = self.matched[key] = self._rule(key)
+        if rule is None:
+            return True
+
+        if rule.sample_rate < 1.0 and random.random() >= rule.sample_rate:
+            self._suppress(key)
+            return False
+        if rule.rate_limit is None:
+            return True
+        with self.lock:
+            now = time.time()
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(
+                    rule.rate_limit, rule.burst, now)
+            if bucket.take(now):
+                return True
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            return False
+
+    def _suppress(self, key):
+        with self.lock:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+
+    def summary(self):
+        """
+        The counts of records suppressed since the last summary, reset.
+
+        returns: a dict of counts by 'logger level', empty if none were
+        """
+        with self.lock:
+            suppressed, self.suppressed = self.suppressed, {}
+        return {
+            '{} {}'.format(name, logging.getLevelName(levelno)): count
+            for (name, levelno), count in suppressed.items()
+        }
+
+    def summary_record(self):
+        """
+        returns: a WARNING record from SUMMARY_LOGGER with the counts of
+        suppressed records as its 'suppressed' detail, or None if none were
+        """
+        suppressed = self.summary()
+        if not suppressed:
+            return None
+        return logging.makeLogRecord({
+            'name': SUMMARY_LOGGER,
+            'levelno': logging.WARNING,
+            'levelname': 'WARNING',
+            'msg': 'suppressed %d records',
+            'args': (sum(suppressed.values()),),
+            'suppressed': suppressed,
+        })
+
+    def afterFork(self):
+        """
+        Runs in the child after a fork: start counting over.
+        """
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.suppressed = {}
@@ -0,0 +1,104 @@
+from __future__ import absolute_import
+
+import heapq
+import itertools
+import sys
+import threading
+import time
+
+
+class ScheduledCall(object):
+    __slots__ = ('when', 'function', 'args', 'cancelled', 'started')
+
+    def __init__(self, when, function, args):
+        self.when = when
+        self.function = function
+        self.args = args
+        self.cancelled = False
+        self.started = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler(object):
+    """
+    Runs functions after a delay on one background thread, started on first
+    use. Functions should be quick; anything slow holds up the rest.
+    """
+
+    def __init__(self, name='restapi-logging-scheduler'):
+        self.name = name
+        self.condition = threading.Condition()
+        self.heap = []
+        self.counter = itertools.count()
+        self.thread = None
+        self.stopped = False
+
+    def call_later(self, delay, function, *args):
+        """
+        Run function(*args) in delay seconds.
+
+        returns: a ScheduledCall that can be cancelled, cancelled already
+        if the scheduler is stopped
+        """
+        call = ScheduledCall(time.time() + max(delay, 0), function, args)
+        with self.condition:
+            if self.stopped:
+                call.cancel()
+                return call
+            # the counter keeps calls due at the same time in order
+            heapq.heappush(self.heap, (call.when, next(self.counter), call))
+            if self.thread is None:
+                self._start()
+            self.condition.notify()
+        return call
+
+    def call_soon(self, function, *args):
+        return self.call_later(0, function, *args)
+
+    def pending(self):
+        with self.condition:
+            return sum(1 for entry in self.heap if not entry[2].cancelled)
+
+    def _start(self):
+        self.thread = threading.Thread(target=self._run, name=self.name)
+        self.thread.daemon = True  # stop if the program exits
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.stopped:
+                        return
+                    if self.heap:
+                        wait = self.heap[0][0] - time.time()
+                        if wait <= 0:
+                            call = heapq.heappop(self.heap)[2]
+                            call.started = True
+                            break
+                        self.condition.wait(wait)
+                    else:
+                        self.condition.wait()
+
+            if call.cancelled:
+                continue
+            try:
+                call.function(*call.args)
+            except Exception as e:
+                sys.stderr.write(
+                    '{}: scheduled call failed error {}\n'.format(
+                        self.name, repr(e)))
+
+    def stop(self):
+        """
+        Stop the thread, dropping calls that are not yet due.
+        """
+        with self.condition:
+            self.stopped = True
+            self.heap = []
+            self.condition.notify()
+        thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(5.0)
@@ -0,0 +1,256 @@
+from __future__ import absolute_import
+
+import datetime
+import decimal
+import json
+import uuid
+from functools import partial
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    text_type = unicode
+    NATIVE_TYPES = (str, unicode, int, long, float, bool, type(None))  # noqa
+except NameError:
+    text_type = str
+    NATIVE_TYPES = (str, int, float, bool, type(None))
+
+
+def _isoformat(serializer, obj, depth):
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat(sep='T')
+    return obj.isoformat()
+
+
+def _text(serializer, obj, depth):
+    return serializer.text(obj)
+
+
+def _bytes(serializer, obj, depth):
+    return serializer.text(obj.decode('utf-8', 'replace'))
+
+
+def _exception(serializer, obj, depth):
+    return serializer.text(repr(obj))
+
+
+def _mapping(serializer, obj, depth):
+    if depth >= serializer.max_depth:
+        return serializer.tooDeep(obj)
+    out = {}
+    for i, (k, v) in enumerate(obj.items()):
+        if i == serializer.max_items:
+            out['__truncated__'] = len(obj) - i
+            break
+        if not isinstance(k, NATIVE_TYPES):
+            k = serializer.text(k)
+        out[k] = serializer(v, depth + 1)
+    return out
+
+
+def _sequence(serializer, obj, depth):
+    if depth >= serializer.max_depth:
+        return serializer.tooDeep(obj)
+    out = []
+    for i, v in enumerate(obj):
+        if i == serializer.max_items:
+            out.append('... {} more'.format(len(obj) - i))
+            break
+        out.append(serializer(v, depth + 1))
+    return out
+
+
+def _object(serializer, obj, depth):
+    """
+    Fallback for anything else: its attributes if it has any, else its
+    string form.
+    """
+    try:
+        attributes = vars(obj)
+    except TypeError:
+        return serializer.text(obj)
+    if depth >= serializer.max_depth:
+        return serializer.tooDeep(obj)
+    return _mapping(serializer, attributes, depth)
+
+
+# how values of a type, or of its subclasses, are made json encodable;
+# None means json encodes them as they are
+HANDLERS = {
+    str: None,
+    int: None,
+    float: None,
+    bool: None,
+    type(None): None,
+    dict: _mapping,
+    list: _sequence,
+    tuple: _sequence,
+    set: _sequence,
+    frozenset: _sequence,
+    datetime.datetime: _isoformat,
+    datetime.date: _isoformat,
+    datetime.time: _isoformat,
+    uuid.UUID: _text,
+    decimal.Decimal: _text,
+    bytes: _bytes,
+    bytearray: _bytes,
+    BaseException: _exception,
+    object: _object,
+}
+if text_type is not str:
+    HANDLERS[text_type] = None
+    HANDLERS[long] = None  # noqa
+
+
+class Serializer(object):
+    """
+    Turns log record values into something json can encode natively.
+
+    Values of json types are passed through untouched. For everything else
+    a handler is looked up once per type, along its method resolution order
+    in HANDLERS, and cached. Objects with neither a handler nor json type
+    fall back to their __dict__, which is bounded in depth and size so one
+    big object can't stall logging.
+    """
+
+    def __init__(self, max_depth=4, max_items=100, max_string=4096,
+                 handlers=None):
+        """
+        max_depth: containers and objects nested deeper than this are
+            replaced by a short description
+        max_items: most keys or items kept from a container or object
+        max_string: most characters kept of a value's string form
+        handlers: extra {type: function(serializer, obj, depth)} handlers,
+            taking precedence over HANDLERS
+        """
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.max_string = max_string
+        self.registry = dict(HANDLERS)
+        if handlers:
+            self.registry.update(handlers)
+        self.cache = {}
+
+    def __call__(self, obj, depth=0):
+        cls = type(obj)
+        try:
+            handler = self.cache[cls]
+        except KeyError:
+            handler = self.cache[cls] = self._resolve(cls)
+        if handler is None:
+            return obj
+        try:
+            return handler(self, obj, depth)
+        except Exception as e:
+            return 'cannot serialize {} {}'.format(cls, repr(e))
+
+    def _resolve(self, cls):
+        for base in getattr(cls, '__mro__', (cls, object)):
+            if base in self.registry:
+                return self.registry[base]
+        return _object
+
+    def text(self, obj):
+        """
+        String form of obj, cut to max_string characters.
+        """
+        try:
+            text = text_type(obj)
+        except Exception:
+            text = 'unknown obj {}'.format(type(obj))
+        if len(text) > self.max_string:
+            text = text[:self.max_string] + '...'
+        return text
+
+    def tooDeep(self, obj):
+        return '<{} nested too deep>'.format(type(obj).__name__)
+
+
+DEFAULT_SERIALIZER = Serializer()
+
+
+def serialize(obj):
+    """JSON serializer for objects not serializable by default json code"""
+    return DEFAULT_SERIALIZER(obj)
+
+
+def _stdlib_dumps(obj, default):
+    return json.dumps(obj, default=default)
+
+
+def _orjson_dumps(obj, default):
+    return orjson.dumps(
+        obj, default=default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+
+def _ujson_dumps(obj, default):
+    return ujson.dumps(obj, default=default, escape_forward_slashes=False)
+
+
+# json libraries by name, fastest first; None where not installed
+ENCODERS = {
+    'orjson': _orjson_dumps if orjson is not None else None,
+    'ujson': _ujson_dumps if ujson is not None else None,
+    'json': _stdlib_dumps,
+}
+AUTO_ORDER = ('orjson', 'ujson', 'json')
+
+
+def get_encoder(encoder='auto', default=serialize):
+    """
+    encoder: 'auto' for the fastest installed library, 'orjson', 'ujson' or
+        'json' for a given one, or a callable taking (obj, default) like
+        json.dumps, called as encoder(obj, default=default), returning text
+        or bytes
+    default: hook for objects the library can't encode, as in json.dumps
+
+    returns: a function encoding an object to JSON text. Anything the chosen
+    encoder fails on is retried with the stdlib json module.
+    """
+    if callable(encoder):
+        dumps = encoder
+    elif encoder == 'auto':
+        dumps = next(ENCODERS[name] for name in AUTO_ORDER if ENCODERS[name])
+    elif encoder in ENCODERS:
+        dumps = ENCODERS[encoder]
+        if dumps is None:
+            raise ValueError(
+                'json encoder {} is not installed'.format(encoder))
+    else:
+        raise ValueError(
+            'json encoder must be a callable, auto or one of {}'.format(
+                ', '.join(AUTO_ORDER)))
+
+    if dumps is _stdlib_dumps:
+        return partial(json.dumps, default=default)
+
+    def encode(obj):
+        try:
+            data = dumps(obj, default=default)
+        except (TypeError, ValueError, OverflowError):
+            return json.dumps(obj, default=default)
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return data
+
+    return encode
+
+
+def utf8_len(text):
+    """
+    Size of text in bytes once UTF-8 encoded.
+    """
+    try:
+        if text.isascii():
+            return len(text)
+    except AttributeError:
+        pass
+    return len(text.encode('utf-8'))
@@ -0,0 +1,306 @@
+from __future__ import absolute_import
+
+import errno
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+# frame header: length of the json metadata, length of the body
+FRAME = struct.Struct('>II')
+
+SEGMENT = '.seg'
+OPEN = '.open'
+REPLAY = '.replay'
+
+
+def _pidAlive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _ownerPid(name):
+    """
+    Pid of the process that wrote, or is replaying, a spool file.
+    Names look like <time>-<pid>-<seq>.seg[.open|.<pid>.replay]
+    """
+    try:
+        if name.endswith(REPLAY):
+            return int(name.split('.')[-2])
+        return int(name.split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def readFrames(path):
+    """
+    Yield the (url, data, headers) requests stored in a segment file. A
+    frame cut short by a crash mid-write ends the segment.
+    """
+    try:
+        f = open(path, 'rb')
+    except (IOError, OSError):
+        # evicted by another process meanwhile
+        return
+    with f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            # empty files can't be mapped, nor can some file systems
+            buf = f.read()
+        try:
+            offset = 0
+            end = len(buf)
+            while offset + FRAME.size <= end:
+                meta_len, body_len = FRAME.unpack_from(buf, offset)
+                start = offset + FRAME.size
+                offset = start + meta_len + body_len
+                if offset > end:
+                    return
+                meta = json.loads(buf[start:start + meta_len].decode('utf-8'))
+                data = buf[start + meta_len:offset]
+                yield meta['url'], bytes(data), meta['headers']
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+
+class DiskSpool(object):
+    """
+    Keeps requests that could not be delivered in append-only segment files
+    so they survive an outage or a restart.
+
+    Each process appends to its own segment, named after its creation time
+    and pid, which ends in .open while written and is renamed to .seg when
+    full or closed. Replaying claims a segment by renaming it to
+    .<pid>.replay, which only one process can win, so several processes can
+    share a directory. Segments of processes that died are claimed too.
+    The directory is held under max_bytes by deleting the oldest segments
+    nobody is writing or replaying.
+    """
+
+    def __init__(self, directory, max_bytes=100 * 1024 * 1024,
+                 segment_bytes=4 * 1024 * 1024):
+        """
+        directory: where segments are kept, created if missing
+        max_bytes: most bytes kept in the directory, oldest segments go first
+        segment_bytes: size at which a segment is closed and another started
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.segment = None
+        self.segment_size = 0
+        self.file = None
+        self.seq = itertools.count()
+        self.evicted = 0
+        # size of the directory when last listed, plus what was appended
+        # since, None until first listed
+        self.tracked_size = None
+
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _openSegment(self):
+        name = '{:020d}-{}-{}{}{}'.format(
+            int(time.time() * 1e6), os.getpid(), next(self.seq), SEGMENT, OPEN)
+        self.segment = self._path(name)
+        self.segment_size = 0
+        self.file = open(self.segment, 'ab')
+
+    def _closeSegment(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        try:
+            os.rename(self.segment, self.segment[:-len(OPEN)])
+        except OSError as e:
+            # removed by hand, or by a process of an older version
+            if e.errno != errno.ENOENT:
+                raise
+        self.segment = None
+
+    def append(self, url, data, headers):
+        """
+        Store one request.
+        """
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        meta = json.dumps({'url': url, 'headers': headers}).encode('utf-8')
+        frame = FRAME.pack(len(meta), len(data)) + meta + data
+
+        with self.lock:
+            if self.file is None or self.segment_size >= self.segment_bytes:
+                self._closeSegment()
+                self._openSegment()
+            self.file.write(frame)
+            self.file.flush()
+            self.segment_size += len(frame)
+            if self.tracked_size is not None:
+                self.tracked_size += len(frame)
+            if self.tracked_size is None or self.tracked_size > self.max_bytes:
+                self._evict()
+
+    def rotate(self):
+        """
+        Close the segment being written so it can be replayed now, e.g. once
+        the endpoint is back, rather than when it fills up.
+        """
+        with self.lock:
+            self._closeSegment()
+
+    def close(self):
+        self.rotate()
+
+    def afterFork(self):
+        """
+        In the child after a fork, leave the segment being written to the
+        parent and start one of its own on the next append.
+        """
+        self.lock = threading.Lock()
+        self.file = None
+        self.segment = None
+        self.segment_size = 0
+        self.tracked_size = None
+
+    def _listing(self):
+        """
+        Spool files, oldest first, as (name, size) tuples.
+        """
+        files = []
+        for name in sorted(os.listdir(self.directory)):
+            try:
+                files.append((name, os.path.getsize(self._path(name))))
+            except OSError:
+                # gone, another process claimed or evicted it
+                pass
+        return files
+
+    def _evict(self):
+        """
+        Delete the oldest segments until the directory is under max_bytes.
+        Segments other processes are writing or replaying are left alone,
+        as is this one's own.
+        """
+        files = self._listing()
+        total = sum(size for name, size in files)
+        for name, size in files:
+            if total <= self.max_bytes:
+                break
+            if not self._claimable(name):
+                continue
+            try:
+                os.remove(self._path(name))
+                self.evicted += 1
+            except OSError:
+                pass
+            total -= size
+        self.tracked_size = total
+
+    def size(self):
+        return sum(size for name, size in self._listing())
+
+    def _claimable(self, name):
+        if name.endswith(SEGMENT):
+            return True
+        if name.endswith(OPEN) or name.endswith(REPLAY):
+            pid = _ownerPid(name)
+            return (pid is not None and pid != os.getpid() and
+                    not _pidAlive(pid))
+        return False
+
+    def claim(self):
+        """
+        Take over the segments ready to be replayed.
+
+        returns: paths of the claimed segments, oldest first
+        """
+        claimed = []
+        for name, size in self._listing():
+            if not self._claimable(name):
+                continue
+            base = name.split(SEGMENT)[0] + SEGMENT
+            target = self._path('{}.{}{}'.format(base, os.getpid(), REPLAY))
+            try:
+                os.rename(self._path(name), target)
+            except OSError:
+                continue
+            claimed.append(target)
+        return claimed
+
+    def replay(self, send):
+        """
+        Send everything spooled by this or earlier processes.
+        send: function(url, data, headers) returning True once delivered
+
+        returns: the number of requests delivered. Replay stops at the first
+        request that fails; it and the ones after it are spooled again.
+        """
+        delivered = 0
+        while True:
+            segments = self.claim()
+            if not segments:
+                return delivered
+            replayed, failed = self._replaySegments(segments, send)
+            delivered += replayed
+            if failed:
+                return delivered
+
+    def _replaySegments(self, segments, send):
+        """
+        returns: the number of requests delivered, and True if one failed
+        """
+        delivered = 0
+        for i, path in enumerate(segments):
+            frames = readFrames(path)
+            for url, data, headers in frames:
+                if send(url, data, headers):
+                    delivered += 1
+                    continue
+                # put back what is left of this segment and the rest
+                self.append(url, data, headers)
+                for request in frames:
+                    self.append(*request)
+                for rest in segments[i + 1:]:
+                    for request in readFrames(rest):
+                        self.append(*request)
+                    self._remove(rest)
+                self._remove(path)
+                return delivered, True
+            self._remove(path)
+        return delivered, False
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def replayInBackground(self, send):
+        def run():
+            try:
+                self.replay(send)
+            except Exception as e:
+                sys.stderr.write(
+                    'DiskSpool: replay from {} failed error {}\n'.format(
+                        self.directory, repr(e)))
+
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+        return t
@@ -0,0 +1,152 @@
+from unittest import TestCase
+import json
+import logging
+import sys
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from restapi_logging_handler import LogglyHandler
+from restapi_logging_handler.aggregation import Aggregator
+
+
+def record(created, msg='retrying %s', args=('a',), lineno=10, **kwargs):
+    attrs = {'name': 'app', 'levelno': logging.WARNING,
+             'levelname': 'WARNING', 'msg': msg, 'args': args,
+             'lineno': lineno, 'created': created}
+    attrs.update(kwargs)
+    return logging.makeLogRecord(attrs)
+
+
+class TestAggregator(TestCase):
+    def test_first_sent_repeats_counted(self):
+        aggregator = Aggregator(window=10, max_samples=2)
+        self.assertFalse(aggregator.add(record(1, args=('a',))))
+        self.assertTrue(aggregator.add(record(2, args=('b',))))
+        self.assertTrue(aggregator.add(record(3, args=('c',))))
+        self.assertTrue(aggregator.add(record(4, args=('d',))))
+        # a different line, message or level is another record
+        self.assertFalse(aggregator.add(record(4, lineno=11)))
+        self.assertFalse(aggregator.add(record(4, msg='other')))
+        self.assertFalse(aggregator.add(record(4, levelno=logging.INFO)))
+
+        self.assertEqual(aggregator.collect(5), [])
+        repeats, = aggregator.collect(11)
+        self.assertEqual(repeats.count, 3)
+        self.assertEqual((repeats.first, repeats.last), (2, 4))
+        self.assertEqual(repeats.samples, [('b',), ('c',)])
+        self.assertEqual(repeats.record.args, ('d',))
+        self.assertEqual(aggregator.collect(11, everything=True), [])
+
+    def test_new_window_after_expiry(self):
+        aggregator = Aggregator(window=1)
+        aggregator.add(record(0))
+        aggregator.add(record(0.5))
+        self.assertFalse(aggregator.add(record(1.5)))
+        self.assertTrue(aggregator.add(record(1.6)))
+        first, second = aggregator.collect(1.7, everything=True)
+        self.assertEqual((first.first, first.count), (0.5, 1))
+        self.assertEqual((second.first, second.count), (1.6, 1))
+
+    def test_lru_eviction(self):
+        aggregator = Aggregator(window=10, max_keys=2)
+        aggregator.add(record(0, lineno=1))
+        aggregator.add(record(0, lineno=1))
+        aggregator.add(record(0, lineno=2))
+        aggregator.add(record(0, lineno=1))
+        # line 2 is the least recently logged, and has no repeats
+        aggregator.add(record(0, lineno=3))
+        self.assertEqual(len(aggregator.windows), 2)
+        self.assertEqual(aggregator.collect(1), [])
+        # line 1 is evicted with its repeats, which are kept to be sent
+        aggregator.add(record(0, lineno=4))
+        repeats, = aggregator.collect(1)
+        self.assertEqual((repeats.record.lineno, repeats.count), (1, 2))
+
+    def test_repeats_copied(self):
+        aggregator = Aggregator(window=10, snapshot=lambda r: ('copy', r),
+                                sample=repr)
+        first = record(1)
+        repeat = record(2)
+        aggregator.add(first)
+        aggregator.add(repeat)
+        repeats, = aggregator.collect(11)
+        self.assertEqual(repeats.record, ('copy', repeat))
+        self.assertEqual(repeats.samples, ["('a',)"])
+
+    def test_not_aggregated(self):
+        aggregator = Aggregator()
+        try:
+            raise ValueError()
+        except ValueError:
+            exc_info = sys.exc_info()
+        for i in range(2):
+            self.assertFalse(aggregator.add(record(0, exc_info=exc_info)))
+            self.assertFalse(aggregator.add(record(0, msg=['unhashable'])))
+
+
+@patch('restapi_logging_handler.loggly_handler.time.time',
+       return_value=100.0)
+@patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+class TestLogglyHandlerAggregation(TestCase):
+    def setUp(self):
+        self.log = logging.getLogger('aggregated')
+        self.log.setLevel(logging.DEBUG)
+        self.log.propagate = False
+
+    def tearDown(self):
+        for handler in list(self.log.handlers):
+            self.log.removeHandler(handler)
+            handler.close()
+
+    def sent(self, handler):
+        with patch.object(handler, '_sendBulk') as send_bulk:
+            handler.flush()
+        return [json.loads(line) for call in send_bulk.call_args_list
+                for line in call[0][1]]
+
+    def test_repeats_sent_as_one_event(self, session, now):
+        handler = LogglyHandler('token', 'tag', aggregate_window=60)
+        self.log.addHandler(handler)
+        for i in range(100):
+            self.log.warning('retrying %s', i)
+        self.assertEqual(len(handler.logs), 1)
+
+        first, = self.sent(handler)
+        self.assertEqual(first['message'], 'retrying 0')
+        self.assertNotIn('count', first)
+
+        now.return_value = 1e10
+        event, = self.sent(handler)
+        self.assertEqual(event['message'], 'retrying 99')
+        self.assertEqual(event['count'], 99)
+        self.assertLessEqual(event['first_created'], event['last_created'])
+        self.assertEqual(event['sample_args'], [[1], [2], [3]])
+
+    def test_repeats_sent_at_close(self, session, now):
+        handler = LogglyHandler('token', 'tag', aggregate_window=60)
+        self.log.addHandler(handler)
+        for i in range(2):
+            self.log.info('again')
+        self.log.removeHandler(handler)
+        with patch.object(handler, '_sendBulk') as send_bulk:
+            handler.close()
+        lines = [json.loads(line) for call in send_bulk.call_args_list
+                 for line in call[0][1]]
+        self.assertEqual([line.get('count') for line in lines], [None, 1])
+
+    def test_repeat_args_changed_after_logging(self, session, now):
+        handler = LogglyHandler('token', 'tag', aggregate_window=60,
+                                deferred=True)
+        self.log.addHandler(handler)
+        args = ['before']
+        for i in range(2):
+            self.log.warning('value %s', args)
+        args[0] = 'after'
+
+        now.return_value = 1e10
+        first, event = self.sent(handler)
+        self.assertEqual(event['message'], "value ['before']")
+        self.assertEqual(event['sample_args'], [[['before']]])
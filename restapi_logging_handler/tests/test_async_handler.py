@@ -0,0 +1,245 @@
+from unittest import TestCase, skipIf
+import asyncio
+import json
+import logging
+import sys
+import threading
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from restapi_logging_handler.circuit import CircuitBreaker
+from restapi_logging_handler.retry import RetryPolicy
+
+if sys.version_info >= (3, 7):
+    from restapi_logging_handler import (
+        AsyncLogglyHandler,
+        AsyncRestApiHandler,
+    )
+
+
+@skipIf(sys.version_info < (3, 7), 'needs asyncio.get_running_loop')
+class _BaseAsyncHandler(TestCase):
+    def setUp(self):
+        self.posts = []
+        # statuses of the next posts, 200 once they run out
+        self.statuses = []
+        self.log = logging.getLogger('async')
+        self.log.setLevel(logging.DEBUG)
+        self.log.propagate = False
+
+    def tearDown(self):
+        for handler in list(self.log.handlers):
+            self.log.removeHandler(handler)
+
+    def add(self, handler):
+        async def post(url, data, headers):
+            self.posts.append((url, data, headers))
+            status = self.statuses.pop(0) if self.statuses else 200
+            return status, None
+
+        handler._asyncPost = post
+        self.log.addHandler(handler)
+        return handler
+
+
+class TestAsyncRestApiHandler(_BaseAsyncHandler):
+    def test_posts_each_record(self):
+        handler = self.add(AsyncRestApiHandler('endpoint/url'))
+
+        async def main():
+            self.log.info('one')
+            self.log.info('two')
+            await asyncio.sleep(0.01)
+            await handler.aclose()
+
+        asyncio.run(main())
+        self.assertEqual(
+            [json.loads(data)['message'] for url, data, headers in self.posts],
+            ['one', 'two'])
+        self.assertEqual(self.posts[0][2],
+                         {'content-type': 'application/json'})
+
+    def test_emit_does_not_touch_the_network(self):
+        handler = self.add(AsyncRestApiHandler('endpoint/url'))
+
+        async def main():
+            self.log.info('one')
+            self.assertEqual(self.posts, [])
+            await handler.aclose()
+
+        asyncio.run(main())
+        self.assertEqual(len(self.posts), 1)
+
+    def test_batches(self):
+        handler = self.add(AsyncRestApiHandler(
+            'endpoint/url', batch_interval=0.05, batch_size=100))
+        self.assertIsNone(handler.batch_timer)
+
+        async def main():
+            for i in range(10):
+                self.log.info('message %s', i)
+            await asyncio.sleep(0.2)
+            self.assertEqual(len(self.posts), 1)
+            await handler.aclose()
+
+        asyncio.run(main())
+        url, data, headers = self.posts[0]
+        self.assertEqual(len(data.split('\n')), 10)
+        self.assertEqual(headers,
+                         {'content-type': 'application/x-ndjson'})
+
+    def test_emit_from_other_threads(self):
+        handler = self.add(AsyncRestApiHandler('endpoint/url'))
+
+        async def main():
+            self.log.info('from the loop')
+            threads = [
+                threading.Thread(target=self.log.info, args=('thread',))
+                for i in range(5)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            await asyncio.sleep(0.05)
+            await handler.aclose()
+
+        asyncio.run(main())
+        self.assertEqual(len(self.posts), 6)
+
+    def test_records_before_loop_are_kept(self):
+        handler = self.add(AsyncRestApiHandler('endpoint/url'))
+        self.log.info('early')
+
+        async def main():
+            self.log.info('late')
+            await handler.aclose()
+
+        asyncio.run(main())
+        self.assertEqual(
+            [json.loads(data)['message'] for url, data, headers in self.posts],
+            ['early', 'late'])
+
+    def test_full_queue_drops(self):
+        handler = self.add(AsyncRestApiHandler('endpoint/url', max_queue=2))
+        for i in range(5):
+            self.log.info('early')
+        self.assertEqual(handler.dropped, 3)
+
+    def test_unsupported_options_rejected(self):
+        for option in ({'circuit_breaker': CircuitBreaker()},
+                       {'deferred': True}, {'runtime': True},
+                       {'max_pending': 10}):
+            with self.assertRaises(ValueError):
+                AsyncRestApiHandler('endpoint/url', **option)
+        # the defaults are fine
+        AsyncRestApiHandler('endpoint/url', deferred=False).close()
+
+
+class TestAsyncLogglyHandler(_BaseAsyncHandler):
+    @patch('restapi_logging_handler.loggly_handler.atexit')
+    def test_bulk_upload(self, atexit):
+        handler = self.add(AsyncLogglyHandler(
+            'LOGGLYKEY', ['tag1'], flush_interval=0.05))
+        self.assertIsNone(handler.session)
+
+        async def main():
+            for i in range(3):
+                self.log.warning('message %s', i)
+            await asyncio.sleep(0.2)
+            await handler.aclose()
+
+        asyncio.run(main())
+        url, data, headers = self.posts[0]
+        self.assertEqual(len(self.posts), 1)
+        self.assertTrue(url.startswith(
+            'https://logs-01.loggly.com/bulk/LOGGLYKEY/tag/bulk,tag1,p-'))
+        lines = [json.loads(line) for line in data.split('\n')]
+        self.assertEqual([line['message'] for line in lines],
+                         ['message 0', 'message 1', 'message 2'])
+        self.assertEqual(lines[0]['tags'], 'bulk,tag1')
+
+    @patch('restapi_logging_handler.loggly_handler.atexit')
+    def test_flush_wakes_consumer(self, atexit):
+        handler = self.add(AsyncLogglyHandler(
+            'LOGGLYKEY', ['tag1'], flush_interval=60))
+
+        async def main():
+            self.log.warning('message')
+            await asyncio.sleep(0.01)
+            handler.flush()
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(self.posts), 1)
+            await handler.aclose()
+
+        asyncio.run(main())
+
+    @patch('restapi_logging_handler.async_handler.sys.stderr')
+    @patch('restapi_logging_handler.loggly_handler.atexit')
+    def test_retries_failed_posts(self, atexit, stderr):
+        handler = self.add(AsyncLogglyHandler(
+            'LOGGLYKEY', ['tag1'], flush_interval=0.01, max_attempts=2,
+            retry_policy=RetryPolicy(base_delay=0.01)))
+        self.statuses = [503, 429]
+
+        async def main():
+            self.log.warning('message')
+            await asyncio.sleep(0.3)
+            await handler.aclose()
+
+        asyncio.run(main())
+        self.assertEqual(len(self.posts), 3)
+        self.assertEqual(self.posts[0], self.posts[2])
+        self.assertFalse(stderr.write.called)
+
+    @patch('restapi_logging_handler.async_handler.sys.stderr')
+    @patch('restapi_logging_handler.loggly_handler.atexit')
+    def test_gives_up(self, atexit, stderr):
+        handler = self.add(AsyncLogglyHandler(
+            'LOGGLYKEY', ['tag1'], flush_interval=0.01, max_attempts=1,
+            retry_policy=RetryPolicy(base_delay=0.01)))
+        self.statuses = [503, 503, 400]
+
+        async def main():
+            self.log.warning('message')
+            await asyncio.sleep(0.3)
+            # not retryable
+            self.log.warning('message')
+            await asyncio.sleep(0.1)
+            await handler.aclose()
+
+        asyncio.run(main())
+        self.assertEqual(len(self.posts), 3)
+        self.assertEqual(stderr.write.call_count, 2)
+        self.assertIn('status 400', stderr.write.call_args[0][0])
+
+    @patch('restapi_logging_handler.async_handler.sys.stderr')
+    @patch('restapi_logging_handler.loggly_handler.atexit')
+    def test_no_retries_on_close(self, atexit, stderr):
+        handler = self.add(AsyncLogglyHandler(
+            'LOGGLYKEY', ['tag1'], flush_interval=60,
+            retry_policy=RetryPolicy(base_delay=10)))
+        self.statuses = [503]
+
+        async def main():
+            self.log.warning('message')
+            await handler.aclose()
+
+        asyncio.run(main())
+        self.assertEqual(len(self.posts), 1)
+        self.assertIn('status 503', stderr.write.call_args[0][0])
+
+    def test_unsupported_options_rejected(self):
+        with self.assertRaises(ValueError):
+            AsyncLogglyHandler('LOGGLYKEY', spool_dir='spool')
+        with self.assertRaises(ValueError):
+            AsyncLogglyHandler('LOGGLYKEY', circuit_breaker=CircuitBreaker())
+        for option in ({'aggregate_window': 1.0}, {'deferred': True},
+                       {'interval': 5}, {'flush_count': 100},
+                       {'flush_bytes': 1000}, {'adaptive': True},
+                       {'max_pending': 10}):
+            with self.assertRaises(ValueError):
+                AsyncLogglyHandler('LOGGLYKEY', **option)
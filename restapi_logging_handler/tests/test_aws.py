@@ -0,0 +1,243 @@
+from unittest import TestCase, skipUnless
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from restapi_logging_handler import LogglyHandler
+from restapi_logging_handler.aws import (
+    DEFAULT_CACHE_PATH,
+    INSTANCE_ID_PATH,
+    TOKEN_HEADER,
+    TOKEN_PATH,
+    TOKEN_TTL_HEADER,
+    fetch_instance_id,
+    lookup_instance_id,
+    read_cache,
+    write_cache,
+)
+
+
+class _MetadataHandler(BaseHTTPRequestHandler):
+    def reply(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        stub = self.server.stub
+        stub.requests.append(('PUT', self.path))
+        if (not stub.v2 or self.path != TOKEN_PATH or
+                not self.headers.get(TOKEN_TTL_HEADER)):
+            return self.reply(403)
+        self.reply(200, b'secret-token')
+
+    def do_GET(self):
+        stub = self.server.stub
+        stub.requests.append(('GET', self.path))
+        token = self.headers.get(TOKEN_HEADER)
+        if self.path != INSTANCE_ID_PATH:
+            return self.reply(404)
+        if token is None and not stub.v1:
+            return self.reply(401)
+        if token is not None and token != 'secret-token':
+            return self.reply(401)
+        self.reply(200, b'i-0123456789abcdef0')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubMetadataServer(object):
+    """
+    The instance metadata service, with IMDSv2 tokens if v2, and answering
+    requests without one if v1.
+    """
+
+    def __init__(self, v1=True, v2=True):
+        self.v1 = v1
+        self.v2 = v2
+        self.requests = []
+        self.server = HTTPServer(('127.0.0.1', 0), _MetadataHandler)
+        self.server.stub = self
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def unused_url():
+    server = HTTPServer(('127.0.0.1', 0), _MetadataHandler)
+    url = 'http://127.0.0.1:{}'.format(server.server_port)
+    server.server_close()
+    return url
+
+
+class _BaseMetadata(TestCase):
+    v1 = True
+    v2 = True
+
+    def setUp(self):
+        self.server = StubMetadataServer(v1=self.v1, v2=self.v2)
+        self.addCleanup(self.server.close)
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.cache = os.path.join(self.dir, 'instance-id.json')
+
+
+class TestFetchInstanceId(_BaseMetadata):
+    def test_imdsv2(self):
+        self.server.v1 = False
+        self.assertEqual(fetch_instance_id(self.server.url),
+                         'i-0123456789abcdef0')
+        self.assertEqual(self.server.requests,
+                         [('PUT', TOKEN_PATH), ('GET', INSTANCE_ID_PATH)])
+
+    def test_falls_back_to_imdsv1(self):
+        self.server.v2 = False
+        self.assertEqual(fetch_instance_id(self.server.url),
+                         'i-0123456789abcdef0')
+
+    def test_refused(self):
+        self.server.v1 = self.server.v2 = False
+        self.assertIsNone(fetch_instance_id(self.server.url))
+
+    def test_unreachable(self):
+        self.assertIsNone(fetch_instance_id(unused_url(), timeout=0.5))
+
+
+class TestCache(_BaseMetadata):
+    def test_round_trip(self):
+        self.assertEqual(read_cache(self.cache), (False, None))
+        write_cache(self.cache, 'i-1')
+        self.assertEqual(read_cache(self.cache), (True, 'i-1'))
+        write_cache(self.cache, None)
+        self.assertEqual(read_cache(self.cache), (True, None))
+        self.assertEqual(os.listdir(self.dir), ['instance-id.json'])
+
+    def test_expired(self):
+        write_cache(self.cache, 'i-1')
+        with open(self.cache) as f:
+            cached = json.load(f)
+        self.assertEqual(read_cache(self.cache, now=cached['time'] + 1e6),
+                         (False, None))
+        # off EC2 is checked again sooner
+        write_cache(self.cache, None)
+        self.assertEqual(read_cache(self.cache, now=cached['time'] + 7200),
+                         (False, None))
+
+    def test_corrupt(self):
+        with open(self.cache, 'w') as f:
+            f.write('{not json')
+        self.assertEqual(read_cache(self.cache), (False, None))
+
+    @skipUnless(hasattr(os, 'getuid'), 'needs uids')
+    def test_other_users_file_ignored(self):
+        write_cache(self.cache, 'i-1')
+        with patch('restapi_logging_handler.aws.os.getuid',
+                   return_value=os.getuid() + 1):
+            self.assertEqual(read_cache(self.cache), (False, None))
+
+    @skipUnless(hasattr(os, 'getuid'), 'needs uids')
+    def test_default_path_is_per_user(self):
+        self.assertIn('-{}.json'.format(os.getuid()), DEFAULT_CACHE_PATH)
+
+    @patch('restapi_logging_handler.aws.sys.stderr')
+    def test_failed_write_leaves_nothing(self, stderr):
+        with patch('restapi_logging_handler.aws._replace',
+                   side_effect=OSError('no')):
+            write_cache(self.cache, 'i-1')
+        self.assertEqual(os.listdir(self.dir), [])
+        self.assertTrue(stderr.write.called)
+
+    @skipUnless(hasattr(os, 'getuid'), 'needs uids')
+    def test_written_for_the_user_only(self):
+        write_cache(self.cache, 'i-1')
+        self.assertEqual(os.stat(self.cache).st_mode & 0o077, 0)
+
+
+class TestLookupInstanceId(_BaseMetadata):
+    def test_in_background_then_cached(self):
+        found = []
+        thread = lookup_instance_id(found.append, base_url=self.server.url,
+                                    cache_path=self.cache)
+        thread.join(5)
+        self.assertEqual(found, ['i-0123456789abcdef0'])
+
+        # the next process takes it from the cache
+        requests = len(self.server.requests)
+        self.assertIsNone(lookup_instance_id(
+            found.append, base_url=self.server.url, cache_path=self.cache))
+        self.assertEqual(found, ['i-0123456789abcdef0'] * 2)
+        self.assertEqual(len(self.server.requests), requests)
+
+    def test_not_found_cached(self):
+        found = []
+        lookup_instance_id(found.append, base_url=unused_url(),
+                           cache_path=self.cache, timeout=0.5).join(5)
+        self.assertEqual(found, [None])
+        self.assertEqual(read_cache(self.cache), (True, None))
+
+
+@patch('restapi_logging_handler.loggly_handler.sys.stderr')
+class TestAwsTagging(_BaseMetadata):
+    def make_handler(self, **kwargs):
+        handler = LogglyHandler('token', ['tag'], max_attempts=1,
+                                aws_metadata_url=self.server.url,
+                                aws_cache_path=self.cache, **kwargs)
+        self.addCleanup(handler.close)
+        return handler
+
+    def test_tag_true(self, stderr):
+        handler = self.make_handler(aws_tag=True)
+        handler.aws_lookup.join(5)
+        self.assertEqual(handler.tags, ['bulk', 'tag', 'i-0123456789abcdef0'])
+        self.assertEqual(handler.ec2_id, 'i-0123456789abcdef0')
+        self.assertIn('i-0123456789abcdef0', handler._getEndpoint())
+
+    def test_tag_cached(self, stderr):
+        write_cache(self.cache, 'i-cached')
+        handler = self.make_handler(aws_tag=True)
+        self.assertIsNone(handler.aws_lookup)
+        self.assertEqual(handler.tags, ['bulk', 'tag', 'i-cached'])
+        self.assertEqual(self.server.requests, [])
+
+    def test_tag_not_found(self, stderr):
+        self.server.v1 = self.server.v2 = False
+        handler = self.make_handler(aws_tag=True)
+        handler.aws_lookup.join(5)
+        self.assertEqual(handler.tags, ['bulk', 'tag', 'id_NA'])
+        self.assertTrue(stderr.write.called)
+
+    def test_does_not_block_init(self, stderr):
+        release = threading.Event()
+        with patch('restapi_logging_handler.aws.fetch_instance_id',
+                   side_effect=lambda *a, **kw: release.wait(5) and 'i-late'):
+            handler = self.make_handler(aws_tag=True)
+            self.assertEqual(handler.tags, ['bulk', 'tag'])
+            release.set()
+            handler.aws_lookup.join(5)
+        self.assertEqual(handler.tags, ['bulk', 'tag', 'i-late'])
+
+    def test_tag_false(self, stderr):
+        handler = self.make_handler(aws_tag=False)
+        self.assertIsNone(handler.aws_lookup)
+        self.assertEqual(handler.tags, ['bulk', 'tag'])
+        self.assertEqual(self.server.requests, [])
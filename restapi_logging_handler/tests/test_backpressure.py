@@ -0,0 +1,137 @@
+from concurrent.futures import Future
+from unittest import TestCase
+import logging
+import threading
+import time
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from restapi_logging_handler import RestApiHandler
+from restapi_logging_handler.backpressure import PendingLimiter
+
+
+class _BaseLimiter(TestCase):
+    policy = 'block'
+
+    def setUp(self):
+        self.limiter = PendingLimiter(
+            2, policy=self.policy, timeout=0.05, report_interval=3600)
+        self.futures = []
+
+    def send(self):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def fill(self):
+        self.assertIsNotNone(self.limiter.submit(self.send))
+        self.assertIsNotNone(self.limiter.submit(self.send))
+
+
+class TestUnderLimit(_BaseLimiter):
+    def test_completed_futures_free_slots(self):
+        for i in range(10):
+            future = self.limiter.submit(self.send)
+            future.set_result(None)
+        self.assertEqual(self.limiter.count, 0)
+        self.assertEqual(self.limiter.dropped_total, 0)
+
+    def test_bad_policy(self):
+        with self.assertRaises(ValueError):
+            PendingLimiter(2, policy='panic')
+
+
+class TestBlock(_BaseLimiter):
+    def test_times_out_then_drops(self):
+        self.fill()
+        self.assertIsNone(self.limiter.submit(self.send))
+        self.assertEqual(self.limiter.dropped, {'timeout': 1})
+
+    def test_unblocks_when_a_slot_frees(self):
+        self.fill()
+        self.limiter.timeout = 5
+        threading.Timer(0.05, self.futures[0].set_result, [None]).start()
+        self.assertIsNotNone(self.limiter.submit(self.send))
+        self.assertEqual(self.limiter.dropped_total, 0)
+
+
+class TestDropNewest(_BaseLimiter):
+    policy = 'drop_newest'
+
+    def test_drops_without_waiting(self):
+        self.fill()
+        start = time.time()
+        self.assertIsNone(self.limiter.submit(self.send, records=3))
+        self.assertLess(time.time() - start, 0.05)
+        self.assertEqual(self.limiter.dropped, {'newest': 3})
+        self.assertEqual(len(self.futures), 2)
+
+
+class TestDropOldest(_BaseLimiter):
+    policy = 'drop_oldest'
+
+    def test_cancels_oldest(self):
+        self.fill()
+        self.assertIsNotNone(self.limiter.submit(self.send))
+        self.assertTrue(self.futures[0].cancelled())
+        self.assertFalse(self.futures[1].cancelled())
+        self.assertEqual(self.limiter.dropped, {'oldest': 1})
+        self.assertEqual(self.limiter.count, 2)
+
+    def test_drops_newest_when_all_running(self):
+        self.fill()
+        for future in self.futures:
+            future.set_running_or_notify_cancel()
+        self.assertIsNone(self.limiter.submit(self.send))
+        self.assertEqual(self.limiter.dropped, {'newest': 1})
+
+
+class TestDropBelow(_BaseLimiter):
+    policy = 'drop_below'
+
+    def test_drops_low_levels(self):
+        self.fill()
+        self.assertIsNone(self.limiter.submit(self.send, logging.INFO))
+        self.assertEqual(self.limiter.dropped, {'below_level': 1})
+
+    def test_blocks_high_levels(self):
+        self.fill()
+        self.limiter.timeout = 5
+        threading.Timer(0.05, self.futures[0].set_result, [None]).start()
+        self.assertIsNotNone(self.limiter.submit(self.send, logging.ERROR))
+
+
+class TestReport(_BaseLimiter):
+    policy = 'drop_newest'
+
+    @patch('restapi_logging_handler.backpressure.sys.stderr.write')
+    def test_reports_once_per_change(self, write):
+        self.fill()
+        self.limiter.submit(self.send)
+        self.limiter.submit(self.send)
+        self.limiter.report()
+        self.limiter.report()
+        write.assert_called_once_with(
+            'RestApiHandler: dropped 2 records, newest 2\n')
+
+
+class TestHandlerLimit(TestCase):
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_handler_drops_over_limit(self, session):
+        session.return_value.post.side_effect = lambda *a, **kw: Future()
+        handler = RestApiHandler('endpoint/url', max_pending=3,
+                                 overflow_policy='drop_newest')
+        log = logging.getLogger('backpressure')
+        log.propagate = False
+        log.addHandler(handler)
+        try:
+            for i in range(5):
+                log.warning('message')
+        finally:
+            log.removeHandler(handler)
+
+        self.assertEqual(session.return_value.post.call_count, 3)
+        self.assertEqual(handler.limiter.dropped, {'newest': 2})
@@ -0,0 +1,327 @@
+from concurrent.futures import Future
+from unittest import TestCase
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
+
+from restapi_logging_handler import LogglyHandler, RestApiHandler
+from restapi_logging_handler.circuit import (
+    CLOSED,
+    DROP,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+)
+from restapi_logging_handler.spool import readFrames
+
+
+def response(status_code):
+    future = Future()
+    future.set_result(Mock(status_code=status_code))
+    return future
+
+
+@patch('restapi_logging_handler.circuit.sys.stderr')
+class TestCircuitBreaker(TestCase):
+    def open_breaker(self, **kwargs):
+        breaker = CircuitBreaker(failure_threshold=2, **kwargs)
+        breaker.record_failure()
+        breaker.record_failure()
+        return breaker
+
+    def test_opens_after_threshold(self, stderr):
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_success_resets_count(self, stderr):
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure()
+        self.assertIsNone(breaker.record_success())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_single_probe(self, stderr):
+        breaker = self.open_breaker(reset_timeout=0)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_probe_success_closes(self, stderr):
+        breaker = self.open_breaker(reset_timeout=0)
+        breaker.hold('first')
+        breaker.hold('second')
+        breaker.allow()
+        self.assertEqual(breaker.record_success(), ['first', 'second'])
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_probe_failure_backs_off(self, stderr):
+        breaker = self.open_breaker(reset_timeout=1, max_reset_timeout=3)
+        for timeout in (2, 3, 3):
+            breaker.opened_at -= breaker.timeout
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+            self.assertEqual(breaker.state, OPEN)
+            self.assertEqual(breaker.timeout, timeout)
+
+    def test_buffer_drops_oldest(self, stderr):
+        breaker = self.open_breaker(max_buffered=2)
+        for send in ('a', 'b', 'c'):
+            breaker.hold(send, records=3)
+        self.assertEqual([s for s, r in breaker.buffered], ['b', 'c'])
+        self.assertEqual(breaker.dropped, 3)
+
+    def test_drop_policy(self, stderr):
+        breaker = self.open_breaker(policy=DROP)
+        breaker.hold('a', records=4)
+        self.assertEqual(len(breaker.buffered), 0)
+        self.assertEqual(breaker.dropped, 4)
+
+    def test_failed(self, stderr):
+        breaker = CircuitBreaker()
+        self.assertTrue(breaker.failed(503))
+        self.assertTrue(breaker.failed(error=IOError()))
+        self.assertFalse(breaker.failed(200))
+        self.assertFalse(breaker.failed(400))
+
+    def test_released_probe_reopens(self, stderr):
+        breaker = self.open_breaker(reset_timeout=0)
+        self.assertEqual(breaker.allow(), HALF_OPEN)
+        breaker.release_probe()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.allow(), HALF_OPEN)
+
+    def test_buffered_dropped(self, stderr):
+        breaker = self.open_breaker()
+        breaker.hold(Mock(), 2)
+        breaker.hold(Mock(), 3)
+        breaker.drop_buffered()
+        self.assertEqual(breaker.dropped, 5)
+        self.assertEqual(len(breaker.buffered), 0)
+
+    def test_bad_policy(self, stderr):
+        self.assertRaises(ValueError, CircuitBreaker, policy='nope')
+
+
+@patch('restapi_logging_handler.circuit.sys.stderr')
+class TestRestApiHandlerCircuit(TestCase):
+    def setUp(self):
+        self.log = logging.getLogger('circuit')
+        self.log.setLevel(logging.DEBUG)
+        self.log.propagate = False
+
+    def tearDown(self):
+        for handler in list(self.log.handlers):
+            self.log.removeHandler(handler)
+            handler.close()
+
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def make_handler(self, statuses, session, handler_kwargs=None,
+                     **kwargs):
+        self.post = session.return_value.post
+        self.post.side_effect = [
+            s if isinstance(s, Future) else response(s) for s in statuses]
+        self.breaker = CircuitBreaker(**kwargs)
+        handler = RestApiHandler('endpoint/url',
+                                 circuit_breaker=self.breaker,
+                                 **(handler_kwargs or {}))
+        self.log.addHandler(handler)
+        return handler
+
+    def messages(self):
+        return [c[1]['data'] for c in self.post.call_args_list]
+
+    def wait_for_posts(self, count):
+        deadline = time.time() + 5
+        while self.post.call_count < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_holds_while_open(self, stderr):
+        self.make_handler([503, 503], failure_threshold=2)
+        for i in range(5):
+            self.log.info('message %s', i)
+        self.assertEqual(self.post.call_count, 2)
+        self.assertEqual(len(self.breaker.buffered), 3)
+
+    def test_probe_resumes(self, stderr):
+        self.make_handler([503, 200, 200, 200],
+                          failure_threshold=1, reset_timeout=0)
+        self.log.info('fails')
+        self.breaker.opened_at += 60
+        self.log.info('held')
+        self.breaker.opened_at -= 60
+        self.log.info('probe')
+        self.wait_for_posts(3)
+        self.assertEqual(self.post.call_count, 3)
+        self.assertIn('"probe"', self.messages()[1])
+        self.assertIn('"held"', self.messages()[2])
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_failed_probe_sends_nothing_else(self, stderr):
+        self.make_handler([503, 503], failure_threshold=1, reset_timeout=0)
+        self.log.info('fails')
+        self.breaker.opened_at += 60
+        self.log.info('held')
+        self.breaker.opened_at -= 60
+        self.log.info('probe')
+        self.assertEqual(self.post.call_count, 2)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(len(self.breaker.buffered), 1)
+
+    def test_held_sent_off_the_callback_thread(self, stderr):
+        handler = self.make_handler([503, 200, 200],
+                                    failure_threshold=1, reset_timeout=0)
+        threads = []
+        responses = self.post.side_effect
+
+        def record_thread(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return next(responses)
+
+        self.post.side_effect = record_thread
+        self.log.info('fails')
+        self.breaker.opened_at += 60
+        self.log.info('held')
+        self.breaker.opened_at -= 60
+        self.log.info('probe')
+        self.wait_for_posts(3)
+        self.assertIs(threads[1], threading.current_thread())
+        self.assertIsNot(threads[2], threading.current_thread())
+        handler.close()
+
+    @patch('restapi_logging_handler.backpressure.sys.stderr')
+    def test_probe_dropped_by_limiter(self, limiter_stderr, stderr):
+        slow = Future()
+        self.make_handler(
+            [slow, 200], failure_threshold=1, reset_timeout=0,
+            handler_kwargs={'max_pending': 1,
+                            'overflow_policy': 'drop_newest'})
+        self.log.info('slow')
+        self.breaker.record_failure()
+        self.log.info('dropped probe')
+        self.assertEqual(self.breaker.state, OPEN)
+
+        slow.set_result(Mock(status_code=503))
+        self.log.info('probe')
+        self.assertEqual(self.post.call_count, 2)
+        self.assertIn('"probe"', self.messages()[1])
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_cancelled_probe_released(self, stderr):
+        pending = Future()
+        self.make_handler([pending], failure_threshold=1, reset_timeout=0)
+        self.breaker.record_failure()
+        self.log.info('probe')
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        pending.cancel()
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_held_counted_dropped_at_close(self, stderr):
+        handler = self.make_handler([503], failure_threshold=1)
+        for i in range(3):
+            self.log.info('message %s', i)
+        self.log.removeHandler(handler)
+        handler.close()
+        self.assertEqual(self.breaker.dropped, 2)
+        self.assertIn('dropped 2 records', stderr.write.call_args[0][0])
+
+
+@patch('restapi_logging_handler.circuit.sys.stderr')
+class TestLogglyHandlerCircuit(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @patch('restapi_logging_handler.loggly_handler.atexit')
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_spools_while_open(self, session, atexit, stderr):
+        breaker = CircuitBreaker(failure_threshold=1)
+        breaker.record_failure()
+        handler = LogglyHandler('LOGGLYKEY', ['tag'], spool_dir=self.directory,
+                                circuit_breaker=breaker)
+        handler.timer.set()
+        handler.spool_replay.join()
+
+        handler._sendBulk('http://loggly/', ['{"a": 1}'])
+        handler.close()
+
+        self.assertEqual(session.return_value.post.call_count, 0)
+        self.assertEqual(len(breaker.buffered), 0)
+        segments = [os.path.join(self.directory, name)
+                    for name in os.listdir(self.directory)]
+        frames = [f for path in segments for f in readFrames(path)]
+        self.assertEqual(frames, [('http://loggly/', b'{"a": 1}',
+                                   {'content-type': 'application/json'})])
+
+    @patch('restapi_logging_handler.loggly_handler.atexit')
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_spooled_sent_after_close(self, session, atexit, stderr):
+        post = session.return_value.post
+        post.side_effect = lambda *args, **kwargs: response(200)
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        handler = LogglyHandler('LOGGLYKEY', ['tag'], spool_dir=self.directory,
+                                circuit_breaker=breaker)
+        handler.timer.set()
+        handler.spool_replay.join()
+        breaker.record_failure()
+        breaker.opened_at += 60
+
+        handler._sendBulk('http://loggly/', ['{"held": 1}'])
+        self.assertEqual(post.call_count, 0)
+
+        # the probe succeeds and the circuit closes
+        breaker.opened_at -= 60
+        handler._sendBulk('http://loggly/', ['{"probe": 1}'])
+        handler.spool_replay.join(5)
+
+        bodies = [c[1]['data'] for c in post.call_args_list]
+        self.assertEqual(bodies, ['{"probe": 1}', b'{"held": 1}'])
+        self.assertEqual(os.listdir(self.directory), [])
+        handler.close()
+
+    @patch('restapi_logging_handler.loggly_handler.atexit')
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_held_failure_retried(self, session, atexit, stderr):
+        failed = Future()
+        failed.set_exception(IOError('connection reset'))
+        posted = threading.Event()
+        responses = iter([response(200), failed])
+
+        def post(*args, **kwargs):
+            future = next(responses)
+            if future is failed:
+                posted.set()
+            return future
+
+        session.return_value.post.side_effect = post
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        handler = LogglyHandler('LOGGLYKEY', ['tag'],
+                                circuit_breaker=breaker)
+        handler.timer.set()
+        breaker.record_failure()
+        breaker.opened_at += 60
+        handler._sendBulk('http://loggly/', ['{"held": 1}'])
+        breaker.opened_at -= 60
+
+        with patch.object(handler, '_retry') as retry:
+            handler._sendBulk('http://loggly/', ['{"probe": 1}'])
+            self.assertTrue(posted.wait(5))
+            handler.scheduler.stop()
+        self.assertEqual(retry.call_args[0][:3],
+                         ('http://loggly/', ['{"held": 1}'], 1))
+        self.assertEqual(handler.inflight, set())
+        handler.close()
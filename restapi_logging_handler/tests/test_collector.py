@@ -0,0 +1,196 @@
+from unittest import TestCase
+import errno
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
+
+from restapi_logging_handler import LogglyHandler, RestApiHandler
+from restapi_logging_handler.collector import (
+    Collector,
+    CollectorHandler,
+    _parser,
+    build_handler,
+)
+
+
+class _BaseCollector(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.address = os.path.join(self.directory, 'collector.sock')
+        self.log = logging.getLogger('collector')
+        self.log.setLevel(logging.DEBUG)
+        self.log.propagate = False
+        self.handler = CollectorHandler(self.address, max_datagram=2048)
+        self.log.addHandler(self.handler)
+
+    def tearDown(self):
+        self.log.removeHandler(self.handler)
+        self.handler.close()
+        shutil.rmtree(self.directory)
+
+    def receive(self, collector, count):
+        deadline = time.time() + 5
+        while collector.received < count and time.time() < deadline:
+            time.sleep(0.01)
+
+
+class TestCollector(_BaseCollector):
+    def setUp(self):
+        super(TestCollector, self).setUp()
+        self.target = Mock()
+        self.collector = Collector(self.target, address=self.address)
+        self.thread = threading.Thread(target=self.collector.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.collector.stop()
+        self.thread.join()
+        self.collector.close()
+        super(TestCollector, self).tearDown()
+
+    def payloads(self):
+        return [c[0][0] for c in self.target._collectPayload.call_args_list]
+
+    def test_forwards_payloads(self):
+        for i in range(3):
+            self.log.info('message %s', i, extra={'n': i})
+        self.receive(self.collector, 3)
+
+        payloads = self.payloads()
+        self.assertEqual([p['message'] for p in payloads],
+                         ['message 0', 'message 1', 'message 2'])
+        self.assertEqual(payloads[2]['details']['n'], 2)
+        self.assertEqual(payloads[0]['pid'], 'p-{}'.format(os.getpid()))
+
+    def test_shrinks_big_events(self):
+        self.log.info('x' * 10000, extra={'big': 'y' * 10000})
+        self.receive(self.collector, 1)
+
+        payload, = self.payloads()
+        self.assertNotIn('details', payload)
+        self.assertGreater(payload['truncated'], 20000)
+        self.assertLess(len(payload['message']), 2048)
+
+    def test_ignores_garbage(self):
+        self.collector.handle_datagram(b'not json')
+        self.assertEqual(self.collector.invalid, 1)
+        self.assertEqual(self.payloads(), [])
+
+    def test_close_closes_handler(self):
+        self.collector.stop()
+        self.thread.join()
+        self.collector.close()
+        self.assertTrue(self.target.close.called)
+        self.assertFalse(os.path.exists(self.address))
+
+
+class TestCollectorHandlerWithoutCollector(_BaseCollector):
+    @patch('restapi_logging_handler.collector.sys.stderr')
+    def test_drops_and_counts(self, stderr):
+        self.log.info('nobody listening')
+        self.log.info('nobody listening')
+        self.assertEqual(self.handler.dropped, 2)
+        self.handler.close()
+        self.assertIn('dropped 2 records', stderr.write.call_args[0][0])
+
+
+class TestCollectorHandlerSendErrors(_BaseCollector):
+    def sock(self, *errnos):
+        sock = Mock()
+        sock.sendto.side_effect = [
+            OSError(e, os.strerror(e)) if e else None for e in errnos]
+        self.handler.sock = sock
+        return sock
+
+    @patch('restapi_logging_handler.collector.sys.stderr')
+    def test_other_errors_dropped(self, stderr):
+        self.sock(errno.EBADF)
+        self.log.info('bad socket')
+        self.assertEqual(self.handler.dropped, 1)
+        self.handler.close()
+        self.assertIn('last send error', stderr.write.call_args[0][0])
+
+    def test_shrinks_on_message_too_long(self):
+        sock = self.sock(errno.EMSGSIZE, errno.EMSGSIZE, None)
+        self.log.info('x' * 1500)
+
+        sent = [c[0][0] for c in sock.sendto.call_args_list]
+        self.assertEqual(len(sent), 3)
+        self.assertLess(len(sent[1]), len(sent[0]))
+        self.assertLess(len(sent[2]), len(sent[1]))
+        self.assertEqual(json.loads(sent[2].decode('utf-8'))['truncated'],
+                         len(sent[0]))
+        self.assertEqual(self.handler.dropped, 0)
+
+    def test_too_long_whatever_the_size_dropped(self):
+        sock = Mock()
+        sock.sendto.side_effect = OSError(errno.EMSGSIZE, 'too long')
+        self.handler.sock = sock
+        self.log.info('x' * 1500)
+        self.assertEqual(self.handler.dropped, 1)
+
+
+class TestCollectorDelivery(TestCase):
+    @patch('restapi_logging_handler.loggly_handler.atexit')
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_loggly(self, session, atexit):
+        handler = LogglyHandler('TOKEN', 'tag', group_by_thread=False)
+        handler.timer.set()
+        for pid in (1, 2):
+            handler._collectPayload(
+                {'message': 'from {}'.format(pid), 'level': 'INFO',
+                 'pid': 'p-{}'.format(pid), 'tid': 't-1'})
+        handler.flush()
+
+        post = session.return_value.post
+        self.assertEqual(post.call_count, 1)
+        events = [json.loads(line)
+                  for line in post.call_args[1]['data'].split('\n')]
+        self.assertEqual([(e['message'], e['pid'], e['tags']) for e in events],
+                         [('from 1', 'p-1', 'bulk,tag'),
+                          ('from 2', 'p-2', 'bulk,tag')])
+
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_restapi_batch(self, session):
+        handler = RestApiHandler('http://a/', batch_size=2)
+        handler._collectPayload({'message': 'one', 'level': 'INFO'})
+        handler._collectPayload({'message': 'two', 'level': 'ERROR'})
+
+        post = session.return_value.post
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(
+            [json.loads(line)['message']
+             for line in post.call_args[1]['data'].split('\n')],
+            ['one', 'two'])
+
+
+class TestCollectorCommand(TestCase):
+    @patch('restapi_logging_handler.loggly_handler.atexit')
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_builds_loggly_handler(self, session, atexit):
+        args = _parser().parse_args(
+            ['--loggly-token', 'TOKEN', '--tags', 'a,b', '--interval', '2',
+             '--compression', 'gzip'])
+        handler = build_handler(args)
+        handler.timer.set()
+        self.assertIsInstance(handler, LogglyHandler)
+        self.assertFalse(handler.group_by_thread)
+        self.assertEqual(handler.interval, 2)
+        self.assertEqual(handler.compression, 'gzip')
+
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_builds_restapi_handler(self, session):
+        args = _parser().parse_args(['--endpoint', 'http://a/'])
+        handler = build_handler(args)
+        self.assertIsInstance(handler, RestApiHandler)
+        self.assertEqual(handler.batch_size, 1000)
+        handler.close()
@@ -0,0 +1,109 @@
+from unittest import TestCase, skipIf
+import gzip
+import io
+import json
+import logging
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from restapi_logging_handler import LogglyHandler, RestApiHandler
+from restapi_logging_handler import compression
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=io.BytesIO(data)).read().decode('utf-8')
+
+
+class TestCompress(TestCase):
+    def test_no_encoding(self):
+        self.assertEqual(compression.compress('body', None), ('body', None))
+
+    def test_under_threshold(self):
+        self.assertEqual(
+            compression.compress('body', 'gzip', threshold=10),
+            (b'body', None))
+
+    def test_gzip(self):
+        body = '\n'.join(['{"message": "same again"}'] * 100)
+        data, encoding = compression.compress(body, 'gzip', threshold=10)
+        self.assertEqual(encoding, 'gzip')
+        self.assertLess(len(data), len(body) / 8)
+        self.assertEqual(gunzip(data), body)
+
+    @skipIf(compression.zstandard is None, 'zstandard not installed')
+    def test_zstd(self):
+        body = '\n'.join(['{"message": "same again"}'] * 100)
+        data, encoding = compression.compress(body, 'zstd')
+        self.assertEqual(encoding, 'zstd')
+        decompressed = compression.zstandard.ZstdDecompressor().decompress(
+            data, max_output_size=len(body))
+        self.assertEqual(decompressed.decode('utf-8'), body)
+
+    @skipIf(compression.zstandard is not None, 'zstandard installed')
+    def test_zstd_missing(self):
+        with self.assertRaises(ValueError):
+            compression.check_encoding('zstd')
+
+    def test_unknown_encoding(self):
+        with self.assertRaises(ValueError):
+            RestApiHandler('endpoint/url', compression='brotli')
+
+
+class TestHandlerCompression(TestCase):
+    def setUp(self):
+        self.log = logging.getLogger('compression')
+        self.log.setLevel(logging.DEBUG)
+        self.log.propagate = False
+
+    def tearDown(self):
+        for handler in list(self.log.handlers):
+            self.log.removeHandler(handler)
+
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_batch_is_gzipped(self, session):
+        handler = RestApiHandler('endpoint/url', batch_size=50,
+                                 compression='gzip')
+        self.log.addHandler(handler)
+        for i in range(50):
+            self.log.info('a fairly verbose message number %s', i)
+
+        post = session.return_value.post.call_args[1]
+        self.assertEqual(post['headers'], {
+            'content-type': 'application/x-ndjson',
+            'content-encoding': 'gzip',
+        })
+        lines = gunzip(post['data']).split('\n')
+        self.assertEqual(len(lines), 50)
+        self.assertEqual(json.loads(lines[-1])['message'],
+                         'a fairly verbose message number 49')
+
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_small_batch_is_not(self, session):
+        handler = RestApiHandler('endpoint/url', batch_size=1,
+                                 compression='gzip',
+                                 compression_threshold=10000)
+        self.log.addHandler(handler)
+        self.log.info('short')
+
+        post = session.return_value.post.call_args[1]
+        self.assertEqual(post['headers'],
+                         {'content-type': 'application/x-ndjson'})
+
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_loggly_bulk_is_gzipped(self, session):
+        handler = LogglyHandler('LOGGLYKEY', ['tag'], compression='gzip',
+                                compression_threshold=0)
+        handler._stopFlushTimer()
+        self.log.addHandler(handler)
+        self.log.warning('one')
+        self.log.warning('two')
+        handler.flush()
+
+        post = session.return_value.post.call_args[1]
+        self.assertEqual(post['headers']['content-encoding'], 'gzip')
+        messages = [json.loads(line)['message']
+                    for line in gunzip(post['data']).split('\n')]
+        self.assertEqual(messages, ['one', 'two'])
@@ -0,0 +1,155 @@
+from unittest import TestCase, skipUnless
+import json
+import logging
+import os
+
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
+
+from restapi_logging_handler import LogglyHandler, RestApiHandler
+from restapi_logging_handler.restapi_logging_handler import (
+    AT_FORK_HOOKS,
+    _handlers,
+)
+
+
+def in_child(check):
+    """
+    Fork, run check in the child and return what it returned.
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read)
+            result = json.dumps(check())
+        except Exception as e:
+            result = json.dumps({'error': repr(e)})
+        finally:
+            os.write(write, result.encode('utf-8'))
+            os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as f:
+        result = json.loads(f.read())
+    os.waitpid(pid, 0)
+    return result
+
+
+@skipUnless(AT_FORK_HOOKS, 'needs os.register_at_fork')
+class TestAfterFork(TestCase):
+    def setUp(self):
+        self.log = logging.getLogger('fork')
+        self.log.setLevel(logging.DEBUG)
+        self.log.propagate = False
+        patcher = patch(
+            'restapi_logging_handler.restapi_logging_handler.FuturesSession',
+            side_effect=lambda *args, **kwargs: Mock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        for handler in list(self.log.handlers):
+            self.log.removeHandler(handler)
+            handler.close()
+
+    @patch('restapi_logging_handler.loggly_handler.atexit')
+    def test_loggly_starts_over(self, atexit):
+        handler = LogglyHandler('TOKEN', 'tag', interval=60)
+        self.log.addHandler(handler)
+        self.log.info('parent')
+        parent_session = handler.session
+
+        def check():
+            self.log.info('child')
+            handler.flush()
+            data = handler.session.post.call_args[1]['data']
+            return {
+                'new_session': handler.session is not parent_session,
+                'pid': handler.pid == os.getpid(),
+                'messages': [json.loads(line)['message']
+                             for line in data.split('\n')],
+                'timer': not handler.timer.is_set(),
+                'atexit': atexit.register.call_count,
+            }
+
+        self.assertEqual(in_child(check), {
+            'new_session': True,
+            'pid': True,
+            'messages': ['child'],
+            'timer': True,
+            'atexit': 1,
+        })
+        # the parent keeps its own
+        self.assertEqual(len(handler.logs), 1)
+
+    def test_deferred_worker_restarted(self):
+        handler = RestApiHandler('http://a/', deferred=True, batch_size=2)
+        self.log.addHandler(handler)
+        parent_worker = handler.worker
+
+        def check():
+            self.log.info('one')
+            self.log.info('two')
+            handler.flush()
+            return {
+                'new_worker': handler.worker is not parent_worker,
+                'alive': handler.worker.is_alive(),
+                'posts': handler.session.post.call_count,
+            }
+
+        self.assertEqual(in_child(check), {
+            'new_worker': True,
+            'alive': True,
+            'posts': 1,
+        })
+
+    def test_metrics_start_over(self):
+        handler = RestApiHandler('http://a/', metrics=True)
+        self.log.addHandler(handler)
+        self.log.info('parent')
+        # as if a parent thread held it while forking
+        handler.metrics.lock.acquire()
+        self.addCleanup(handler.metrics.lock.release)
+
+        def check():
+            self.log.info('child')
+            counters = handler.metrics.snapshot()['counters']
+            return [counters['records'], counters['posts']]
+
+        self.assertEqual(in_child(check), [1, 1])
+
+    @patch('restapi_logging_handler.loggly_handler.atexit')
+    def test_closed_handlers_left_alone(self, atexit):
+        handler = LogglyHandler('TOKEN', 'tag', interval=60)
+        handler.close()
+        self.assertNotIn(handler, _handlers)
+
+        def check():
+            return handler.timer.is_set()
+
+        self.assertTrue(in_child(check))
+
+    @patch('restapi_logging_handler.loggly_handler.atexit')
+    def test_retry_budget_lock_replaced(self, atexit):
+        handler = LogglyHandler('TOKEN', 'tag', interval=60)
+        self.log.addHandler(handler)
+        budget = handler.retry_policy.budget
+        budget.lock.acquire()
+        self.addCleanup(budget.lock.release)
+
+        def check():
+            return budget.withdraw()
+
+        self.assertTrue(in_child(check))
+
+    def test_emit_skips_pid_check(self):
+        handler = RestApiHandler('http://a/')
+        record = logging.LogRecord('fork', logging.INFO, __file__, 1,
+                                   'no pid check', None, None)
+        with patch('restapi_logging_handler.restapi_logging_handler'
+                   '.os.getpid') as getpid:
+            handler.handle(record)
+        self.assertFalse(getpid.called)
+        self.assertEqual(handler.session.post.call_count, 1)
@@ -1,10 +1,27 @@
+from concurrent.futures import Future
 from mock import patch, Mock
 from unittest import TestCase
 import json
 import logging
+import os
+import shutil
+import tempfile
+import threading
 import time
 
 from restapi_logging_handler import LogglyHandler
+from restapi_logging_handler.scheduler import ScheduledCall
+from restapi_logging_handler.spool import readFrames
+
+
+def run_now(delay, function, *args):
+    """
+    A Scheduler.call_later that runs the call straight away.
+    """
+    call = ScheduledCall(0, function, args)
+    call.started = True
+    function(*args)
+    return call
 
 
 class _BaseLogglyHandler(TestCase):
@@ -106,6 +123,271 @@ class TestAcceptsTextTags(_BaseLogglyLoggingHandler):
         cls.log_now('something')
 
 
+class TestLogglyHandlerSplitsBulk(_BaseLogglyHandler):
+    @classmethod
+    def configure(cls):
+        cls.handler = LogglyHandler('LOGGLYKEY', cls.tags, max_bulk_bytes=1000)
+        logging.root.addHandler(cls.handler)
+
+    @classmethod
+    def execute(cls):
+        for i in range(30):
+            logging.warning('%s %s', i, 'x' * 100)
+        cls.flush()
+
+    def test_splits_into_several_posts(self):
+        posts = self.session.return_value.post.call_args_list
+        self.assertGreater(len(posts), 1)
+        for post in posts:
+            self.assertLessEqual(len(post[1]['data']), 1000)
+
+    def test_keeps_every_line_in_order(self):
+        lines = [
+            json.loads(line)['message']
+            for post in self.session.return_value.post.call_args_list
+            for line in post[1]['data'].split('\n')
+        ]
+        self.assertEqual(
+            lines, ['{} {}'.format(i, 'x' * 100) for i in range(30)])
+
+
+class TestLogglyHandlerSingleBulk(_BaseLogglyHandler):
+    @classmethod
+    def configure(cls):
+        cls.handler = LogglyHandler('LOGGLYKEY', cls.tags,
+                                    group_by_thread=False)
+        logging.root.addHandler(cls.handler)
+
+    @classmethod
+    def execute(cls):
+        done = threading.Event()
+        logged = [threading.Event() for i in range(5)]
+
+        def log(i):
+            logging.warning('thread %s', i)
+            logged[i].set()
+            done.wait(5)  # keep thread ids from being reused
+
+        threads = [threading.Thread(target=log, args=(i,)) for i in range(5)]
+        for t in threads:
+            t.start()
+        for event in logged:
+            event.wait(5)
+        cls.flush()
+        done.set()
+        for t in threads:
+            t.join()
+
+    def test_one_post(self):
+        self.assert_post_count_is(1)
+
+    def test_no_thread_tags(self):
+        url = self.session.return_value.post.call_args[0][0]
+        self.assertTrue(url.endswith('/tag/bulk,tag1,tag2/'))
+
+    def test_pid_and_tid_are_fields(self):
+        data = self.session.return_value.post.call_args[1]['data']
+        events = [json.loads(line) for line in data.split('\n')]
+        self.assertEqual(len(events), 5)
+        self.assertEqual(len(set(e['tid'] for e in events)), 5)
+        for event in events:
+            self.assertEqual(event['pid'], 'p-{}'.format(os.getpid()))
+
+
+class TestLogglyHandlerTagFields(_BaseLogglyHandler):
+    @classmethod
+    def configure(cls):
+        cls.handler = LogglyHandler('LOGGLYKEY', cls.tags,
+                                    group_by_thread=False,
+                                    tag_fields=['level', 'log'],
+                                    max_tag_groups=2)
+        logging.root.addHandler(cls.handler)
+
+    @classmethod
+    def execute(cls):
+        logging.getLogger('a.b').warning('one')
+        logging.getLogger('a.b').warning('two')
+        logging.getLogger('a.b').error('three')
+        logging.getLogger('c').error('four')
+        cls.flush()
+
+    def test_post_per_group(self):
+        posts = self.session.return_value.post.call_args_list
+        sent = sorted(
+            (post[0][0].split('/tag/')[1],
+             [json.loads(line)['message']
+              for line in post[1]['data'].split('\n')])
+            for post in posts
+        )
+        self.assertEqual(sent, [
+            ('bulk,tag1,tag2,ERROR,a.b/', ['three']),
+            ('bulk,tag1,tag2,WARNING,a.b/', ['one', 'two']),
+            ('bulk,tag1,tag2/', ['four']),
+        ])
+
+
+class TestLogglyHandlerConcurrentFlush(_BaseLogglyHandler):
+    threads = 8
+    records = 500
+
+    @classmethod
+    def configure(cls):
+        cls.handler = LogglyHandler('LOGGLYKEY', cls.tags,
+                                    group_by_thread=False)
+        cls.handler.timer.set()
+        cls.log = logging.getLogger('concurrent')
+        cls.log.propagate = False
+        cls.log.addHandler(cls.handler)
+
+    @classmethod
+    def execute(cls):
+        def log(n):
+            for i in range(cls.records):
+                cls.log.warning('%s %s', n, i)
+
+        threads = [threading.Thread(target=log, args=(n,))
+                   for n in range(cls.threads)]
+        for t in threads:
+            t.start()
+        while any(t.is_alive() for t in threads):
+            cls.flush()
+        cls.flush()
+        cls.log.removeHandler(cls.handler)
+
+    def test_every_record_sent_once(self):
+        messages = [
+            json.loads(line)['message']
+            for post in self.session.return_value.post.call_args_list
+            for line in post[1]['data'].split('\n')
+        ]
+        self.assertEqual(
+            sorted(messages),
+            sorted('{} {}'.format(n, i) for n in range(self.threads)
+                   for i in range(self.records)))
+
+    def test_handler_lock_not_held(self):
+        record = logging.LogRecord('concurrent', logging.INFO, __file__, 1,
+                                   'message', None, None)
+        self.handler.acquire()
+        try:
+            done = threading.Thread(target=self.handler.handle,
+                                    args=(record,))
+            done.start()
+            done.join(5)
+            self.assertFalse(done.is_alive())
+        finally:
+            self.handler.release()
+
+
+class TestLogglyHandlerFlushTriggers(TestCase):
+    def setUp(self):
+        self.log = logging.getLogger('triggers')
+        self.log.propagate = False
+        self.handlers = []
+
+    def tearDown(self):
+        for handler in self.handlers:
+            self.log.removeHandler(handler)
+            handler.timer.set()
+            handler.wake.set()
+
+    @patch('restapi_logging_handler.loggly_handler.atexit')
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def make_handler(self, session, atexit, **kwargs):
+        self.post = session.return_value.post
+        self.posted = threading.Event()
+        self.post.side_effect = lambda *a, **kw: self.posted.set()
+        handler = LogglyHandler('LOGGLYKEY', ['tag'], **kwargs)
+        self.log.addHandler(handler)
+        self.handlers.append(handler)
+        return handler
+
+    def test_interval(self):
+        self.make_handler(interval=0.05)
+        self.log.warning('soon')
+        self.assertTrue(self.posted.wait(5))
+
+    def test_flush_count_wakes_early(self):
+        self.make_handler(interval=60, flush_count=3)
+        self.log.warning('one')
+        self.log.warning('two')
+        self.assertFalse(self.posted.wait(0.2))
+        self.log.warning('three')
+        self.assertTrue(self.posted.wait(5))
+
+    def test_flush_bytes_wakes_early(self):
+        self.make_handler(interval=60, flush_bytes=1000)
+        self.log.warning('x' * 1000)
+        self.assertTrue(self.posted.wait(5))
+
+    def test_adaptive_interval(self):
+        handler = self.make_handler(interval=1, min_interval=0.25,
+                                    max_interval=4, flush_count=100,
+                                    adaptive=True)
+        self.assertEqual(handler._nextInterval(1, 0, False), 2)
+        self.assertEqual(handler._nextInterval(4, 10, False), 4)
+        self.assertEqual(handler._nextInterval(1, 50, False), 1)
+        self.assertEqual(handler._nextInterval(1, 100, False), 0.5)
+        self.assertEqual(handler._nextInterval(1, 30, True), 0.5)
+        self.assertEqual(handler._nextInterval(0.25, 500, True), 0.25)
+
+
+class TestLogglyHandlerTruncatesEvent(_BaseLogglyHandler):
+    @classmethod
+    def configure(cls):
+        cls.handler = LogglyHandler('LOGGLYKEY', cls.tags, max_event_bytes=500)
+        logging.root.addHandler(cls.handler)
+
+    @classmethod
+    def execute(cls):
+        logging.warning('x' * 2000, extra={'big': 'y' * 2000})
+        logging.warning('small')
+        cls.flush()
+
+    def test_sends_both(self):
+        self.assert_post_count_is(1)
+        data = self.session.return_value.post.call_args[1]['data']
+        self.assertEqual(len(data.split('\n')), 2)
+
+    def test_truncates_big_event(self):
+        data = self.session.return_value.post.call_args[1]['data']
+        line = data.split('\n')[0]
+        self.assertLessEqual(len(line), 500)
+
+        event = json.loads(line)
+        self.assertGreater(event['truncated'], 4000)
+        self.assertTrue(event['message'].endswith('...[truncated]'))
+        self.assertTrue(event['message'].startswith('xxx'))
+        self.assertNotIn('details', event)
+        self.assertEqual(event['level'], 'WARNING')
+
+    def test_leaves_small_event(self):
+        data = self.session.return_value.post.call_args[1]['data']
+        event = json.loads(data.split('\n')[1])
+        self.assertEqual(event['message'], 'small')
+        self.assertNotIn('truncated', event)
+
+
+class TestLogglyHandlerDeferred(_BaseLogglyLoggingHandler):
+    @classmethod
+    def configure(cls):
+        cls.handler = LogglyHandler('LOGGLYKEY', cls.tags, deferred=True)
+        logging.root.addHandler(cls.handler)
+
+    @classmethod
+    def execute(cls):
+        for i in range(10):
+            logging.warning('something %s', i)
+        cls.flush()
+
+    def test_flush_sends_everything_queued(self):
+        self.assert_post_count_is(1)
+        data = self.session.return_value.post.call_args[1]['data']
+        self.assertEqual(
+            [json.loads(line)['message'] for line in data.split('\n')],
+            ['something {}'.format(i) for i in range(10)])
+
+
 class _BaseWebRequestFailure(_BaseLogglyHandler):
     results = [Mock(status_code=200)]
     post_count = 0
@@ -121,13 +403,17 @@ class _BaseWebRequestFailure(_BaseLogglyHandler):
     @classmethod
     def configure(cls):
         super(_BaseWebRequestFailure, cls).configure()
+        # send retries straight away rather than after a backoff
+        cls.handler.scheduler = Mock()
+        cls.handler.scheduler.call_later.side_effect = run_now
 
     @classmethod
     @patch('restapi_logging_handler.loggly_handler.sys.stderr.write')
     def execute(cls, print):
         for index, result in enumerate(cls.results):
             cls.handler.handle_response(
-                Mock(), result, batch=[{}], attempt=index + 1)
+                Mock(), result, batch=['{}'], attempt=index + 1,
+                url='https://logs-01.loggly.com/bulk/')
         cls.stderr_calls = [
             c for c in print.call_args_list
         ]
@@ -177,19 +463,92 @@ class TestMoreThanMaxFailures(TestNoFailure):
             self.stderr_calls[0][0][0])
 
 
-@patch('restapi_logging_handler.loggly_handler.requests.get')
-class TestAwsTagging(TestCase):
-    def test_tag_true(self, mock_get):
-        mock_get.return_value.content = 'id_test'.encode('utf-8')
-
-        loggly = LogglyHandler('token', ['tag'], max_attempts=1, aws_tag=True)
-
-        self.assertEqual(loggly.tags, ['bulk', 'tag', 'id_test'])
+class TestNonRetryableFailure(TestNoFailure):
+    results = [
+        Mock(status_code=400, content='bad'.encode()),
+    ]
+    post_count = 0
+    stderr_count = 1
 
-    def test_tag_false(self, mock_get):
-        mock_get.return_value.content = 'id_test'.encode('utf-8')
 
-        loggly = LogglyHandler('token', ['tag'], max_attempts=1,
-                               aws_tag=False)
+class TestRetryScheduling(_BaseLogglyHandler):
+    @classmethod
+    def configure(cls):
+        super(TestRetryScheduling, cls).configure()
+        cls.handler.scheduler = Mock()
+        cls.handler.scheduler.call_later.return_value = ScheduledCall(
+            0, None, ())
 
-        self.assertEqual(loggly.tags, ['bulk', 'tag'])
+    @classmethod
+    def execute(cls):
+        response = Mock(status_code=429, headers={'Retry-After': '120'})
+        cls.handler.handle_response(Mock(), response, batch=['{}'],
+                                    attempt=1, url='http://loggly/')
+        failed = Mock()
+        failed.cancelled.return_value = False
+        failed.exception.return_value = IOError('connection reset')
+        cls.handler._checkPosted('http://loggly/', ['{}'], 2, failed)
+
+    def test_nothing_posted_before_delay(self):
+        self.assert_post_count_is(0)
+
+    def test_waits_for_retry_after(self):
+        delay, function, url, lines, level, attempt = (
+            self.handler.scheduler.call_later.call_args_list[0][0])
+        self.assertGreaterEqual(delay, 120)
+        self.assertEqual((url, lines, attempt), ('http://loggly/', ['{}'], 2))
+
+    def test_retries_connection_errors(self):
+        delay, function, url, lines, level, attempt = (
+            self.handler.scheduler.call_later.call_args_list[1][0])
+        self.assertLessEqual(delay, 1.0)
+        self.assertEqual(attempt, 3)
+
+
+@patch('restapi_logging_handler.loggly_handler.sys.stderr')
+@patch('restapi_logging_handler.loggly_handler.atexit')
+@patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+class TestFailuresAtClose(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def failed(self, *args, **kwargs):
+        future = Future()
+        future.set_exception(IOError('connection reset'))
+        return future
+
+    def spooled(self):
+        return [frame for name in sorted(os.listdir(self.directory))
+                for frame in readFrames(os.path.join(self.directory, name))]
+
+    def test_final_flush_failure_spooled(self, session, atexit, stderr):
+        session.return_value.post.side_effect = self.failed
+        handler = LogglyHandler('token', 'tag', spool_dir=self.directory)
+        handler.spool_replay.join()
+        handler.handle(logging.makeLogRecord({'name': 'app', 'msg': 'last'}))
+        handler.close()
+
+        self.assertEqual(session.return_value.post.call_count, 1)
+        frame, = self.spooled()
+        self.assertIn(b'"last"', frame[1])
+
+    def test_pending_retry_spooled(self, session, atexit, stderr):
+        handler = LogglyHandler('token', 'tag', spool_dir=self.directory)
+        handler.spool_replay.join()
+        handler._retry('http://loggly/', ['{"a": 1}'], 1, retry_after=60)
+        self.assertEqual(handler.scheduler.pending(), 1)
+        handler.close()
+
+        self.assertEqual(session.return_value.post.call_count, 0)
+        self.assertEqual(self.spooled(), [
+            ('http://loggly/', b'{"a": 1}',
+             {'content-type': 'application/json'})])
+
+    def test_stopped_scheduler_reported(self, session, atexit, stderr):
+        handler = LogglyHandler('token', 'tag')
+        handler.scheduler.stop()
+        handler._retry('http://loggly/', ['{}'], 1, reason='status 503')
+        message = stderr.write.call_args[0][0]
+        self.assertIn('handler closed, post failed status 503', message)
+        handler.close()
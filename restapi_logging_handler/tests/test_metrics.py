@@ -0,0 +1,186 @@
+from concurrent.futures import Future
+from datetime import timedelta
+from unittest import TestCase
+import logging
+import threading
+
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
+
+from restapi_logging_handler import LogglyHandler, RestApiHandler
+from restapi_logging_handler.metrics import Histogram, Metrics
+from restapi_logging_handler.scheduler import ScheduledCall
+
+
+def run_now(delay, function, *args):
+    """
+    A Scheduler.call_later that runs the call straight away.
+    """
+    call = ScheduledCall(0, function, args)
+    call.started = True
+    function(*args)
+    return call
+
+
+def response(status_code, elapsed=0.25):
+    future = Future()
+    future.set_result(Mock(status_code=status_code,
+                           elapsed=timedelta(seconds=elapsed)))
+    return future
+
+
+class TestHistogram(TestCase):
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 2.0):
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 4)
+        self.assertAlmostEqual(snapshot['sum'], 3.05)
+        self.assertEqual(snapshot['buckets'],
+                         [(0.1, 1), (1.0, 3), (float('inf'), 4)])
+
+
+class TestMetrics(TestCase):
+    def test_counters_and_gauges(self):
+        metrics = Metrics()
+        metrics.inc('records')
+        metrics.inc('bytes', 10)
+        metrics.gauge('buffered', lambda: 3)
+        metrics.gauge('broken', lambda: 1 / 0)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {'records': 1, 'bytes': 10})
+        self.assertEqual(snapshot['gauges'], {'buffered': 3, 'broken': None})
+
+    def test_timed(self):
+        metrics = Metrics()
+        double = metrics.timed('serialize_seconds', lambda x: x * 2)
+        self.assertEqual(double(2), 4)
+        self.assertEqual(
+            metrics.snapshot()['histograms']['serialize_seconds']['count'], 1)
+
+    def test_prometheus(self):
+        metrics = Metrics(name='api', buckets=(0.5,))
+        metrics.inc('posts', 2)
+        metrics.gauge('buffered', lambda: 1)
+        metrics.observe('post_seconds', 0.25)
+        text = metrics.prometheus()
+        self.assertIn('# TYPE restapi_logging_posts_total counter', text)
+        self.assertIn('restapi_logging_posts_total{handler="api"} 2', text)
+        self.assertIn('restapi_logging_buffered{handler="api"} 1', text)
+        self.assertIn(
+            'restapi_logging_post_seconds_bucket{handler="api",le="0.5"} 1',
+            text)
+        self.assertIn(
+            'restapi_logging_post_seconds_bucket{handler="api",le="+Inf"} 1',
+            text)
+        self.assertIn('restapi_logging_post_seconds_count{handler="api"} 1',
+                      text)
+
+    def test_export(self):
+        metrics = Metrics()
+        exported = threading.Event()
+        snapshots = []
+
+        def callback(snapshot):
+            snapshots.append(snapshot)
+            exported.set()
+
+        stopped = metrics.export(0.01, callback)
+        self.assertTrue(exported.wait(5))
+        stopped.set()
+        self.assertIn('counters', snapshots[0])
+
+
+class TestRestApiHandlerMetrics(TestCase):
+    def setUp(self):
+        self.log = logging.getLogger('metrics')
+        self.log.setLevel(logging.DEBUG)
+        self.log.propagate = False
+
+    def add(self, handler):
+        self.log.addHandler(handler)
+        self.addCleanup(self.log.removeHandler, handler)
+        return handler
+
+    def test_off_by_default(self):
+        handler = RestApiHandler('http://endpoint')
+        self.assertIsNone(handler.metrics)
+        self.assertNotIn('flush', vars(handler))
+
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_records_posts(self, session):
+        session.return_value.post.return_value = response(200)
+        handler = self.add(RestApiHandler('http://endpoint', metrics=True))
+        self.log.info('one')
+        self.log.info('two')
+
+        snapshot = handler.metrics.snapshot()
+        self.assertEqual(handler.metrics.name, 'RestApiHandler')
+        counters = snapshot['counters']
+        self.assertEqual(counters['records'], 2)
+        self.assertEqual(counters['posts'], 2)
+        self.assertGreater(counters['bytes'], 0)
+        self.assertNotIn('post_errors', counters)
+        histograms = snapshot['histograms']
+        for name in ('emit_seconds', 'serialize_seconds', 'post_seconds',
+                     'http_seconds'):
+            self.assertEqual(histograms[name]['count'], 2, name)
+        self.assertAlmostEqual(histograms['http_seconds']['sum'], 0.5)
+
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_records_errors(self, session):
+        failed = Future()
+        failed.set_exception(IOError('down'))
+        session.return_value.post.side_effect = [response(500), failed]
+        handler = self.add(RestApiHandler('http://endpoint', metrics=True))
+        self.log.info('one')
+        self.log.info('two')
+        self.assertEqual(
+            handler.metrics.snapshot()['counters']['post_errors'], 2)
+
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_batch_gauges(self, session):
+        session.return_value.post.return_value = response(200)
+        metrics = Metrics(name='batched')
+        handler = self.add(RestApiHandler('http://endpoint', batch_size=10,
+                                          metrics=metrics))
+        self.log.info('one')
+        self.assertEqual(metrics.snapshot()['gauges'],
+                         {'buffered': 1, 'dropped': 0})
+
+        handler.flush()
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['gauges']['buffered'], 0)
+        self.assertEqual(snapshot['counters']['batches'], 1)
+        self.assertEqual(snapshot['histograms']['flush_seconds']['count'], 1)
+
+
+class TestLogglyHandlerMetrics(TestCase):
+    @patch('restapi_logging_handler.loggly_handler.sys.stderr')
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_retries_and_failures(self, session, stderr):
+        def post(*args, **kwargs):
+            failed = Future()
+            failed.set_exception(IOError('down'))
+            return failed
+
+        session.return_value.post.side_effect = post
+        handler = LogglyHandler('token', 'tag', max_attempts=2,
+                                metrics=True)
+        handler.scheduler = Mock()
+        handler.scheduler.call_later.side_effect = run_now
+        self.addCleanup(handler.close)
+
+        handler.handle(logging.makeLogRecord({'name': 'app', 'msg': 'one'}))
+        self.assertEqual(handler.metrics.snapshot()['gauges']['buffered'], 1)
+        handler.flush()
+
+        snapshot = handler.metrics.snapshot()
+        self.assertEqual(handler.metrics.name, 'LogglyHandler')
+        self.assertEqual(snapshot['gauges']['buffered'], 0)
+        self.assertEqual(snapshot['counters']['retries'], 2)
+        self.assertEqual(snapshot['counters']['records_failed'], 1)
+        self.assertEqual(snapshot['counters']['post_errors'], 3)
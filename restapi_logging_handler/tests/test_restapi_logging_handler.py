@@ -1,6 +1,8 @@
 import json
 import uuid
 import datetime
+import threading
+import time
 
 try:
     from unittest.mock import patch
@@ -92,7 +94,7 @@ class TestRestApiHandler(TestCase):
 
         self.assertEqual(
             details,
-            {'this': '1', 'that': 'null', }
+            {'this': 1, 'that': None, }
         )
 
     def test_logging_uuid(self):
@@ -112,7 +114,7 @@ class TestRestApiHandler(TestCase):
 
         self.assertEqual(
             details,
-            {'this': '"{}"'.format(str(random_id))}
+            {'this': str(random_id)}
         )
 
     def test_logging_datetime(self):
@@ -133,7 +135,7 @@ class TestRestApiHandler(TestCase):
         self.assertEqual(
             details,
             {
-                'this': '"{}"'.format(random_date.isoformat(sep='T'))}
+                'this': random_date.isoformat(sep='T')}
         )
 
     def test_logging_thing(self):
@@ -157,14 +159,49 @@ class TestRestApiHandler(TestCase):
         details = payload.pop('details')
 
         thing = details.pop('this')
-        self.assertEqual(json.loads(thing),
-                         {"thing1": "Fred", "thing2": "Jerry"})
+        self.assertEqual(thing, {"thing1": "Fred", "thing2": "Jerry"})
 
         self.assertEqual(
             details,
-            {'that': 'null'}
+            {'that': None}
         )
 
+    def test_record_is_not_changed(self):
+        record = logging.makeLogRecord({
+            'name': 'testing',
+            'msg': 'test %s',
+            'args': ('message',),
+            'levelname': 'INFO',
+            'levelno': logging.INFO,
+            'extra_key': 'extra',
+        })
+        before = dict(record.__dict__)
+
+        first = self.handler._getPayload(record)
+        second = self.handler._getPayload(record)
+
+        self.assertEqual(record.__dict__, before)
+        self.assertEqual(first, second)
+        self.assertEqual(first['pid'], 'p-{}'.format(record.process))
+        self.assertEqual(first['tid'], 't-{}'.format(record.thread))
+        self.assertEqual(first['message'], 'test message')
+        self.assertEqual(first['details'], {'extra_key': 'extra'})
+
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_custom_ignored_keys(self, session):
+        handler = RestApiHandler('endpoint/url',
+                                 ignored_record_keys={'msg', 'args'})
+        record = logging.makeLogRecord({'name': 'testing', 'msg': 'hi'})
+
+        payload = handler._getPayload(record)
+
+        self.assertEqual(payload['log'], 'testing')
+        self.assertEqual(payload['meta']['line'], record.lineno)
+        self.assertNotIn('msg', payload['details'])
+        self.assertNotIn('process', payload['details'])
+        self.assertNotIn('thread', payload['details'])
+        self.assertIn('pathname', payload['details'])
+
     def test_ignored_record_keys(self):
 
         self.assertEqual(
@@ -221,3 +258,244 @@ class TestRestApiHandler(TestCase):
                 'message',
             }
         )
+
+
+class TestRestApiHandlerBatching(TestCase):
+    def setUp(self):
+        self.log = logging.getLogger('batching')
+        self.log.setLevel(logging.DEBUG)
+        self.log.propagate = False
+
+    def tearDown(self):
+        for handler in list(self.log.handlers):
+            self.log.removeHandler(handler)
+            handler.close()
+
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def make_handler(self, session, **kwargs):
+        self.session = session
+        handler = RestApiHandler('endpoint/url', **kwargs)
+        self.log.addHandler(handler)
+        return handler
+
+    def posted(self):
+        return [c[1] for c in self.session.return_value.post.call_args_list]
+
+    def test_not_batching_by_default(self):
+        handler = self.make_handler()
+        self.assertFalse(handler.batching)
+        self.log.info('one')
+        self.log.info('two')
+        self.assertEqual(len(self.posted()), 2)
+
+    def test_flushes_on_count(self):
+        self.make_handler(batch_size=3)
+        for i in range(7):
+            self.log.info('message %s', i)
+
+        posts = self.posted()
+        self.assertEqual(len(posts), 2)
+        for post in posts:
+            lines = post['data'].split('\n')
+            self.assertEqual(len(lines), 3)
+            self.assertEqual(
+                post['headers'], {'content-type': 'application/x-ndjson'})
+        messages = [json.loads(line)['message']
+                    for post in posts for line in post['data'].split('\n')]
+        self.assertEqual(messages, ['message {}'.format(i) for i in range(6)])
+
+    def test_flushes_on_bytes(self):
+        handler = self.make_handler(batch_bytes=500)
+        while not self.posted():
+            self.log.info('x' * 50)
+        self.assertEqual(handler.batch, [])
+        self.assertGreaterEqual(len(self.posted()[0]['data']), 500)
+
+    def test_array_format(self):
+        handler = self.make_handler(batch_size=10, batch_format='array')
+        self.log.info('one')
+        self.log.info('two')
+        handler.flush()
+
+        post, = self.posted()
+        self.assertEqual(post['headers'],
+                         {'content-type': 'application/json'})
+        body = json.loads(post['data'])
+        self.assertEqual([d['message'] for d in body], ['one', 'two'])
+
+    def test_flushes_on_interval(self):
+        handler = self.make_handler(batch_interval=0.05)
+        self.log.info('one')
+        self.assertEqual(self.posted(), [])
+        time.sleep(0.2)
+        self.assertEqual(len(self.posted()), 1)
+        handler.close()
+        self.assertTrue(handler.batch_timer.is_set())
+
+    def test_close_sends_remainder(self):
+        handler = self.make_handler(batch_size=10)
+        self.log.info('one')
+        self.log.removeHandler(handler)
+        handler.close()
+        self.assertEqual(len(self.posted()), 1)
+
+    def test_bad_format(self):
+        with self.assertRaises(ValueError):
+            RestApiHandler('endpoint/url', batch_format='xml')
+
+
+class TestRestApiHandlerDeferred(TestCase):
+    def setUp(self):
+        self.log = logging.getLogger('deferred')
+        self.log.setLevel(logging.DEBUG)
+        self.log.propagate = False
+
+    def tearDown(self):
+        for handler in list(self.log.handlers):
+            self.log.removeHandler(handler)
+            handler.close()
+
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def make_handler(self, session, **kwargs):
+        self.session = session
+        handler = RestApiHandler('endpoint/url', deferred=True, **kwargs)
+        self.log.addHandler(handler)
+        return handler
+
+    def posted(self):
+        return [json.loads(c[1]['data'])
+                for c in self.session.return_value.post.call_args_list]
+
+    def test_builds_payload_on_worker(self):
+        handler = self.make_handler()
+        threads = []
+        prep = handler._prepPayload
+
+        def spy(record):
+            threads.append(threading.current_thread())
+            return prep(record)
+
+        handler._prepPayload = spy
+        self.log.info('one')
+        handler.flush()
+
+        self.assertEqual(threads, [handler.worker])
+        self.assertEqual(self.posted()[0]['message'], 'one')
+
+    def hold_worker(self, handler):
+        """
+        Make the worker wait on the returned event before each record.
+        """
+        release = threading.Event()
+        prep = handler._prepPayload
+
+        def held(record):
+            release.wait(5)
+            return prep(record)
+
+        handler._prepPayload = held
+        return release
+
+    def test_message_is_resolved_at_emit(self):
+        handler = self.make_handler()
+        release = self.hold_worker(handler)
+        args = ['before']
+        self.log.info('value %s', args)
+        args[0] = 'after'
+        release.set()
+        handler.flush()
+
+        self.assertEqual(self.posted()[0]['message'], "value ['before']")
+
+    def test_traceback_is_from_the_record(self):
+        handler = self.make_handler()
+        try:
+            raise ValueError('deferred failure')
+        except ValueError:
+            self.log.exception('failed')
+        handler.flush()
+
+        tb = self.posted()[0]['traceback']
+        self.assertTrue(tb.startswith('Traceback'))
+        self.assertIn('ValueError: deferred failure', tb)
+
+    def test_record_is_not_changed(self):
+        handler = self.make_handler()
+        record = logging.makeLogRecord(
+            {'name': 'deferred', 'msg': 'a %s', 'args': ('b',)})
+        handler.handle(record)
+        handler.flush()
+
+        self.assertEqual(record.msg, 'a %s')
+        self.assertEqual(record.args, ('b',))
+
+    def test_bad_args_do_not_raise(self):
+        handler = self.make_handler()
+        self.log.warning('%d items', 'abc')
+        handler.flush()
+
+        payload = self.posted()[0]
+        self.assertEqual(payload['message'], 'could not format')
+        self.assertIn('TypeError', payload['exception'])
+
+    def test_batches_on_worker(self):
+        handler = self.make_handler(batch_size=5)
+        for i in range(10):
+            self.log.info('message %s', i)
+        handler.flush()
+        self.assertEqual(self.session.return_value.post.call_count, 2)
+
+    def test_drops_when_queue_full(self):
+        handler = self.make_handler(max_queue=2)
+        release = self.hold_worker(handler)
+        for i in range(5):
+            self.log.info('message %s', i)
+        release.set()
+        handler.flush()
+        # the worker may have taken one off the queue before blocking
+        self.assertIn(handler.queue_dropped, (2, 3))
+        self.assertEqual(len(self.posted()), 5 - handler.queue_dropped)
+
+    def test_close_stops_worker(self):
+        handler = self.make_handler()
+        worker = handler.worker
+        self.log.info('one')
+        self.log.removeHandler(handler)
+        handler.close()
+
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(len(self.posted()), 1)
+
+
+class TestRestApiHandlerSession(TestCase):
+    def pools(self, session):
+        return [(prefix, adapter._pool_connections, adapter._pool_maxsize)
+                for prefix, adapter in session.adapters.items()]
+
+    def test_pool_matches_workers(self):
+        handler = RestApiHandler('http://a/', max_workers=48)
+        self.assertEqual(self.pools(handler.session), [
+            ('https://', 10, 48),
+            ('http://', 10, 48),
+        ])
+        self.assertEqual(handler.session.executor._max_workers, 48)
+        self.assertEqual(handler.session.headers['Connection'], 'keep-alive')
+        handler.session.close()
+
+    def test_pool_options(self):
+        handler = RestApiHandler('http://a/', pool_connections=2,
+                                 pool_maxsize=4, keep_alive=False)
+        self.assertEqual(self.pools(handler.session), [
+            ('https://', 2, 4),
+            ('http://', 2, 4),
+        ])
+        self.assertEqual(handler.session.headers['Connection'], 'close')
+        handler.session.close()
+
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def test_posts_with_timeout(self, session):
+        handler = RestApiHandler('http://a/', timeout=(1, 2))
+        handler.emit(logging.LogRecord('session', logging.INFO, __file__, 1,
+                                       'message', None, None))
+        self.assertEqual(
+            session.return_value.post.call_args[1]['timeout'], (1, 2))
@@ -0,0 +1,108 @@
+from unittest import TestCase
+import threading
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from restapi_logging_handler.retry import (
+    RetryBudget,
+    RetryPolicy,
+    parse_retry_after,
+)
+from restapi_logging_handler.scheduler import Scheduler
+
+
+class TestParseRetryAfter(TestCase):
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after('30'), 30.0)
+
+    def test_http_date(self):
+        self.assertEqual(
+            parse_retry_after('Thu, 01 Jan 1970 00:01:40 GMT', now=40), 60.0)
+
+    def test_past_date(self):
+        self.assertEqual(
+            parse_retry_after('Thu, 01 Jan 1970 00:01:40 GMT', now=400), 0.0)
+
+    def test_missing_or_unreadable(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after(''))
+        self.assertIsNone(parse_retry_after('soon'))
+
+
+class TestRetryPolicy(TestCase):
+    def test_retryable(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.retryable(503))
+        self.assertTrue(policy.retryable(429))
+        self.assertTrue(policy.retryable(None))
+        self.assertFalse(policy.retryable(400))
+        self.assertFalse(policy.retryable(403))
+
+    def test_backoff_doubles_up_to_max(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5, jitter=False)
+        self.assertEqual([policy.delay(a) for a in range(1, 6)],
+                         [1, 2, 4, 5, 5])
+
+    @patch('restapi_logging_handler.retry.random.uniform')
+    def test_jitter(self, uniform):
+        uniform.return_value = 0.25
+        policy = RetryPolicy(base_delay=1)
+        self.assertEqual(policy.delay(3), 0.25)
+        uniform.assert_called_once_with(0, 4)
+
+    def test_retry_after_wins(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5)
+        self.assertEqual(policy.delay(1, retry_after=60), 60)
+
+
+class TestRetryBudget(TestCase):
+    def test_exhausted(self):
+        budget = RetryBudget(min_per_second=0, max_tokens=2)
+        self.assertEqual([budget.withdraw() for i in range(3)],
+                         [True, True, False])
+        self.assertEqual(budget.exhausted, 1)
+
+    def test_deposits(self):
+        budget = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=2)
+        budget.tokens = 0
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+
+class TestScheduler(TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler()
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def test_runs_in_order_of_delay(self):
+        ran = []
+        done = threading.Event()
+        self.scheduler.call_later(0.05, ran.append, 'later')
+        self.scheduler.call_soon(ran.append, 'soon')
+        self.scheduler.call_later(0.1, done.set)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(ran, ['soon', 'later'])
+
+    def test_cancel(self):
+        ran = []
+        done = threading.Event()
+        self.scheduler.call_soon(ran.append, 'cancelled').cancel()
+        self.scheduler.call_later(0.01, done.set)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(ran, [])
+
+    def test_stop_drops_pending(self):
+        ran = []
+        self.scheduler.call_later(60, ran.append, 'never')
+        self.assertEqual(self.scheduler.pending(), 1)
+        self.scheduler.stop()
+        self.assertEqual(self.scheduler.pending(), 0)
+        self.scheduler.call_soon(ran.append, 'never')
+        self.assertEqual(ran, [])
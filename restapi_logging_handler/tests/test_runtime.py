@@ -0,0 +1,149 @@
+from unittest import TestCase
+import json
+import logging
+import threading
+import time
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from restapi_logging_handler import LogglyHandler, RestApiHandler
+from restapi_logging_handler.runtime import SharedRuntime
+from restapi_logging_handler.sampling import SamplingRule
+
+
+class _BaseRuntime(TestCase):
+    @patch('restapi_logging_handler.runtime.atexit')
+    @patch('restapi_logging_handler.runtime.FuturesSession')
+    def setUp(self, session, atexit):
+        self.runtime = SharedRuntime(max_workers=4)
+        self.post = session.return_value.post
+        self.posted = threading.Event()
+        self.post.side_effect = lambda *a, **kw: self.posted.set()
+        self.log = logging.getLogger('runtime')
+        self.log.setLevel(logging.DEBUG)
+        self.log.propagate = False
+        self.handlers = []
+
+    def tearDown(self):
+        for handler in self.handlers:
+            self.log.removeHandler(handler)
+            handler.close()
+        self.runtime.close()
+
+    def add(self, handler):
+        self.log.addHandler(handler)
+        self.handlers.append(handler)
+        return handler
+
+    def messages(self):
+        return sorted(
+            json.loads(line)['message']
+            for c in self.post.call_args_list
+            for line in c[1]['data'].split('\n')
+        )
+
+
+class TestSharedRuntime(_BaseRuntime):
+    def test_shares_session(self):
+        first = self.add(RestApiHandler('http://a/', runtime=self.runtime))
+        second = self.add(LogglyHandler('TOKEN', 'tag', runtime=self.runtime))
+        self.assertIs(first.session, self.runtime.session)
+        self.assertIs(second.session, self.runtime.session)
+        self.assertIs(second.scheduler, self.runtime.scheduler)
+
+    def test_no_thread_per_handler(self):
+        before = threading.active_count()
+        for i in range(20):
+            self.add(LogglyHandler('TOKEN', 'tag', runtime=self.runtime,
+                                   deferred=True))
+        # at most the scheduler thread was started
+        self.assertLessEqual(threading.active_count(), before + 1)
+
+    def test_deferred_handlers_share_dispatcher(self):
+        handlers = [
+            self.add(RestApiHandler('http://{}/'.format(i), batch_size=1000,
+                                    deferred=True, runtime=self.runtime))
+            for i in range(3)
+        ]
+        for i in range(250):
+            self.log.info('%s', i)
+        for handler in handlers:
+            self.assertIsNone(handler.worker)
+            handler.flush()
+        self.assertEqual(self.post.call_count, 3)
+        self.assertEqual(self.messages(),
+                         sorted([str(i) for i in range(250)] * 3))
+
+    def test_batch_interval_on_scheduler(self):
+        self.add(RestApiHandler('http://a/', batch_interval=0.05,
+                                runtime=self.runtime))
+        self.log.info('later')
+        self.assertTrue(self.posted.wait(5))
+        self.assertEqual(self.messages(), ['later'])
+
+    def test_loggly_interval_on_scheduler(self):
+        self.add(LogglyHandler('TOKEN', 'tag', interval=0.05,
+                               runtime=self.runtime))
+        self.log.info('later')
+        self.assertTrue(self.posted.wait(5))
+
+    def test_loggly_wakes_early(self):
+        self.add(LogglyHandler('TOKEN', 'tag', interval=60, flush_count=2,
+                               runtime=self.runtime))
+        self.log.info('one')
+        self.assertFalse(self.posted.wait(0.2))
+        self.log.info('two')
+        self.assertTrue(self.posted.wait(5))
+
+    def test_wake_while_flushing_keeps_one_timer(self):
+        handler = self.add(LogglyHandler('TOKEN', 'tag', interval=60,
+                                         runtime=self.runtime))
+        flushed = []
+        done = threading.Event()
+
+        def flush():
+            flushed.append(1)
+            if len(flushed) == 1:
+                handler._wakeFlush()
+            else:
+                done.set()
+            return 0
+
+        handler.flush = flush
+        handler._wakeFlush()
+        self.assertTrue(done.wait(5))
+        # let the second flush schedule the next
+        time.sleep(0.1)
+        self.assertEqual(len(flushed), 2)
+        self.assertEqual(self.runtime.scheduler.pending(), 1)
+
+    def test_close_flushes_handlers(self):
+        self.add(LogglyHandler('TOKEN', 'tag', interval=60,
+                               runtime=self.runtime))
+        self.log.info('at exit')
+        self.runtime.close()
+        self.assertEqual(self.messages(), ['at exit'])
+
+    def test_close_sends_repeats_and_summary(self):
+        self.add(LogglyHandler('TOKEN', 'tag', interval=60,
+                               aggregate_window=60,
+                               sampling=[SamplingRule('runtime.noisy',
+                                                      sample_rate=0.0)],
+                               runtime=self.runtime))
+        for i in range(3):
+            self.log.info('again')
+        noisy = self.log.getChild('noisy')
+        noisy.info('dropped')
+        noisy.info('dropped')
+        self.runtime.close()
+
+        events = [json.loads(line)
+                  for c in self.post.call_args_list
+                  for line in c[1]['data'].split('\n')]
+        self.assertEqual(sorted(e['message'] for e in events),
+                         ['again', 'again', 'suppressed 2 records'])
+        self.assertEqual(sorted(e.get('count', 0) for e in events),
+                         [0, 0, 2])
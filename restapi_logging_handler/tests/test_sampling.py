@@ -0,0 +1,173 @@
+from unittest import TestCase
+import json
+import logging
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from restapi_logging_handler import LogglyHandler, RestApiHandler
+from restapi_logging_handler.sampling import (
+    SUMMARY_LOGGER,
+    Sampler,
+    SamplingRule,
+    TokenBucket,
+)
+
+
+def record(name='app', level=logging.WARNING, msg='noisy'):
+    return logging.makeLogRecord({
+        'name': name,
+        'levelno': level,
+        'levelname': logging.getLevelName(level),
+        'msg': msg,
+    })
+
+
+class TestTokenBucket(TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=2, burst=3, now=0)
+        self.assertEqual([bucket.take(0) for i in range(4)],
+                         [True, True, True, False])
+        self.assertTrue(bucket.take(0.5))
+        self.assertFalse(bucket.take(0.5))
+
+
+class TestSamplingRule(TestCase):
+    def test_matches_logger_and_children(self):
+        rule = SamplingRule('app.db')
+        self.assertTrue(rule.matches('app.db', logging.INFO))
+        self.assertTrue(rule.matches('app.db.pool', logging.INFO))
+        self.assertFalse(rule.matches('app.dbx', logging.INFO))
+        self.assertFalse(rule.matches('app', logging.INFO))
+
+    def test_matches_up_to_level(self):
+        rule = SamplingRule(level=logging.INFO)
+        self.assertTrue(rule.matches('app', logging.DEBUG))
+        self.assertFalse(rule.matches('app', logging.WARNING))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, SamplingRule, sample_rate=2)
+        self.assertRaises(ValueError, SamplingRule, rate_limit=0)
+
+
+class TestSampler(TestCase):
+    def test_unmatched_kept(self):
+        sampler = Sampler([SamplingRule('other', sample_rate=0)])
+        self.assertTrue(sampler.allow(record()))
+        self.assertEqual(sampler.summary(), {})
+
+    def test_sample_rate(self):
+        sampler = Sampler([SamplingRule(sample_rate=0.25)])
+        with patch('restapi_logging_handler.sampling.random.random',
+                   side_effect=[0.1, 0.3, 0.2, 0.9]):
+            kept = [sampler.allow(record()) for i in range(4)]
+        self.assertEqual(kept, [True, False, True, False])
+        self.assertEqual(sampler.summary(), {'app WARNING': 2})
+        self.assertEqual(sampler.summary(), {})
+
+    def test_rate_limit_per_logger_and_level(self):
+        sampler = Sampler([SamplingRule(rate_limit=1, burst=2)])
+        with patch('restapi_logging_handler.sampling.time.time',
+                   return_value=100.0):
+            kept = [sampler.allow(record()) for i in range(5)]
+            self.assertTrue(sampler.allow(record(name='other')))
+            self.assertTrue(sampler.allow(record(level=logging.INFO)))
+        self.assertEqual(kept, [True, True, False, False, False])
+        self.assertEqual(sampler.summary(), {'app WARNING': 3})
+
+    def test_errors_always_kept(self):
+        sampler = Sampler([SamplingRule(level=logging.CRITICAL,
+                                        sample_rate=0)])
+        self.assertTrue(sampler.allow(record(level=logging.ERROR)))
+        self.assertTrue(sampler.allow(record(level=logging.CRITICAL)))
+        self.assertFalse(sampler.allow(record(level=logging.WARNING)))
+
+    def test_most_specific_rule_first(self):
+        sampler = Sampler([SamplingRule('app', sample_rate=0),
+                           SamplingRule('app.db', sample_rate=1)])
+        self.assertTrue(sampler.allow(record(name='app.db')))
+        self.assertFalse(sampler.allow(record(name='app.web')))
+
+    def test_summary_record(self):
+        sampler = Sampler([SamplingRule(sample_rate=0)])
+        self.assertIsNone(sampler.summary_record())
+        sampler.allow(record())
+        sampler.allow(record(name='other', level=logging.INFO))
+        summary = sampler.summary_record()
+        self.assertEqual(summary.name, SUMMARY_LOGGER)
+        self.assertEqual(summary.levelno, logging.WARNING)
+        self.assertEqual(summary.getMessage(), 'suppressed 2 records')
+        self.assertEqual(summary.suppressed,
+                         {'app WARNING': 1, 'other INFO': 1})
+        # summaries are never suppressed themselves
+        self.assertTrue(sampler.allow(summary))
+
+
+@patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+class TestRestApiHandlerSampling(TestCase):
+    def setUp(self):
+        self.log = logging.getLogger('sampled')
+        self.log.setLevel(logging.DEBUG)
+        self.log.propagate = False
+
+    def tearDown(self):
+        for handler in list(self.log.handlers):
+            self.log.removeHandler(handler)
+
+    def posted(self, session):
+        return [json.loads(call[1]['data'])
+                for call in session.return_value.post.call_args_list]
+
+    def test_suppressed_before_payload(self, session):
+        handler = RestApiHandler(
+            'http://endpoint', sampling=[SamplingRule(sample_rate=0)],
+            metrics=True)
+        self.log.addHandler(handler)
+        with patch.object(handler, '_getPayload') as get_payload:
+            self.log.warning('dropped')
+        get_payload.assert_not_called()
+        self.assertEqual(
+            handler.metrics.snapshot()['counters']['suppressed'], 1)
+        handler.summary_timer.set()
+
+    def test_summary_sent_at_close(self, session):
+        handler = RestApiHandler(
+            'http://endpoint', sampling=[SamplingRule('sampled',
+                                                      rate_limit=1)])
+        self.log.addHandler(handler)
+        for i in range(5):
+            self.log.warning('noisy')
+        self.log.error('kept')
+        handler.close()
+
+        payloads = self.posted(session)
+        self.assertEqual([p['message'] for p in payloads],
+                         ['noisy', 'kept', 'suppressed 4 records'])
+        self.assertEqual(payloads[-1]['log'], SUMMARY_LOGGER)
+        self.assertEqual(payloads[-1]['details']['suppressed'],
+                         {'sampled WARNING': 4})
+
+    def test_summary_timer(self, session):
+        handler = RestApiHandler(
+            'http://endpoint', sampling=[SamplingRule(sample_rate=0)],
+            sampling_summary_interval=0.01)
+        self.log.addHandler(handler)
+        with patch.object(handler, '_logSuppressed') as log_suppressed:
+            log_suppressed.side_effect = lambda: handler.summary_timer.set()
+            self.log.info('dropped')
+            handler.summary_timer.wait(5)
+        self.assertTrue(log_suppressed.called)
+
+    def test_loggly_summary_flushed_at_close(self, session):
+        handler = LogglyHandler('token', 'tag',
+                                sampling=[SamplingRule(sample_rate=0)])
+        self.log.addHandler(handler)
+        self.log.info('dropped')
+        with patch.object(handler, '_sendBulk') as send_bulk:
+            handler.close()
+        lines = [json.loads(line) for call in send_bulk.call_args_list
+                 for line in call[0][1]]
+        self.assertEqual([line['message'] for line in lines],
+                         ['suppressed 1 records'])
@@ -0,0 +1,152 @@
+from functools import partial
+from unittest import TestCase, skipIf
+import datetime
+import decimal
+import json
+import uuid
+
+from restapi_logging_handler import serialization
+from restapi_logging_handler.serialization import (
+    Serializer,
+    get_encoder,
+    serialize,
+    utf8_len,
+)
+
+
+class Thing(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class LongText(object):
+    __slots__ = ()
+
+    def __str__(self):
+        return 'x' * 100
+
+
+class Unprintable(object):
+    __slots__ = ()
+
+    def __str__(self):
+        raise ValueError('no')
+
+
+class TestSerializer(TestCase):
+    def setUp(self):
+        self.serializer = Serializer(max_depth=3, max_items=5, max_string=40)
+
+    def test_native_types_pass_through(self):
+        for value in ('text', 1, 1.5, True, None):
+            self.assertIs(self.serializer(value), value)
+
+    def test_containers(self):
+        self.assertEqual(
+            self.serializer({'a': [1, (2, 3)], 1: {'b': None}}),
+            {'a': [1, [2, 3]], 1: {'b': None}})
+
+    def test_known_types(self):
+        moment = datetime.datetime(2020, 1, 2, 3, 4, 5)
+        random_id = uuid.uuid4()
+        self.assertEqual(self.serializer(moment), '2020-01-02T03:04:05')
+        self.assertEqual(self.serializer(moment.date()), '2020-01-02')
+        self.assertEqual(self.serializer(random_id), str(random_id))
+        self.assertEqual(self.serializer(decimal.Decimal('1.10')), '1.10')
+        self.assertEqual(self.serializer(b'bytes'), 'bytes')
+        self.assertEqual(self.serializer(ValueError('bad')),
+                         "ValueError('bad')")
+
+    def test_object_attributes(self):
+        self.assertEqual(self.serializer(Thing(a=1, b=Thing(c=2))),
+                         {'a': 1, 'b': {'c': 2}})
+
+    def test_depth_limit(self):
+        nested = Thing(a=Thing(b=Thing(c=Thing(d=1))))
+        self.assertEqual(self.serializer(nested),
+                         {'a': {'b': {'c': '<Thing nested too deep>'}}})
+
+    def test_size_limit(self):
+        self.assertEqual(
+            self.serializer(Thing(**{str(i): i for i in range(8)})),
+            {'0': 0, '1': 1, '2': 2, '3': 3, '4': 4, '__truncated__': 3})
+        self.assertEqual(self.serializer(list(range(8))),
+                         [0, 1, 2, 3, 4, '... 3 more'])
+
+    def test_string_limit(self):
+        self.assertEqual(self.serializer(LongText()), 'x' * 40 + '...')
+
+    def test_unprintable(self):
+        self.assertTrue(
+            self.serializer(Unprintable()).startswith('unknown obj'))
+
+    def test_caches_handler_per_type(self):
+        self.serializer(Thing())
+        self.serializer(uuid.uuid4())
+        self.assertIn(Thing, self.serializer.cache)
+        self.assertIn(uuid.UUID, self.serializer.cache)
+
+    def test_custom_handler(self):
+        serializer = Serializer(
+            handlers={Thing: lambda s, obj, depth: 'a thing'})
+        self.assertEqual(serializer([Thing()]), ['a thing'])
+
+    def test_json_default_hook(self):
+        self.assertEqual(
+            json.loads(json.dumps({'t': Thing(a=1)}, default=serialize)),
+            {'t': {'a': 1}})
+
+
+class TestGetEncoder(TestCase):
+    payload = {
+        'message': u'café http://x/y',
+        'meta': {'created': 1.5, 'line': 10},
+        'details': {'when': datetime.datetime(2020, 1, 2, 3, 4, 5),
+                    'thing': Thing(a=1)},
+    }
+
+    def assert_equivalent(self, encode):
+        self.assertEqual(json.loads(encode(self.payload)),
+                         json.loads(json.dumps(self.payload,
+                                               default=serialize)))
+
+    def test_auto(self):
+        self.assert_equivalent(get_encoder())
+
+    def test_stdlib_is_unchanged(self):
+        self.assertEqual(get_encoder('json')(self.payload),
+                         json.dumps(self.payload, default=serialize))
+
+    @skipIf(serialization.orjson is None, 'orjson not installed')
+    def test_orjson(self):
+        encode = get_encoder('orjson')
+        self.assert_equivalent(encode)
+        self.assertEqual(encode({1: 'a'}), '{"1":"a"}')
+
+    @skipIf(serialization.ujson is None, 'ujson not installed')
+    def test_ujson(self):
+        self.assert_equivalent(get_encoder('ujson'))
+
+    def test_callable(self):
+        encode = get_encoder(partial(json.dumps, sort_keys=True))
+        self.assertEqual(encode({'b': 1, 'a': uuid.UUID(int=0)}),
+                         '{"a": "00000000-0000-0000-0000-000000000000", '
+                         '"b": 1}')
+
+    def test_callable_returning_bytes(self):
+        encode = get_encoder(lambda obj, default: b'{}')
+        self.assertEqual(encode({}), '{}')
+
+    def test_falls_back_to_stdlib(self):
+        def fails(obj, default):
+            raise TypeError('not today')
+
+        self.assertEqual(get_encoder(fails)({'a': 1}), '{"a": 1}')
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            get_encoder('simplejson')
+
+    def test_utf8_len(self):
+        self.assertEqual(utf8_len('abc'), 3)
+        self.assertEqual(utf8_len(u'café'), 5)
@@ -0,0 +1,227 @@
+from unittest import TestCase
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
+
+from restapi_logging_handler import LogglyHandler
+from restapi_logging_handler.spool import DiskSpool, readFrames
+
+
+def append_from_process(directory, count):
+    spool = DiskSpool(directory, segment_bytes=200)
+    for i in range(count):
+        spool.append('url', 'from {} {}'.format(os.getpid(), i), {})
+    spool.close()
+
+
+class _BaseSpool(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = DiskSpool(self.directory, max_bytes=10000,
+                               segment_bytes=500)
+
+    def tearDown(self):
+        self.spool.close()
+        shutil.rmtree(self.directory)
+
+    def names(self):
+        return sorted(os.listdir(self.directory))
+
+    def replay_all(self, spool=None):
+        sent = []
+
+        def send(url, data, headers):
+            sent.append((url, data, headers))
+            return True
+
+        (spool or self.spool).replay(send)
+        return sent
+
+
+class TestSpoolStorage(_BaseSpool):
+    def test_round_trip(self):
+        self.spool.append('http://a/', 'text body', {'content-type': 'x'})
+        self.spool.append('http://b/', b'\x1f\x8b bytes', {})
+        self.spool.close()
+
+        path = os.path.join(self.directory, self.names()[0])
+        self.assertEqual(list(readFrames(path)), [
+            ('http://a/', b'text body', {'content-type': 'x'}),
+            ('http://b/', b'\x1f\x8b bytes', {}),
+        ])
+
+    def test_open_segment_until_closed(self):
+        self.spool.append('url', 'body', {})
+        self.assertTrue(self.names()[0].endswith('.seg.open'))
+        self.spool.close()
+        self.assertTrue(self.names()[0].endswith('.seg'))
+
+    def test_rotates_segments(self):
+        for i in range(20):
+            self.spool.append('url', 'x' * 100, {})
+        self.assertGreater(len(self.names()), 3)
+
+    def test_evicts_oldest(self):
+        for i in range(200):
+            self.spool.append('url', '{:05d}'.format(i) + 'x' * 95, {})
+        self.spool.close()
+
+        self.assertLessEqual(self.spool.size(), 10000)
+        self.assertGreater(self.spool.evicted, 0)
+        bodies = [data for url, data, headers in self.replay_all()]
+        self.assertEqual(bodies[-1][:5], b'00199')
+        self.assertNotEqual(bodies[0][:5], b'00000')
+
+    def test_keeps_files_of_live_processes(self):
+        live = os.getppid()
+        names = ['{:020d}-{}-0.seg.open'.format(1, live),
+                 '{:020d}-1-0.seg.{}.replay'.format(2, live)]
+        for name in names:
+            with open(os.path.join(self.directory, name), 'wb') as f:
+                f.write(b'x' * 4000)
+        for i in range(100):
+            self.spool.append('url', 'x' * 100, {})
+        self.spool.close()
+
+        self.assertGreater(self.spool.evicted, 0)
+        for name in names:
+            self.assertIn(name, self.names())
+
+    def test_lists_only_when_over(self):
+        with patch.object(self.spool, '_listing',
+                          wraps=self.spool._listing) as listing:
+            for i in range(50):
+                self.spool.append('url', 'x' * 100, {})
+            self.assertEqual(listing.call_count, 1)
+            for i in range(100):
+                self.spool.append('url', 'x' * 100, {})
+            self.assertGreater(listing.call_count, 1)
+        self.assertLessEqual(self.spool.size(), 10000)
+
+    def test_segment_removed_meanwhile(self):
+        self.spool.append('url', 'body', {})
+        os.remove(self.spool.segment)
+        self.spool.close()
+        self.assertEqual(self.names(), [])
+
+    def test_ignores_frame_cut_short(self):
+        self.spool.append('url', 'whole', {})
+        self.spool.append('url', 'cut short', {})
+        path = self.spool.segment
+        self.spool.file.truncate(os.path.getsize(path) - 3)
+        self.spool.close()
+
+        self.assertEqual(
+            [data for url, data, headers in self.replay_all()], [b'whole'])
+
+
+class TestSpoolReplay(_BaseSpool):
+    def test_replay_delivers_and_removes(self):
+        for i in range(10):
+            self.spool.append('url', str(i), {})
+        self.spool.close()
+
+        sent = self.replay_all()
+        self.assertEqual([data for url, data, headers in sent],
+                         [str(i).encode() for i in range(10)])
+        self.assertEqual(self.names(), [])
+
+    def test_failure_spools_the_rest_again(self):
+        for i in range(10):
+            self.spool.append('url', str(i), {})
+        self.spool.close()
+
+        def send(url, data, headers):
+            return data != b'5'
+
+        self.assertEqual(self.spool.replay(send), 5)
+        self.spool.close()
+        self.assertEqual([data for url, data, headers in self.replay_all()],
+                         [str(i).encode() for i in range(5, 10)])
+
+    def test_claims_only_once(self):
+        self.spool.append('url', 'body', {})
+        self.spool.close()
+        other = DiskSpool(self.directory)
+
+        self.assertEqual(len(self.spool.claim()), 1)
+        self.assertEqual(other.claim(), [])
+
+    def test_leaves_live_open_segments(self):
+        self.spool.append('url', 'body', {})
+        other = DiskSpool(self.directory)
+        self.assertEqual(other.claim(), [])
+
+    def test_claims_segments_of_dead_processes(self):
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        name = '{:020d}-{}-0.seg.open'.format(1, dead.pid)
+        with open(os.path.join(self.directory, name), 'wb'):
+            pass
+
+        self.assertEqual(len(self.spool.claim()), 1)
+
+    def test_several_processes(self):
+        processes = [
+            multiprocessing.Process(target=append_from_process,
+                                    args=(self.directory, 20))
+            for i in range(3)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+
+        self.assertEqual(len(self.replay_all()), 60)
+
+
+class TestLogglySpool(_BaseSpool):
+    @patch('restapi_logging_handler.loggly_handler.atexit')
+    @patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+    def make_handler(self, session, atexit, status_code=200):
+        self.session = session
+        self.post = session.return_value.post
+        self.post.return_value.result.return_value.status_code = status_code
+        handler = LogglyHandler('LOGGLYKEY', ['tag'], max_attempts=1,
+                                spool_dir=self.directory)
+        handler.timer.set()
+        handler.spool_replay.join()
+        return handler
+
+    def test_spools_after_max_attempts(self):
+        handler = self.make_handler()
+        handler.handle_response(Mock(), Mock(status_code=503),
+                                batch=['{"a": 1}', '{"b": 2}'],
+                                attempt=2, url='http://loggly/')
+        handler.spool.close()
+
+        sent = self.replay_all()
+        self.assertEqual(sent, [('http://loggly/', b'{"a": 1}\n{"b": 2}',
+                                 {'content-type': 'application/json'})])
+
+    def test_replays_at_startup(self):
+        self.spool.append('http://loggly/', 'spooled', {})
+        self.spool.close()
+
+        self.make_handler()
+
+        self.post.assert_called_once_with('http://loggly/', data=b'spooled',
+                                          headers={}, timeout=(5.0, 30.0))
+        self.assertEqual(self.names(), [])
+
+    def test_keeps_spool_when_replay_fails(self):
+        self.spool.append('http://loggly/', 'spooled', {})
+        self.spool.close()
+
+        handler = self.make_handler(status_code=503)
+        handler.spool.close()
+
+        self.assertEqual(len(self.replay_all()), 1)
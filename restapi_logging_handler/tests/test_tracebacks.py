@@ -0,0 +1,149 @@
+from unittest import TestCase
+import json
+import logging
+import sys
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from restapi_logging_handler import RestApiHandler
+from restapi_logging_handler.tracebacks import (
+    TRUNCATED,
+    TracebackFormatter,
+    traceback_key,
+)
+
+
+def fail(message='failed'):
+    raise ValueError(message)
+
+
+def nested(depth, message='failed'):
+    if depth == 0:
+        fail(message)
+    nested(depth - 1, message)
+
+
+def exc_info_of(function, *args):
+    try:
+        function(*args)
+    except Exception:
+        return sys.exc_info()
+
+
+def chained(inner):
+    try:
+        fail(inner)
+    except ValueError:
+        raise KeyError('outer')
+
+
+class TestTracebackKey(TestCase):
+    def test_same_place_same_key(self):
+        keys = [traceback_key(*exc_info_of(fail)) for i in range(2)]
+        self.assertEqual(keys[0], keys[1])
+
+    def test_message_and_place_matter(self):
+        key = traceback_key(*exc_info_of(fail))
+        self.assertNotEqual(key, traceback_key(*exc_info_of(fail, 'other')))
+        self.assertNotEqual(key, traceback_key(*exc_info_of(nested, 1)))
+
+    def test_chained_exceptions_matter(self):
+        first = traceback_key(*exc_info_of(chained, 'a'))
+        self.assertEqual(len(first), 2)
+        self.assertNotEqual(first, traceback_key(*exc_info_of(chained, 'b')))
+
+
+class TestTracebackFormatter(TestCase):
+    def test_cached(self):
+        formatter = TracebackFormatter()
+        with patch('restapi_logging_handler.tracebacks.traceback'
+                   '.format_exception', return_value=['text']) as format:
+            texts = [formatter.format(exc_info_of(fail)) for i in range(3)]
+        self.assertEqual(texts, ['text'] * 3)
+        self.assertEqual(format.call_count, 1)
+        self.assertEqual(formatter.hits, 2)
+
+    def test_cache_bounded(self):
+        formatter = TracebackFormatter(cache_size=2)
+        for message in ('a', 'b', 'c'):
+            formatter.format(exc_info_of(fail, message))
+        self.assertEqual(len(formatter.cache), 2)
+
+    def test_cache_off(self):
+        formatter = TracebackFormatter(cache_size=0)
+        formatter.format(exc_info_of(fail))
+        self.assertEqual(len(formatter.cache), 0)
+
+    def test_exc_text_used(self):
+        formatter = TracebackFormatter()
+        self.assertEqual(formatter.format(exc_info_of(fail), 'formatted'),
+                         'formatted')
+
+    def test_max_frames_keeps_innermost(self):
+        text = TracebackFormatter(max_frames=2).format(
+            exc_info_of(nested, 5))
+        self.assertEqual(text.count('File '), 2)
+        self.assertIn('in fail', text)
+        self.assertIn('ValueError: failed', text)
+
+    def test_max_bytes_keeps_end(self):
+        text = TracebackFormatter(max_bytes=100).format(
+            exc_info_of(nested, 5))
+        self.assertTrue(text.startswith(TRUNCATED))
+        self.assertTrue(text.endswith('ValueError: failed\n'))
+        self.assertLessEqual(len(text.encode('utf-8')), 100)
+
+    def test_chain_formatted(self):
+        text = TracebackFormatter().format(exc_info_of(chained, 'inner'))
+        self.assertIn('ValueError: inner', text)
+        self.assertIn("KeyError: 'outer'", text)
+
+
+@patch('restapi_logging_handler.restapi_logging_handler.FuturesSession')
+class TestRestApiHandlerTracebacks(TestCase):
+    def setUp(self):
+        self.log = logging.getLogger('tracebacks')
+        self.log.setLevel(logging.DEBUG)
+        self.log.propagate = False
+
+    def tearDown(self):
+        for handler in list(self.log.handlers):
+            self.log.removeHandler(handler)
+
+    def traceback(self, session):
+        data = session.return_value.post.call_args[1]['data']
+        return json.loads(data).get('traceback')
+
+    def test_from_record_not_current_exception(self, session):
+        self.log.addHandler(RestApiHandler('http://endpoint'))
+        record = self.log.makeRecord(
+            'tracebacks', logging.ERROR, __file__, 1, 'failed', (),
+            exc_info_of(fail, 'recorded'))
+        try:
+            fail('current')
+        except ValueError:
+            self.log.handle(record)
+        tb = self.traceback(session)
+        self.assertIn('ValueError: recorded', tb)
+        self.assertNotIn('current', tb)
+
+    def test_exc_text_reused(self, session):
+        self.log.addHandler(RestApiHandler('http://endpoint'))
+        record = self.log.makeRecord(
+            'tracebacks', logging.ERROR, __file__, 1, 'failed', (),
+            exc_info_of(fail))
+        record.exc_text = 'already formatted'
+        self.log.handle(record)
+        self.assertEqual(self.traceback(session), 'already formatted')
+
+    def test_limits(self, session):
+        handler = RestApiHandler('http://endpoint', max_traceback_frames=1,
+                                 max_traceback_bytes=1000)
+        handler.handle(self.log.makeRecord(
+            'tracebacks', logging.ERROR, __file__, 1, 'failed', (),
+            exc_info_of(nested, 3)))
+        tb = self.traceback(session)
+        self.assertEqual(tb.count('File '), 1)
@@ -0,0 +1,120 @@
+from __future__ import absolute_import
+
+import collections
+import threading
+import traceback
+
+from restapi_logging_handler.serialization import utf8_len
+
+# starts a traceback cut short to max_bytes
+TRUNCATED = '...[traceback truncated]\n'
+
+
+def _text(value):
+    try:
+        return str(value)
+    except Exception:
+        return '<unprintable {}>'.format(type(value).__name__)
+
+
+def _frames(tb):
+    frames = []
+    while tb is not None:
+        frames.append((tb.tb_frame.f_code, tb.tb_lineno))
+        tb = tb.tb_next
+    return tuple(frames)
+
+
+def traceback_key(exc_type, value, tb):
+    """
+    What the formatted traceback of an exception depends on: the type and
+    text of it and of each exception chained to it, and the code and line of
+    each of their frames. Exceptions raised again from the same place have
+    the same key.
+    """
+    key = [(exc_type, _text(value), _frames(tb))]
+    seen = {id(value)}
+    while True:
+        cause = getattr(value, '__cause__', None)
+        if cause is None and not getattr(value, '__suppress_context__', False):
+            cause = getattr(value, '__context__', None)
+        if cause is None or id(cause) in seen:
+            break
+        seen.add(id(cause))
+        value = cause
+        key.append((type(value), _text(value),
+                    _frames(getattr(value, '__traceback__', None))))
+    return tuple(key)
+
+
+class TracebackFormatter(object):
+    """
+    Formats the tracebacks of records, remembering the last cache_size so
+    the same failure logged again, e.g. by a retry loop, isn't formatted
+    again.
+    """
+
+    def __init__(self, cache_size=256, max_frames=None, max_bytes=None):
+        """
+        cache_size: most tracebacks remembered, 0 to format every one
+        max_frames: most frames formatted of each traceback, the innermost
+            kept, all if None
+        max_bytes: tracebacks over this size keep only their end, and start
+            with TRUNCATED
+        """
+        self.cache_size = cache_size
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+
+    def _format(self, exc_info):
+        limit = -self.max_frames if self.max_frames else None
+        return self._truncate(
+            ''.join(traceback.format_exception(*exc_info, limit=limit)))
+
+    def _truncate(self, text):
+        if self.max_bytes is None or utf8_len(text) <= self.max_bytes:
+            return text
+        keep = max(0, self.max_bytes - len(TRUNCATED))
+        tail = text.encode('utf-8')[-keep:] if keep else b''
+        return TRUNCATED + tail.decode('utf-8', 'ignore')
+
+    def format(self, exc_info, exc_text=None):
+        """
+        exc_info: the record's exc_info tuple
+        exc_text: the record's exc_text, used as it is if a formatter has
+            filled it in already
+
+        returns: the traceback as text
+        """
+        if exc_text:
+            return self._truncate(exc_text)
+        if not self.cache_size:
+            return self._format(exc_info)
+        try:
+            key = traceback_key(*exc_info)
+            hash(key)
+        except TypeError:
+            return self._format(exc_info)
+
+        with self.lock:
+            text = self.cache.pop(key, None)
+            if text is not None:
+                self.cache[key] = text
+                self.hits += 1
+                return text
+        text = self._format(exc_info)
+        with self.lock:
+            self.cache[key] = text
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return text
+
+    def afterFork(self):
+        """
+        Runs in the child after a fork, where the lock may have been held
+        by one of the parent's threads.
+        """
+        self.lock = threading.Lock()
@@ -16,6 +16,16 @@ setup(
     long_description=description,
     packages=['restapi_logging_handler'],
     install_requires=['requests-futures'],
+    extras_require={
+        'zstd': ['zstandard'],
+        'async': ['aiohttp'],
+    },
+    entry_points={
+        'console_scripts': [
+            'restapi-logging-collector='
+            'restapi_logging_handler.collector:main',
+        ],
+    },
     author='RJ Gilligan, Ethan McCreadie, Mikey Reppy',
     author_email='r.j.gilligan@nrg.com, '
                  'ethan.mccreadie@nrg.com, '